@@ -0,0 +1,339 @@
+# address_index.py
+
+"""
+Offline Address Autocomplete Index
+
+Answers partial addresses ("123 main st", "45 oak") within a ZIP code without
+calling the Geocoding API. Known addresses are read from a gazetteer CSV and
+kept in a per-ZIP inverted index:
+
+- only the street part of an address (before the first comma) is indexed,
+  split into normalized tokens ("Street" -> "st", "North" -> "n",
+  punctuation dropped); city, state, ZIP and country would match every
+  address of the ZIP
+- each ZIP holds {token: set of entry ids} plus a sorted token list
+- a query matches the entries containing all of its tokens; the posting
+  sets are intersected smallest first. Words are matched exactly, except an
+  unfinished last word that is not a known word itself, which is matched
+  by prefix with a binary search ("123 mai" -> "main", but "123 main" does
+  not match "123 Mainland Rd")
+- match() answers only when the query names a house number and a street
+  name and exactly one address fits best (fewest words the query did not
+  mention); otherwise the caller asks the geocoder
+
+Addresses the geocoder returns for a ZIP are added to the index as well
+(learn()), so repeated fragments are answered locally after the first miss.
+
+Gazetteer format (CSV with a header row): zip,address,lat,lng
+    10001,"123 Main St, New York, NY 10001, USA",40.7506,-73.9972
+
+Building it from the addresses already in the geocode cache:
+    python address_index.py build geocode_cache.db [addresses.csv]
+"""
+
+import bisect
+import csv
+import json
+import os
+import re
+import sys
+import threading
+
+# Configuration constants
+ADDRESSES_FILE = os.getenv('ADDRESS_INDEX_CSV', 'addresses.csv')
+MAX_LEARNED_ENTRIES = int(os.getenv('ADDRESS_INDEX_MAX_LEARNED', '50000'))
+MAX_RESULTS = 5
+
+# Spelled-out forms mapped to the abbreviations the geocoder returns
+ABBREVIATIONS = {
+    'street': 'st', 'avenue': 'ave', 'av': 'ave', 'road': 'rd', 'drive': 'dr',
+    'boulevard': 'blvd', 'lane': 'ln', 'court': 'ct', 'place': 'pl',
+    'terrace': 'ter', 'highway': 'hwy', 'parkway': 'pkwy', 'circle': 'cir',
+    'square': 'sq', 'north': 'n', 'south': 's', 'east': 'e', 'west': 'w',
+    'northeast': 'ne', 'northwest': 'nw', 'southeast': 'se', 'southwest': 'sw',
+    'apartment': 'apt', 'suite': 'ste',
+}
+
+# Street types, directions and unit words: they narrow a match but never identify a street
+GENERIC_TOKENS = frozenset(ABBREVIATIONS.values())
+
+
+def tokenize(text):
+    """
+    Split an address into normalized tokens.
+
+    "123 North Main Street, Apt 4" -> ['123', 'n', 'main', 'st', 'apt', '4']
+    """
+    words = re.sub(r'[^\w\s]', ' ', (text or '').lower()).split()
+    return [ABBREVIATIONS.get(word, word) for word in words]
+
+
+def street_tokens(address):
+    """Tokens of the street part of an address: "123 Main St, New York, NY" -> ['123', 'main', 'st']."""
+    return tokenize((address or '').split(',')[0])
+
+
+def postal_code(result):
+    """ZIP code of a Geocoding API result, or None."""
+    for component in result.get('address_components', []):
+        if 'postal_code' in component.get('types', []):
+            return component['long_name']
+    return None
+
+
+class _ZipIndex:
+    """Inverted index over the addresses of one ZIP code."""
+
+    __slots__ = ('postings', 'vocabulary', 'vocabulary_dirty')
+
+    def __init__(self):
+        self.postings = {}
+        self.vocabulary = []
+        self.vocabulary_dirty = False
+
+    def add(self, entry_id, tokens):
+        for token in set(tokens):
+            entries = self.postings.get(token)
+            if entries is None:
+                self.postings[token] = entries = set()
+                self.vocabulary_dirty = True
+            entries.add(entry_id)
+
+    def prefix_matches(self, prefix):
+        """Union of the entries of every token starting with prefix."""
+        if self.vocabulary_dirty:
+            self.vocabulary = sorted(self.postings)
+            self.vocabulary_dirty = False
+        matches = set()
+        i = bisect.bisect_left(self.vocabulary, prefix)
+        while i < len(self.vocabulary) and self.vocabulary[i].startswith(prefix):
+            matches |= self.postings[self.vocabulary[i]]
+            i += 1
+        return matches
+
+
+class AddressIndex:
+    """
+    ZIP-scoped autocomplete over known addresses.
+
+    Args:
+        rows (iterable): (zip_code, formatted_address, lat, lng) tuples
+    """
+
+    def __init__(self, rows=()):
+        self._zips = {}
+        self._entries = []             # (formatted_address, lat, lng, zip_code, street token count)
+        self._known = set()            # (zip_code, formatted_address)
+        self._learned = 0
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'ties': 0, 'learned': 0}
+        for zip_code, address, lat, lng in rows:
+            self.add(zip_code, address, lat, lng)
+
+    @classmethod
+    def from_file(cls, path):
+        """Load an index from disk, returning an empty index if the file is missing."""
+        if not os.path.exists(path):
+            print(f"Address index file {path} not found, partial addresses go to the geocoder")
+            return cls()
+        return cls(read_address_rows(path))
+
+    def add(self, zip_code, address, lat, lng, learned=False):
+        """
+        Add one address to a ZIP code's index.
+
+        Args:
+            learned (bool): Address comes from the geocoder, counted against MAX_LEARNED_ENTRIES
+
+        Returns:
+            bool: False if the address was already indexed or the learned limit is reached
+        """
+        zip_code = str(zip_code).strip().zfill(5)
+        tokens = street_tokens(address)
+        with self._lock:
+            if (zip_code, address) in self._known:
+                return False
+            if learned:
+                if self._learned >= MAX_LEARNED_ENTRIES:
+                    return False
+                self._learned += 1
+                self.stats['learned'] += 1
+            self._known.add((zip_code, address))
+            entry_id = len(self._entries)
+            self._entries.append((address, float(lat), float(lng), zip_code, len(set(tokens))))
+            zip_index = self._zips.get(zip_code)
+            if zip_index is None:
+                self._zips[zip_code] = zip_index = _ZipIndex()
+            zip_index.add(entry_id, tokens)
+        return True
+
+    def learn(self, results):
+        """Index the addresses of a Geocoding API 'OK' response, up to MAX_LEARNED_ENTRIES."""
+        for result in results:
+            zip_code = postal_code(result)
+            if not zip_code:
+                continue
+            location = result['geometry']['location']
+            self.add(zip_code, result['formatted_address'], location['lat'], location['lng'], learned=True)
+
+    def _candidates(self, query, zip_code):
+        """
+        Entries of zip_code containing every word of query, best first.
+
+        Returns:
+            list: (words the query did not mention, entry) pairs; empty unless the
+            query has both a house number and a street name
+        """
+        zip_code = str(zip_code).strip().zfill(5) if zip_code else None
+        zip_index = self._zips.get(zip_code) if zip_code else None
+        street = (query or '').split(',')[0]
+        tokens = [token for token in tokenize(street) if token != zip_code]
+        has_number = any(token.isdigit() for token in tokens)
+        has_name = any(not token.isdigit() and token not in GENERIC_TOKENS for token in tokens)
+        if zip_index is None or not has_number or not has_name:
+            return []
+        # "123 mai" is still being typed, "123 mai " and "123 main" are not
+        last_unfinished = bool(re.search(r'\w$', street))
+
+        with self._lock:
+            candidate_sets = []
+            for i, token in enumerate(tokens):
+                entries = zip_index.postings.get(token)
+                if (entries is None and i == len(tokens) - 1 and last_unfinished
+                        and not token.isdigit()):
+                    entries = zip_index.prefix_matches(token)
+                candidate_sets.append(entries or set())
+            candidate_sets.sort(key=len)
+            matches = set(candidate_sets[0])
+            for entries in candidate_sets[1:]:
+                if not matches:
+                    break
+                matches &= entries
+            entries = [self._entries[entry_id] for entry_id in matches]
+
+        query_words = len(set(tokens))
+        candidates = [(entry[4] - query_words, entry) for entry in entries]
+        candidates.sort(key=lambda candidate: (candidate[0], len(candidate[1][0])))
+        return candidates
+
+    def match(self, query, zip_code):
+        """
+        The one indexed address a partial address identifies.
+
+        Args:
+            query (str): Partial address as typed by the user ("123 main")
+            zip_code (str): Registered ZIP code the search is scoped to
+
+        Returns:
+            dict: Result in the Geocoding API format, or None when nothing or
+            several equally good addresses match (ask the geocoder instead)
+        """
+        candidates = self._candidates(query, zip_code)
+        if not candidates:
+            self.stats['misses'] += 1
+            return None
+        if len(candidates) > 1 and candidates[0][0] == candidates[1][0]:
+            self.stats['ties'] += 1
+            return None
+        self.stats['hits'] += 1
+        return _result(candidates[0][1])
+
+    def search(self, query, zip_code, limit=MAX_RESULTS):
+        """
+        Find the indexed addresses in zip_code that contain every word of query.
+
+        The query needs a house number and a street name; the last word may be
+        incomplete ("123 main s" matches "123 Main St").
+
+        Args:
+            query (str): Partial address as typed by the user
+            zip_code (str): Registered ZIP code the search is scoped to
+            limit (int): Maximum number of results
+
+        Returns:
+            list: Results in the Geocoding API format (formatted_address,
+            geometry.location, address_components with the postal code),
+            closest match first; empty on a miss
+        """
+        candidates = self._candidates(query, zip_code)
+        if not candidates:
+            self.stats['misses'] += 1
+            return []
+        self.stats['hits'] += 1
+        return [_result(entry) for _, entry in candidates[:limit]]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def _result(entry):
+    """Index entry in the Geocoding API result format."""
+    address, lat, lng, zip_code, _ = entry
+    return {
+        'formatted_address': address,
+        'geometry': {'location': {'lat': lat, 'lng': lng}},
+        'address_components': [{'long_name': zip_code, 'short_name': zip_code, 'types': ['postal_code']}],
+    }
+
+
+def read_address_rows(path):
+    """Stream (zip_code, address, lat, lng) tuples from a gazetteer CSV, skipping bad rows."""
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            try:
+                yield row['zip'], row['address'], float(row['lat']), float(row['lng'])
+            except (KeyError, TypeError, ValueError):
+                continue
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """Return the process-wide index, loading it from ADDRESSES_FILE on first use."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = AddressIndex.from_file(ADDRESSES_FILE)
+    return _index
+
+
+def build_csv_from_cache(cache_database, output_path=ADDRESSES_FILE):
+    """
+    Write every address found in the geocode cache's 'OK' responses to a gazetteer CSV.
+
+    Returns:
+        int: Number of addresses written
+    """
+    import sqlite3
+
+    seen = set()
+    conn = sqlite3.connect(cache_database)
+    try:
+        rows = conn.execute("SELECT response FROM geocode_cache WHERE status = 'OK'")
+        with open(output_path, 'w', newline='', encoding='utf-8') as out:
+            writer = csv.writer(out)
+            writer.writerow(['zip', 'address', 'lat', 'lng'])
+            for (response,) in rows:
+                for result in json.loads(response).get('results', []):
+                    zip_code = postal_code(result)
+                    key = (zip_code, result.get('formatted_address'))
+                    if not zip_code or key in seen:
+                        continue
+                    seen.add(key)
+                    location = result['geometry']['location']
+                    writer.writerow([zip_code, result['formatted_address'],
+                                     f"{location['lat']:.6f}", f"{location['lng']:.6f}"])
+    finally:
+        conn.close()
+    return len(seen)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 3 and sys.argv[1] == 'build':
+        output = sys.argv[3] if len(sys.argv) > 3 else ADDRESSES_FILE
+        print(f"Wrote {build_csv_from_cache(sys.argv[2], output)} addresses to {output}")
+    else:
+        print("Usage: python address_index.py build <geocode_cache.db> [output_csv]")
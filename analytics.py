@@ -0,0 +1,423 @@
+# analytics.py
+
+"""
+Reporting: Streaming Export and Ride Analytics
+
+Reads profiles.db without getting in the way of the webhooks. The live
+database is opened read-only (mode=ro); in WAL mode a reader works on one
+consistent snapshot and never blocks the writer, and the writer never blocks
+it. Aggregates are written to a separate database (ANALYTICS_DATABASE),
+never to profiles.db.
+
+Export: rides or profiles as CSV, JSON lines or Parquet (pip install pyarrow)
+    python analytics.py export rides --format csv -o rides.csv
+    python analytics.py export profiles --format jsonl --since "2025-01-01" | gzip > profiles.jsonl.gz
+    python analytics.py export rides --format parquet -o rides.parquet
+
+  Rows are read from one cursor with fetchmany(EXPORT_BATCH_SIZE) and written
+  batch by batch (Parquet: one row group per batch), so memory use does not
+  grow with the table.
+
+Aggregates:
+    python analytics.py refresh [--every 300]
+    python analytics.py report [--hours 24] [--days 7] [--top 10] [--json]
+
+  - rides_per_zip_hour: rides per passenger ZIP code (profile zip_code) and hour
+  - pickup_destination_pairs: rides per pickup / destination pair (case and
+    surrounding spaces ignored)
+  - first_rides, conversion_daily: per signup day, how many new profiles booked
+    a ride and how many hours after signing up
+
+  A refresh only reads the rides and profiles created after the stored
+  watermark, up to WATERMARK_LAG seconds ago: created_at is set before the
+  insert commits, so the lag lets a slow writer land its row before the
+  window closes. The new counts and the watermark are committed in one
+  transaction, so an interrupted refresh changes nothing and the next one
+  picks up from the last watermark.
+"""
+
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+from urllib.parse import quote
+
+from db_pool import get_connection
+from migrations import ANALYTICS_MIGRATIONS, migrate
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Configuration constants
+DATABASE = 'profiles.db'
+ANALYTICS_DATABASE = os.getenv('ANALYTICS_DATABASE', 'analytics.db')
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '5000'))        # Rows per fetchmany / row group
+WATERMARK_LAG = float(os.getenv('ANALYTICS_WATERMARK_LAG', '10'))     # Seconds
+BUSY_TIMEOUT = 20
+UNKNOWN_ZIP = 'unknown'
+
+# Exported columns and their Parquet types
+EXPORT_COLUMNS = {
+    'rides': [
+        ('id', 'int64'), ('phone_number', 'string'), ('pickup', 'string'),
+        ('destination', 'string'), ('travel_time', 'string'), ('created_at', 'string'),
+        ('status', 'string'), ('driver_id', 'int64'), ('assigned_at', 'string'),
+        ('pickup_lat', 'float64'), ('pickup_lng', 'float64'),
+    ],
+    'profiles': [
+        ('phone_number', 'string'), ('profile_name', 'string'), ('gender', 'string'),
+        ('zip_code', 'string'), ('created_at', 'string'),
+    ],
+}
+EXPORT_FORMATS = ('csv', 'jsonl', 'parquet')
+
+
+def open_readonly(database=DATABASE):
+    """
+    Read-only connection to the live database, outside the db_pool.
+
+    Args:
+        database (str): Path of the SQLite database file
+
+    Returns:
+        sqlite3.Connection: In autocommit mode; statements that write fail
+    """
+    uri = f"file:{quote(os.path.abspath(database))}?mode=ro"
+    return sqlite3.connect(uri, uri=True, timeout=BUSY_TIMEOUT, isolation_level=None,
+                           check_same_thread=False)
+
+
+def iter_batches(conn, table, since=None, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Stream a table as lists of at most batch_size row tuples.
+
+    Args:
+        conn (sqlite3.Connection): Connection to profiles.db
+        table (str): 'rides' or 'profiles'
+        since (str): Only rows with created_at after this timestamp, in created_at order
+        batch_size (int): Rows per batch
+
+    Yields:
+        list: Row tuples in EXPORT_COLUMNS order
+    """
+    columns = ', '.join(name for name, _ in EXPORT_COLUMNS[table])
+    if since:
+        cursor = conn.execute(f"SELECT {columns} FROM {table} WHERE created_at > ? ORDER BY created_at",
+                              (since,))
+    else:
+        cursor = conn.execute(f"SELECT {columns} FROM {table}")
+    try:
+        yield from _fetch_batches(cursor, batch_size)
+    finally:
+        cursor.close()
+
+
+def _fetch_batches(cursor, batch_size):
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        yield rows
+
+
+def _write_csv(batches, columns, out):
+    writer = csv.writer(out)
+    writer.writerow(columns)
+    total = 0
+    for rows in batches:
+        writer.writerows(rows)
+        total += len(rows)
+    return total
+
+
+def _write_jsonl(batches, columns, out):
+    total = 0
+    for rows in batches:
+        out.write(''.join(json.dumps(dict(zip(columns, row))) + '\n' for row in rows))
+        total += len(rows)
+    return total
+
+
+def _write_parquet(batches, table, path):
+    schema = pyarrow.schema([(name, getattr(pyarrow, kind)()) for name, kind in EXPORT_COLUMNS[table]])
+    total = 0
+    with pyarrow.parquet.ParquetWriter(path, schema) as writer:
+        for rows in batches:
+            arrays = [pyarrow.array(values, type=field.type)
+                      for values, field in zip(zip(*rows), schema)]
+            writer.write_table(pyarrow.Table.from_arrays(arrays, schema=schema))
+            total += len(rows)
+    return total
+
+
+def export(table, fmt='csv', output='-', database=DATABASE, since=None, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Export rides or profiles from a read-only snapshot of the live database.
+
+    Args:
+        table (str): 'rides' or 'profiles'
+        fmt (str): 'csv', 'jsonl' or 'parquet'
+        output (str): File path, '-' for stdout (CSV and JSON lines only)
+        database (str): profiles.db path
+        since (str): Only rows created after this timestamp
+        batch_size (int): Rows fetched and written at a time
+
+    Returns:
+        int: Rows exported
+
+    Raises:
+        ValueError: Unknown table or format, or Parquet to stdout
+        RuntimeError: Parquet requested but pyarrow is not installed
+    """
+    if table not in EXPORT_COLUMNS:
+        raise ValueError(f"table must be one of: {', '.join(EXPORT_COLUMNS)}")
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"format must be one of: {', '.join(EXPORT_FORMATS)}")
+    if fmt == 'parquet':
+        if pyarrow is None:
+            raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow)")
+        if output == '-':
+            raise ValueError("Parquet export needs an output file")
+
+    conn = open_readonly(database)
+    try:
+        batches = iter_batches(conn, table, since, batch_size)
+        if fmt == 'parquet':
+            return _write_parquet(batches, table, output)
+        columns = [name for name, _ in EXPORT_COLUMNS[table]]
+        write = _write_csv if fmt == 'csv' else _write_jsonl
+        if output == '-':
+            return write(batches, columns, sys.stdout)
+        with open(output, 'w', newline='', encoding='utf-8') as out:
+            return write(batches, columns, out)
+    finally:
+        conn.close()
+
+
+def _refresh_window(live, out, start, end, batch_size):
+    """Fold rides and profiles created in (start, end] into the aggregates."""
+    window = (start, end)
+    totals = {'rides': 0, 'profiles': 0}
+
+    rides_by_hour = live.execute('''SELECT COALESCE(p.zip_code, ?), strftime('%Y-%m-%d %H:00', r.created_at), COUNT(*)
+                                    FROM rides r LEFT JOIN profiles p ON p.phone_number = r.phone_number
+                                    WHERE r.created_at > ? AND r.created_at <= ?
+                                    GROUP BY 1, 2''', (UNKNOWN_ZIP, *window)).fetchall()
+    out.executemany('''INSERT INTO rides_per_zip_hour (zip_code, hour, rides) VALUES (?, ?, ?)
+                       ON CONFLICT (zip_code, hour) DO UPDATE SET rides = rides + excluded.rides''',
+                    rides_by_hour)
+    totals['rides'] = sum(row[2] for row in rides_by_hour)
+
+    pairs = live.execute('''SELECT lower(trim(pickup)), lower(trim(destination)), COUNT(*), MAX(created_at)
+                            FROM rides
+                            WHERE created_at > ? AND created_at <= ?
+                              AND pickup IS NOT NULL AND destination IS NOT NULL
+                            GROUP BY 1, 2''', window)
+    for rows in _fetch_batches(pairs, batch_size):
+        out.executemany('''INSERT INTO pickup_destination_pairs (pickup, destination, rides, last_ride_at)
+                           VALUES (?, ?, ?, ?)
+                           ON CONFLICT (pickup, destination) DO UPDATE SET
+                               rides = rides + excluded.rides,
+                               last_ride_at = MAX(last_ride_at, excluded.last_ride_at)''', rows)
+
+    # Profiles (and riders) touched in this window; their signup days are recounted below
+    out.execute('CREATE TEMP TABLE IF NOT EXISTS touched (phone_number TEXT PRIMARY KEY)')
+    out.execute('DELETE FROM touched')
+
+    profiles = live.execute('''SELECT phone_number, created_at FROM profiles
+                               WHERE created_at > ? AND created_at <= ?''', window)
+    for rows in _fetch_batches(profiles, batch_size):
+        out.executemany('''INSERT INTO first_rides (phone_number, profile_created_at) VALUES (?, ?)
+                           ON CONFLICT (phone_number) DO UPDATE SET
+                               profile_created_at = MIN(COALESCE(profile_created_at, excluded.profile_created_at),
+                                                        excluded.profile_created_at)''', rows)
+        out.executemany('INSERT OR IGNORE INTO touched VALUES (?)', [(row[0],) for row in rows])
+        totals['profiles'] += len(rows)
+
+    first_rides = live.execute('''SELECT phone_number, MIN(created_at) FROM rides
+                                  WHERE created_at > ? AND created_at <= ?
+                                  GROUP BY phone_number''', window)
+    for rows in _fetch_batches(first_rides, batch_size):
+        out.executemany('''INSERT INTO first_rides (phone_number, first_ride_at) VALUES (?, ?)
+                           ON CONFLICT (phone_number) DO UPDATE SET
+                               first_ride_at = MIN(COALESCE(first_ride_at, excluded.first_ride_at),
+                                                   excluded.first_ride_at)''', rows)
+        out.executemany('INSERT OR IGNORE INTO touched VALUES (?)', [(row[0],) for row in rows])
+
+    days = [day for (day,) in out.execute('''SELECT DISTINCT date(f.profile_created_at)
+                                             FROM first_rides f JOIN touched t USING (phone_number)
+                                             WHERE f.profile_created_at IS NOT NULL''')]
+    for day in days:
+        next_day = (datetime.fromisoformat(day) + timedelta(days=1)).date().isoformat()
+        out.execute('''INSERT OR REPLACE INTO conversion_daily (day, profiles, converted, avg_hours_to_first_ride)
+                       SELECT ?, COUNT(*), COUNT(first_ride_at),
+                              AVG((julianday(first_ride_at) - julianday(profile_created_at)) * 24)
+                       FROM first_rides
+                       WHERE profile_created_at >= ? AND profile_created_at < ?''', (day, day, next_day))
+    out.execute('DELETE FROM touched')
+    return totals
+
+
+def refresh(database=DATABASE, analytics_database=ANALYTICS_DATABASE, lag=WATERMARK_LAG,
+            batch_size=EXPORT_BATCH_SIZE):
+    """
+    Bring the aggregates up to date with rows created since the last refresh.
+
+    Args:
+        database (str): profiles.db path, only read
+        analytics_database (str): Aggregates database path
+        lag (float): Rows newer than this many seconds wait for the next refresh
+        batch_size (int): Rows fetched at a time
+
+    Returns:
+        dict: {'rides': new rides, 'profiles': new or re-saved profiles, 'watermark': timestamp}
+    """
+    migrate(analytics_database, ANALYTICS_MIGRATIONS)
+    out = get_connection(analytics_database)
+    watermarks = dict(out.execute('SELECT source, created_at FROM watermarks'))
+    # Rides and profiles share one watermark so the conversion join sees both sides of a window
+    start = watermarks.get('profiles.db', '')
+    end = (datetime.now() - timedelta(seconds=lag)).isoformat(sep=' ', timespec='microseconds')
+    if end <= start:
+        return {'rides': 0, 'profiles': 0, 'watermark': start}
+
+    live = open_readonly(database)
+    try:
+        live.execute('BEGIN')    # One snapshot for every read of this refresh
+        out.execute('BEGIN IMMEDIATE')
+        totals = _refresh_window(live, out, start, end, batch_size)
+        out.execute('INSERT OR REPLACE INTO watermarks (source, created_at, refreshed_at) VALUES (?, ?, ?)',
+                    ('profiles.db', end, datetime.now()))
+        out.commit()
+    except Exception:
+        out.rollback()
+        raise
+    finally:
+        live.close()
+    return {**totals, 'watermark': end}
+
+
+def report(analytics_database=ANALYTICS_DATABASE, hours=24, days=7, top=10):
+    """
+    Read the aggregates.
+
+    Args:
+        analytics_database (str): Aggregates database path
+        hours (int): Window for rides per ZIP code
+        days (int): Signup days of the conversion table
+        top (int): Rows of the ZIP code and pickup / destination rankings
+
+    Returns:
+        dict: {'watermark', 'zip_codes', 'pairs', 'conversion', 'conversion_total'}
+    """
+    migrate(analytics_database, ANALYTICS_MIGRATIONS)
+    conn = get_connection(analytics_database)
+    now = datetime.now()
+    watermark = conn.execute("SELECT created_at FROM watermarks WHERE source = 'profiles.db'").fetchone()
+    zip_codes = conn.execute('''SELECT zip_code, SUM(rides) FROM rides_per_zip_hour
+                                WHERE hour >= ? GROUP BY zip_code ORDER BY 2 DESC LIMIT ?''',
+                             ((now - timedelta(hours=hours)).strftime('%Y-%m-%d %H:00'), top)).fetchall()
+    pairs = conn.execute('''SELECT pickup, destination, rides FROM pickup_destination_pairs
+                            ORDER BY rides DESC LIMIT ?''', (top,)).fetchall()
+    conversion = conn.execute('''SELECT day, profiles, converted, avg_hours_to_first_ride FROM conversion_daily
+                                 WHERE day >= ? ORDER BY day''',
+                              ((now - timedelta(days=days)).date().isoformat(),)).fetchall()
+    profiles, converted = conn.execute('SELECT COALESCE(SUM(profiles), 0), COALESCE(SUM(converted), 0) '
+                                       'FROM conversion_daily').fetchone()
+    return {
+        'watermark': watermark[0] if watermark else None,
+        'zip_codes': [{'zipCode': zip_code, 'rides': rides} for zip_code, rides in zip_codes],
+        'pairs': [{'pickup': pickup, 'destination': destination, 'rides': rides}
+                  for pickup, destination, rides in pairs],
+        'conversion': [{'day': day, 'profiles': count, 'converted': done,
+                        'rate': round(done / count, 3) if count else 0.0,
+                        'avgHoursToFirstRide': round(avg, 1) if avg is not None else None}
+                       for day, count, done, avg in conversion],
+        'conversion_total': {'profiles': profiles, 'converted': converted,
+                             'rate': round(converted / profiles, 3) if profiles else 0.0},
+    }
+
+
+def print_report(summary, hours, days):
+    print(f"Aggregates up to {summary['watermark'] or 'never refreshed'}")
+    print()
+    print(f"Rides per ZIP code, last {hours} hours")
+    for row in summary['zip_codes']:
+        print(f"  {row['zipCode']:<10} {row['rides']:>8}")
+    print()
+    print("Top pickup / destination pairs")
+    for row in summary['pairs']:
+        print(f"  {row['rides']:>8}  {row['pickup']} -> {row['destination']}")
+    print()
+    print(f"Profile to first ride, signups of the last {days} days")
+    for row in summary['conversion']:
+        hours_text = f"{row['avgHoursToFirstRide']} h to first ride" if row['avgHoursToFirstRide'] is not None else ''
+        print(f"  {row['day']}  {row['converted']:>6} of {row['profiles']:<6} ({row['rate']:.1%})  {hours_text}")
+    total = summary['conversion_total']
+    print(f"  all time    {total['converted']:>6} of {total['profiles']:<6} ({total['rate']:.1%})")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export and aggregate rides and profiles.')
+    parser.add_argument('--database', default=DATABASE)
+    parser.add_argument('--analytics-database', default=ANALYTICS_DATABASE)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = commands.add_parser('export', help='Stream a table to CSV, JSON lines or Parquet')
+    export_parser.add_argument('table', choices=sorted(EXPORT_COLUMNS))
+    export_parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv')
+    export_parser.add_argument('-o', '--output', default='-', help="Output file ('-' for stdout)")
+    export_parser.add_argument('--since', help='Only rows created after this timestamp')
+    export_parser.add_argument('--batch-size', type=int, default=EXPORT_BATCH_SIZE)
+
+    refresh_parser = commands.add_parser('refresh', help='Fold new rows into the aggregate tables')
+    refresh_parser.add_argument('--every', type=float, help='Keep refreshing every N seconds')
+
+    report_parser = commands.add_parser('report', help='Print the aggregates')
+    report_parser.add_argument('--hours', type=int, default=24)
+    report_parser.add_argument('--days', type=int, default=7)
+    report_parser.add_argument('--top', type=int, default=10)
+    report_parser.add_argument('--json', action='store_true')
+    args = parser.parse_args(argv)
+
+    if args.command == 'export':
+        try:
+            started = time.perf_counter()
+            total = export(args.table, args.format, args.output, args.database, args.since, args.batch_size)
+        except (ValueError, RuntimeError, sqlite3.Error) as e:
+            print(f"Export failed: {str(e)}", file=sys.stderr)
+            return 1
+        print(f"{total} {args.table} exported in {time.perf_counter() - started:.2f}s", file=sys.stderr)
+
+    elif args.command == 'refresh':
+        while True:
+            try:
+                result = refresh(args.database, args.analytics_database)
+                print(f"Refreshed up to {result['watermark']}: "
+                      f"{result['rides']} rides, {result['profiles']} profiles")
+            except sqlite3.Error as e:
+                print(f"Refresh failed: {str(e)}")
+                if not args.every:
+                    return 1
+            if not args.every:
+                break
+            time.sleep(args.every)
+
+    else:
+        summary = report(args.analytics_database, args.hours, args.days, args.top)
+        if args.json:
+            print(json.dumps(summary))
+        else:
+            print_report(summary, args.hours, args.days)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,44 +3,51 @@
 """
 Driver Registration System Backend
 
-This Flask application handles driver registration with features including:
+This Flask blueprint handles driver registration with features including:
 - Driver information submission
 - License validation
 - SMS notifications via Twilio
 - SQLite database storage
 
-
+It is served together with the passenger blueprints by
+app_factory.create_app(); `app` below runs it on its own.
 """
 
-from flask import Flask, request, jsonify, render_template
+from flask import Blueprint, Flask, request, jsonify, render_template
 from flask_cors import CORS
 import sqlite3
+import threading
+import time
+import csv
+import hmac
+import io
 import os
-from twilio.rest import Client
-from dotenv import load_dotenv
 from contextlib import contextmanager
+from db_pool import get_connection
+from migrations import migrate, DRIVERS_MIGRATIONS
+from license_registry import LicenseRegistry
+import services
+import metrics
+from driver_matching import load_driver_index, report_location, ride_requirements
+from driver_import import import_drivers, read_json_array
 
-# Load environment variables from .env file
-load_dotenv()
-
-# Initialize Flask application
-app = Flask(__name__)
-CORS(app)  # Enable Cross-Origin Resource Sharing
+# Registration pages and API, Cross-Origin Resource Sharing enabled
+registration_blueprint = Blueprint('registration', __name__)
+CORS(registration_blueprint)
 
 # Configuration constants
 DATABASE = 'drivers.db'  # SQLite database file name
-
-# Twilio configuration from environment variables
-account_sid = os.getenv('TWILIO_ACCOUNT_SID')
-auth_token = os.getenv('TWILIO_AUTH_TOKEN')
-twilio_phone = os.getenv('TWILIO_PHONE_NUMBER')
-client = Client(account_sid, auth_token)
+# Key fleet partners send as X-API-Key to /api/drivers/import; the endpoint is disabled without one
+DRIVER_IMPORT_API_KEY = os.getenv('DRIVER_IMPORT_API_KEY', '')
+# Seconds between reloads of the driver position index from driver_locations
+DRIVER_INDEX_REFRESH = float(os.getenv('DRIVER_INDEX_REFRESH', '5'))
 
 @contextmanager
 def get_db_connection():
     """
     Context manager for database connections.
-    Ensures proper handling of connections and automatic closing.
+    Hands out this thread's pooled connection (see db_pool.py) instead of
+    opening a new one, and commits when the block finishes.
     
     Yields:
         sqlite3.Connection: Database connection object
@@ -50,17 +57,19 @@ def get_db_connection():
             cursor = conn.cursor()
             cursor.execute(query)
     """
-    conn = sqlite3.connect(DATABASE, timeout=20)  # 20 second timeout for busy database
+    conn = get_connection(DATABASE)  # Reused per thread, 20 second busy timeout
     try:
         yield conn
-    finally:
+    except Exception:
+        conn.rollback()  # Discard the partial transaction, keep the connection
+        raise
+    else:
         conn.commit()  # Commit any pending transactions
-        conn.close()   # Ensure connection is closed
 
 def init_db():
     """
-    Initialize the database and create the drivers table if it doesn't exist.
-    This function runs when the application starts.
+    Initialize the database by applying any pending schema migrations
+    (see migrations.py). This function runs when the application starts.
     
     Table Schema:
     - id: Primary key
@@ -80,36 +89,70 @@ def init_db():
     - has_booster: Boolean for booster seat availability
     - notify_rides: Boolean for ride notifications
     - notify_deliveries: Boolean for delivery notifications
+    
+    Indexes: UNIQUE on license_number and license_plate, plain index on phone
+    
+    driver_locations holds each driver's last reported position and
+    availability, used for ride matching (see driver_matching.py)
     """
-    with get_db_connection() as conn:
-        c = conn.cursor()
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS drivers (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                phone TEXT NOT NULL,
-                email TEXT NOT NULL,
-                license_number TEXT NOT NULL,
-                license_plate TEXT NOT NULL,
-                gender TEXT NOT NULL,
-                Model TEXT NOT NULL,
-                car_color TEXT NOT NULL,
-                available_seats INTEGER NOT NULL,
-                is_new_car BOOLEAN,
-                is_luxury BOOLEAN,
-                has_wheelchair BOOLEAN,
-                car_seat_count INTEGER,
-                has_booster BOOLEAN,
-                notify_rides BOOLEAN,
-                notify_deliveries BOOLEAN,
-                PassengerPreference TEXT NOT NULL
-            )
-        ''')
+    migrate(DATABASE, DRIVERS_MIGRATIONS)
+
+# Initialize database when the blueprint is registered on an app
+registration_blueprint.record_once(lambda state: init_db())
 
-# Initialize database on startup
-init_db()
+# Registered license numbers/plates, answers most /api/check-license calls
+# (loaded on first lookup)
+license_registry = LicenseRegistry(DATABASE)
+
+# Available drivers by position: updated in place by /api/driver-location in this
+# process, reloaded every DRIVER_INDEX_REFRESH seconds for reports other processes stored
+_driver_index = None
+_driver_index_loaded_at = 0.0
+_driver_index_lock = threading.Lock()
+
+def get_driver_index():
+    """
+    Return the driver position index, loading it from drivers.db on first use
+    and again once it is DRIVER_INDEX_REFRESH seconds old.
+    
+    One thread rebuilds a stale index while the others keep answering from
+    the current one.
+    
+    Returns:
+        DriverIndex: Available drivers (see driver_matching.py)
+    """
+    global _driver_index, _driver_index_loaded_at
+    if _driver_index is not None and time.monotonic() - _driver_index_loaded_at < DRIVER_INDEX_REFRESH:
+        return _driver_index
+    if not _driver_index_lock.acquire(blocking=_driver_index is None):
+        return _driver_index
+    try:
+        if _driver_index is None or time.monotonic() - _driver_index_loaded_at >= DRIVER_INDEX_REFRESH:
+            _driver_index = load_driver_index(DATABASE)
+            _driver_index_loaded_at = time.monotonic()
+    finally:
+        _driver_index_lock.release()
+    return _driver_index
+
+def _number(values, name, convert, default=None, low=None, high=None):
+    """
+    Read a numeric request value.
+    
+    Raises:
+        ValueError: Missing, not a number, or outside low..high, with a message naming the value
+    """
+    value = values.get(name, default)
+    if value is None or value == '':
+        raise ValueError(f"{name} is required")
+    try:
+        number = convert(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be a number") from None
+    if (low is not None and number < low) or (high is not None and number > high):
+        raise ValueError(f"{name} must be between {low} and {high}")
+    return number
 
-@app.route('/')
+@registration_blueprint.route('/')
 def home():
     """
     Render the main registration page.
@@ -119,7 +162,29 @@ def home():
     """
     return render_template('index.html')
 
-@app.route('/api/check-license', methods=['POST','GET'])
+@metrics.timed('db.find_existing_license')
+def find_existing_license(license_number, license_plate):
+    """
+    Check which of a license number and license plate are already registered.
+    Both questions are answered by one statement, each half an index probe.
+    
+    Args:
+        license_number (str): Driver's license number
+        license_plate (str): Vehicle license plate
+    
+    Returns:
+        tuple: (license_number_exists, license_plate_exists)
+    """
+    with get_db_connection() as conn:
+        c = conn.cursor()
+        c.execute('''
+            SELECT EXISTS(SELECT 1 FROM drivers WHERE license_number = ?),
+                   EXISTS(SELECT 1 FROM drivers WHERE license_plate = ?)
+        ''', (license_number, license_plate))
+        license_exists, plate_exists = c.fetchone()
+    return bool(license_exists), bool(plate_exists)
+
+@registration_blueprint.route('/api/check-license', methods=['POST','GET'])
 def check_license():
     """
     API endpoint to check if license number or plate already exists.
@@ -142,35 +207,31 @@ def check_license():
     license_plate = data.get('licensePlate')
     
     try:
-        with get_db_connection() as conn:
-            c = conn.cursor()
-            
-            # Check if license number exists
-            c.execute('SELECT COUNT(*) FROM drivers WHERE license_number = ?', (license_number,))
-            license_exists = c.fetchone()[0] > 0
-            
-            # Check if license plate exists
-            c.execute('SELECT COUNT(*) FROM drivers WHERE license_plate = ?', (license_plate,))
-            plate_exists = c.fetchone()[0] > 0
-            
-            return jsonify({
-                "exists": license_exists or plate_exists,
-                "licenseNumberExists": license_exists,
-                "licensePlateExists": plate_exists
-            })
+        # Neither value in the in-memory registry: not registered, skip SQLite
+        license_exists, plate_exists = license_registry.might_exist(license_number, license_plate)
+        
+        # Confirm possible matches with a single indexed query
+        if license_exists or plate_exists:
+            license_exists, plate_exists = find_existing_license(license_number, license_plate)
+        
+        return jsonify({
+            "exists": license_exists or plate_exists,
+            "licenseNumberExists": license_exists,
+            "licensePlateExists": plate_exists
+        })
             
     except sqlite3.Error as e:
         return jsonify({"error": str(e)}), 500
 
-@app.route('/api/submit', methods=['POST'])
+@registration_blueprint.route('/api/submit', methods=['POST'])
 def submit_form():
     """
     API endpoint to submit driver registration form.
     
     Performs the following steps:
-    1. Validates that license details don't already exist
-    2. Inserts new driver record into database
-    3. Sends SMS confirmation via Twilio
+    1. Inserts new driver record into database
+       (the UNIQUE license indexes reject duplicates atomically)
+    2. Queues SMS confirmation via Twilio once the insert has committed
     
     Expected JSON payload: Full driver registration data
     
@@ -185,24 +246,8 @@ def submit_form():
     try:
         with get_db_connection() as conn:
             c = conn.cursor()
-            
-            # Check for existing license details
-            c.execute('''
-                SELECT license_number, license_plate 
-                FROM drivers 
-                WHERE license_number = ? OR license_plate = ?
-            ''', (data['licenseNumber'], data['licensePlate']))
-            
-            existing = c.fetchone()
-            if existing:
-                return jsonify({
-                    "success": False,
-                    "error": "License details already registered",
-                    "licenseNumberExists": existing[0] == data['licenseNumber'],
-                    "licensePlateExists": existing[1] == data['licensePlate']
-                })
-
-            # Insert new driver record
+
+            # Insert new driver record, duplicates raise IntegrityError
             c.execute('''
                     INSERT INTO drivers (
                         name, phone, email, license_number, license_plate,
@@ -222,19 +267,35 @@ def submit_form():
                     data['PassengerPreference']
                 ))
             
-            # Send SMS confirmation
-            try:
-                message = client.messages.create(
-                    body=f"Thank you {data['name']} license no- {data['licenseNumber']} for registering as a driver!",
-                    from_=twilio_phone,
-                    to=data['phone']
-                )
-            except Exception as e:
-                print(f"Twilio SMS Error: {str(e)}")
-                # Continue even if SMS fails
-            
-            return jsonify({"success": True})
+            license_registry.add(data['licenseNumber'], data['licensePlate'])
+        
+        # Queue SMS confirmation after the transaction has committed
+        try:
+            services.outbound_queue().enqueue(
+                to=data['phone'],
+                body=f"Thank you {data['name']} license no- {data['licenseNumber']} for registering as a driver!",
+                from_=services.TWILIO_PHONE_NUMBER,
+                dedup_key=f"driver-registration:{data['licenseNumber']}"
+            )
+        except Exception as e:
+            print(f"Twilio SMS Error: {str(e)}")
+            # Continue even if SMS fails
+        
+        return jsonify({"success": True})
     
+    except sqlite3.IntegrityError as e:
+        # License number or plate already registered, report which one
+        license_exists, plate_exists = find_existing_license(data['licenseNumber'], data['licensePlate'])
+        if not (license_exists or plate_exists):
+            # Some other constraint, e.g. a NOT NULL field was missing
+            print(f"Database Error: {str(e)}")
+            return jsonify({"success": False, "error": f"Database error: {str(e)}"})
+        return jsonify({
+            "success": False,
+            "error": "License details already registered",
+            "licenseNumberExists": license_exists,
+            "licensePlateExists": plate_exists
+        })
     except sqlite3.Error as e:
         print(f"Database Error: {str(e)}")
         return jsonify({"success": False, "error": f"Database error: {str(e)}"})
@@ -242,6 +303,146 @@ def submit_form():
         print(f"General Error: {str(e)}")
         return jsonify({"success": False, "error": str(e)})
 
+@registration_blueprint.route('/api/drivers/import', methods=['POST'])
+def bulk_import():
+    """
+    API endpoint for bulk driver registration from fleet partner lists.
+    
+    The body is read as a stream and imported in chunks (see driver_import.py),
+    never loaded whole:
+    - text/csv: header row with the registration form field names
+    - application/x-ndjson: one driver object per line
+    - application/json: array of driver objects, parsed one element at a time
+    
+    Requires the X-API-Key header to equal DRIVER_IMPORT_API_KEY: every
+    imported row queues an SMS to the phone number it contains.
+    
+    Query parameters: notify (default true), false skips the confirmation SMS
+    
+    Returns:
+        JSON: {
+            "success": boolean (false if any row was rejected),
+            "rows": integer, "imported": integer, "failed": integer,
+            "smsQueued": integer,
+            "errors": [{"row": integer, "licenseNumber": string, "error": string}, ...]
+        }
+        A row that is not valid JSON, or where the upload stops being readable,
+        is reported in "errors" like any rejected row.
+    """
+    if not DRIVER_IMPORT_API_KEY:
+        return jsonify({"success": False, "error": "Bulk import is disabled"}), 403
+    if not hmac.compare_digest(request.headers.get('X-API-Key', '').encode('utf-8'),
+                               DRIVER_IMPORT_API_KEY.encode('utf-8')):
+        return jsonify({"success": False, "error": "Invalid API key"}), 401
+    
+    notify = request.args.get('notify', 'true').lower() not in ('0', 'false', 'no')
+    
+    try:
+        stream = io.TextIOWrapper(request.stream, encoding='utf-8-sig', newline='')
+        if request.mimetype == 'application/json':
+            rows = read_json_array(stream)
+        elif request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+            rows = (line for line in stream if line.strip())   # Parsed per row by import_drivers
+        else:
+            rows = csv.DictReader(stream)
+        
+        result = import_drivers(
+            rows, DATABASE,
+            outbound_queue=services.outbound_queue() if notify else None,
+            from_number=services.TWILIO_PHONE_NUMBER,
+            registry=license_registry
+        )
+        return jsonify({"success": result['failed'] == 0, **result})
+    
+    except sqlite3.Error as e:
+        print(f"Database Error: {str(e)}")
+        return jsonify({"success": False, "error": f"Database error: {str(e)}"})
+
+@registration_blueprint.route('/api/driver-location', methods=['POST'])
+def driver_location():
+    """
+    API endpoint for drivers to report their position and availability.
+    
+    Expected JSON payload:
+    {
+        "driverId": integer,
+        "lat": number,
+        "lng": number,
+        "available": boolean (optional, default true)
+    }
+    
+    Returns:
+        JSON: {
+            "success": boolean,
+            "error": string (optional)
+        }
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"success": False, "error": "Expected a JSON object"}), 400
+    
+    try:
+        driver_id = _number(data, 'driverId', int)
+        lat = _number(data, 'lat', float, low=-90, high=90)
+        lng = _number(data, 'lng', float, low=-180, high=180)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    
+    try:
+        found = report_location(DATABASE, driver_id, lat, lng,
+                                data.get('available', True), index=get_driver_index())
+        if not found:
+            return jsonify({"success": False, "error": "Unknown driver"}), 404
+        return jsonify({"success": True})
+    except sqlite3.Error as e:
+        print(f"Database Error: {str(e)}")
+        return jsonify({"success": False, "error": f"Database error: {str(e)}"})
+
+@registration_blueprint.route('/api/nearest-drivers', methods=['GET'])
+def nearest_drivers():
+    """
+    API endpoint returning the nearest available drivers able to take a ride.
+    
+    Query parameters: lat, lng, k (default 5), seats (default 1), gender,
+    wheelchair, booster, luxury, newCar (true/false), carSeats (0-2)
+    
+    Returns:
+        JSON: {
+            "drivers": [{"driverId": integer, "distanceKm": number}, ...]
+        }
+        or {"success": false, "error": string} with status 400 for a bad parameter
+    """
+    args = request.args
+    flag = lambda name: args.get(name, '').lower() in ('1', 'true', 'yes')
+    try:
+        lat = _number(args, 'lat', float, low=-90, high=90)
+        lng = _number(args, 'lng', float, low=-180, high=180)
+        k = _number(args, 'k', int, default=5, low=1, high=100)
+        seats = _number(args, 'seats', int, default=1, low=1, high=15)
+        car_seats = _number(args, 'carSeats', int, default=0, low=0, high=2)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    
+    required = ride_requirements(
+        passenger_gender=args.get('gender'),
+        wheelchair=flag('wheelchair'),
+        booster=flag('booster'),
+        car_seats=car_seats,
+        luxury=flag('luxury'),
+        new_car=flag('newCar'),
+    )
+    matches = get_driver_index().nearest(lat, lng, k=k, required_mask=required, seats=seats)
+    return jsonify({
+        "drivers": [{"driverId": driver_id, "distanceKm": round(distance, 3)}
+                    for distance, driver_id in matches]
+    })
+
+# Standalone driver registration app, see app_factory.create_app() for the combined one
+app = Flask(__name__)
+app.register_blueprint(registration_blueprint)
+app.register_blueprint(metrics.metrics_blueprint)
+
 # Start the application
 if __name__ == '__main__':
+    services.outbound_queue()
     app.run(debug=True)  # Set debug=False in production
\ No newline at end of file
@@ -0,0 +1,64 @@
+# app_factory.py
+
+"""
+Application Factory
+
+Builds one Flask app serving both the driver registration site (app.py) and
+the passenger SMS / WhatsApp / IVR webhooks (passenger_reg.py), so a single
+process holds one SQLite connection pool, one HTTP session, one geocode
+cache and one Twilio client (see services.py) instead of two of each.
+
+    from app_factory import create_app
+    app = create_app()                                  # everything
+    app = create_app(blueprints=['sms', 'whatsapp'])    # a subset, e.g. in tests
+
+Registering a blueprint applies its database migrations; Twilio and Google
+clients are only built when a request first needs them.
+
+Development server:
+    python app_factory.py
+"""
+
+import os
+
+from flask import Flask
+
+import app as driver_registration
+import metrics
+import passenger_reg
+import services
+
+# Configuration constants
+PORT = int(os.getenv('PORT', '5000'))
+
+BLUEPRINTS = {
+    'registration': driver_registration.registration_blueprint,
+    'sms': passenger_reg.sms_blueprint,
+    'whatsapp': passenger_reg.whatsapp_blueprint,
+    'voice': passenger_reg.voice_blueprint,
+    'metrics': metrics.metrics_blueprint,     # Request timing, JSON request log and /metrics
+}
+
+
+def create_app(config=None, blueprints=None):
+    """
+    Create the combined Flask application.
+
+    Args:
+        config (dict): Flask config overrides, e.g. {'TESTING': True}
+        blueprints (list): Names from BLUEPRINTS to register, all by default
+
+    Returns:
+        Flask: Application with the selected blueprints registered
+    """
+    application = Flask(__name__)
+    if config:
+        application.config.update(config)
+    for name in blueprints or BLUEPRINTS:
+        application.register_blueprint(BLUEPRINTS[name])
+    return application
+
+
+if __name__ == '__main__':
+    services.outbound_queue()
+    create_app().run(debug=True, port=PORT)
@@ -0,0 +1,61 @@
+# background_jobs.py
+
+"""
+Background Job Runner
+
+Small thread pool used by the webhooks to hand off slow work (geocoding,
+Distance Matrix lookups) so Twilio gets its TwiML reply immediately.
+Results are delivered to the user out-of-band, e.g. via client.messages.create.
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Number of concurrent background workers per process
+BACKGROUND_WORKERS = int(os.getenv('BACKGROUND_WORKERS', '8'))
+
+_executor = None
+_executor_pid = None
+_lock = threading.Lock()
+
+
+def _get_executor():
+    """Create the pool lazily, and again after a fork (threads do not survive fork)."""
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        with _lock:
+            if _executor is None or _executor_pid != os.getpid():
+                _executor = ThreadPoolExecutor(max_workers=BACKGROUND_WORKERS,
+                                               thread_name_prefix='background-job')
+                _executor_pid = os.getpid()
+    return _executor
+
+
+def _run(func, args, kwargs):
+    try:
+        return func(*args, **kwargs)
+    except Exception as e:
+        print(f"Background job {func.__name__} failed: {str(e)}")
+        raise
+
+
+def submit(func, *args, **kwargs):
+    """
+    Run func(*args, **kwargs) on the background pool.
+
+    Exceptions are logged and kept on the returned future.
+
+    Returns:
+        concurrent.futures.Future: Handle to the running job
+    """
+    return _get_executor().submit(_run, func, args, kwargs)
+
+
+def shutdown(wait=True):
+    """Stop accepting jobs and optionally wait for running ones to finish."""
+    global _executor
+    with _lock:
+        if _executor is not None:
+            _executor.shutdown(wait=wait)
+            _executor = None
@@ -0,0 +1,57 @@
+# bench_distance.py
+
+"""
+Benchmark: scalar calculate_distance loop vs vectorized distances_from.
+
+Usage:
+    python bench_distance.py [candidate_count ...]
+"""
+
+import random
+import sys
+import time
+
+import numpy as np
+
+from geo_distance import calculate_distance, distances_from, locations_to_array
+
+
+def random_locations(count, seed=42):
+    """Random points roughly covering the continental US."""
+    rng = random.Random(seed)
+    return [{'lat': rng.uniform(25, 49), 'lng': rng.uniform(-124, -67)} for _ in range(count)]
+
+
+def best_of(func, repeat=5):
+    """Fastest wall-clock time of several runs, in seconds."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def run(count):
+    origin = {'lat': 40.7506, 'lng': -73.9972}
+    points = random_locations(count)
+    points_array = locations_to_array(points)
+
+    scalar = best_of(lambda: [calculate_distance(origin, p) for p in points])
+    vector = best_of(lambda: distances_from(origin, points_array))
+    vector_with_conversion = best_of(lambda: distances_from(origin, points))
+
+    # Both implementations must agree
+    expected = np.array([calculate_distance(origin, p) for p in points])
+    assert np.allclose(expected, distances_from(origin, points_array), atol=1e-6)
+    assert np.allclose(expected, distances_from(origin, points), atol=1e-6)
+
+    print(f"{count:>9} points | scalar {scalar * 1000:9.3f} ms | "
+          f"numpy {vector * 1000:8.3f} ms ({scalar / vector:6.1f}x) | "
+          f"distances_from(dicts) {vector_with_conversion * 1000:8.3f} ms")
+
+
+if __name__ == '__main__':
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10, 100, 1_000, 10_000, 100_000]
+    for size in sizes:
+        run(size)
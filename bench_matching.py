@@ -0,0 +1,98 @@
+# bench_matching.py
+
+"""
+Benchmark: DriverIndex.nearest vs a brute-force scan over every driver.
+
+Drivers are scattered over a metro-sized area (1 x 1 degree) with random
+capabilities, then random pickups inside the area ask for the 5 nearest
+eligible drivers.
+
+Usage:
+    python bench_matching.py [driver_count ...]
+"""
+
+import random
+import sys
+import time
+
+from driver_matching import (CAP_ACCEPTS_FEMALE, CAP_ACCEPTS_MALE, CAP_BOOSTER, CAP_LUXURY,
+                             CAP_WHEELCHAIR, DriverIndex, ride_requirements)
+from geo_distance import calculate_distance
+
+CENTER = (40.75, -73.99)
+QUERIES = 2000
+
+
+def random_drivers(count, seed=42):
+    """(driver_id, lat, lng, mask, seats) tuples around CENTER."""
+    rng = random.Random(seed)
+    drivers = []
+    for driver_id in range(count):
+        mask = rng.choice([CAP_ACCEPTS_MALE | CAP_ACCEPTS_FEMALE, CAP_ACCEPTS_MALE, CAP_ACCEPTS_FEMALE])
+        if rng.random() < 0.1:
+            mask |= CAP_WHEELCHAIR
+        if rng.random() < 0.3:
+            mask |= CAP_BOOSTER
+        if rng.random() < 0.2:
+            mask |= CAP_LUXURY
+        drivers.append((driver_id, CENTER[0] + rng.uniform(-0.5, 0.5),
+                        CENTER[1] + rng.uniform(-0.5, 0.5), mask, rng.randint(1, 6)))
+    return drivers
+
+
+def random_requests(count, seed=7):
+    """(lat, lng, required_mask, seats) tuples."""
+    rng = random.Random(seed)
+    return [
+        (CENTER[0] + rng.uniform(-0.5, 0.5), CENTER[1] + rng.uniform(-0.5, 0.5),
+         ride_requirements(passenger_gender=rng.choice(['Male', 'Female']),
+                           wheelchair=rng.random() < 0.05),
+         rng.randint(1, 3))
+        for _ in range(count)
+    ]
+
+
+def brute_force(drivers, lat, lng, required_mask, seats, k=5):
+    origin = {'lat': lat, 'lng': lng}
+    eligible = [
+        (calculate_distance(origin, {'lat': d_lat, 'lng': d_lng}), driver_id)
+        for driver_id, d_lat, d_lng, mask, free_seats in drivers
+        if mask & required_mask == required_mask and free_seats >= seats
+    ]
+    eligible.sort()
+    return eligible[:k]
+
+
+def run(count):
+    drivers = random_drivers(count)
+    requests = random_requests(QUERIES)
+
+    start = time.perf_counter()
+    index = DriverIndex()
+    for driver_id, lat, lng, mask, seats in drivers:
+        index.upsert(driver_id, lat, lng, mask, seats)
+    build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for lat, lng, required_mask, seats in requests:
+        index.nearest(lat, lng, k=5, required_mask=required_mask, seats=seats)
+    indexed = (time.perf_counter() - start) / len(requests)
+
+    # Brute force is slow, time a sample and check the answers agree
+    sample = requests[:20]
+    start = time.perf_counter()
+    expected = [brute_force(drivers, *request) for request in sample]
+    brute = (time.perf_counter() - start) / len(sample)
+    for request, matches in zip(sample, expected):
+        lat, lng, required_mask, seats = request
+        found = index.nearest(lat, lng, k=5, required_mask=required_mask, seats=seats)
+        assert [driver_id for _, driver_id in found] == [driver_id for _, driver_id in matches]
+
+    print(f"{count:>8} drivers | build {build * 1000:8.1f} ms | "
+          f"nearest {indexed * 1000:7.3f} ms/query | brute force {brute * 1000:8.2f} ms/query")
+
+
+if __name__ == '__main__':
+    counts = [int(arg) for arg in sys.argv[1:]] or [10_000, 100_000]
+    for count in counts:
+        run(count)
@@ -0,0 +1,295 @@
+# bench_webhooks.py
+
+"""
+Benchmark: end-to-end webhook throughput and latency, fully offline.
+
+Replays conversations against the combined app (app_factory.create_app())
+with Google Maps and Twilio replaced by local fake servers with a
+configurable delay per API (see fake_upstreams.py). Conversations run in
+parallel at a fixed concurrency, the messages of one conversation in order.
+Every run starts from empty databases in a temporary directory.
+
+Reports, per endpoint: requests, p50 / p95 / p99 latency and SQLite
+statements per request; overall throughput; upstream call counts; the
+slowest instrumented spans (see metrics.py); and how long the outbound queue
+took to deliver the queued SMS.
+
+Workload: synthetic SMS, WhatsApp and voice registration + booking
+conversations and driver registrations (--conversations per kind), or a
+recorded one (--replay). A workload is a JSONL file, one request per line,
+in conversation order:
+    {"phone": "+15550000001", "path": "/sms", "form": {"From": "+15550000001", "Body": "hi"}}
+    {"phone": "L-000001", "path": "/api/submit", "json": {...}}
+
+Usage:
+    python bench_webhooks.py --conversations 200 --concurrency 16 --geocode-ms 40 --distance-ms 80
+    python bench_webhooks.py --record workload.jsonl
+    python bench_webhooks.py --replay workload.jsonl --json
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+
+from fake_upstreams import FakeUpstreams
+
+STREETS = ['Main St', 'Oak Ave', 'Broadway', 'Park Ave', 'Elm St', 'Lexington Ave', 'Hudson St',
+           'Madison Ave', 'Spring St', 'Canal St', 'Bleecker St', 'Houston St']
+ZIP_CODES = ['10001', '10002', '10003', '10011', '10012', '10013', '10014', '10016']
+DRAIN_TIMEOUT = 60
+
+
+def _address(rng):
+    return f"{rng.randint(1, 999)} {rng.choice(STREETS)}"
+
+
+def _messaging_conversation(phone, path, rng):
+    sender = f"whatsapp:{phone}" if path == '/whatsapp' else phone
+    bodies = ['hi', f"{rng.randint(1000, 9999)}", rng.choice(['1', '2']), rng.choice(ZIP_CODES),
+              f"{_address(rng)}, {_address(rng)}", '1']
+    return [{'phone': phone, 'path': path, 'form': {'From': sender, 'Body': body}} for body in bodies]
+
+
+def _voice_conversation(phone, rng):
+    steps = [{}, {'Digits': f"{rng.randint(1000, 9999)}"}, {'Digits': rng.choice(['1', '2'])},
+             {'Digits': rng.choice(ZIP_CODES)}, {'SpeechResult': ''},
+             {'SpeechResult': _address(rng)}, {'SpeechResult': _address(rng)}, {'Digits': '1'}]
+    return [{'phone': phone, 'path': '/voice', 'form': {'From': phone, **step}} for step in steps]
+
+
+def _driver_conversation(number, rng):
+    license_number, license_plate = f"L-{number:06d}", f"P{number:06d}"
+    key = license_number
+    form = {
+        'name': f"Driver {number}", 'phone': f"+1444{number:07d}", 'email': f"driver{number}@example.com",
+        'licenseNumber': license_number, 'licensePlate': license_plate,
+        'gender': rng.choice(['Male', 'Female']), 'Model': 'Sedan', 'carColor': 'white',
+        'availableSeats': rng.randint(1, 6), 'isNewCar': False, 'isLuxury': False,
+        'hasWheelchair': rng.random() < 0.1, 'carSeatCount': 0, 'hasBooster': False,
+        'notifyRides': True, 'notifyDeliveries': False, 'PassengerPreference': 'male & female',
+    }
+    return [
+        {'phone': key, 'path': '/api/check-license',
+         'json': {'licenseNumber': license_number, 'licensePlate': license_plate}},
+        {'phone': key, 'path': '/api/submit', 'json': form},
+    ]
+
+
+def generate_workload(conversations, seed=42):
+    """Synthetic requests: `conversations` of each kind, as a flat list in conversation order."""
+    rng = random.Random(seed)
+    requests = []
+    for n in range(1, conversations + 1):
+        requests += _messaging_conversation(f"+1555{n:07d}", '/sms', rng)
+        requests += _messaging_conversation(f"+1556{n:07d}", '/whatsapp', rng)
+        requests += _voice_conversation(f"+1557{n:07d}", rng)
+        requests += _driver_conversation(n, rng)
+    return requests
+
+
+def load_workload(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def save_workload(requests, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        for entry in requests:
+            f.write(json.dumps(entry) + '\n')
+
+
+def group_conversations(requests):
+    """Requests grouped by phone (conversation), keeping their order."""
+    conversations = OrderedDict()
+    for entry in requests:
+        conversations.setdefault(entry['phone'], []).append(entry)
+    return list(conversations.values())
+
+
+def _percentiles(values):
+    values = np.asarray(values) * 1000
+    return {
+        'p50_ms': round(float(np.percentile(values, 50)), 3),
+        'p95_ms': round(float(np.percentile(values, 95)), 3),
+        'p99_ms': round(float(np.percentile(values, 99)), 3),
+    }
+
+
+@contextmanager
+def offline_app(geocode_ms=0.0, distance_ms=0.0, twilio_ms=0.0):
+    """
+    Combined app on fresh databases in a temporary directory, with fake
+    upstreams installed. Once per process: the app modules keep their settings.
+
+    Yields:
+        (Flask, FakeUpstreams)
+    """
+    workdir = tempfile.mkdtemp(prefix='offline-app-')
+    cwd = os.getcwd()
+    os.chdir(workdir)    # Fresh profiles.db, drivers.db, outbound.db, geocode_cache.db
+    # Settings for the app modules, applied before they are imported
+    os.environ.update({
+        'SMS_BACKEND': 'twilio',
+        'DB_COUNT_STATEMENTS': 'true',
+        'REQUEST_LOG': 'false',
+        'OUTBOUND_RATE_PER_SECOND': '1000000',
+        'TWILIO_PHONE_NUMBER': '+15550000000',
+        'GEOCODING_API_KEY': 'offline',
+    })
+    try:
+        import metrics
+        from app_factory import create_app
+
+        app = create_app({'TESTING': True})
+        with FakeUpstreams(geocode_ms, distance_ms, twilio_ms) as upstreams:
+            upstreams.install()
+            metrics.reset()
+            yield app, upstreams
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _wait_for_outbound(database, timeout=DRAIN_TIMEOUT):
+    """Seconds until every queued message left the outbound queue, or None on timeout."""
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        conn = sqlite3.connect(database)
+        try:
+            remaining = conn.execute("SELECT COUNT(*) FROM outbound_messages "
+                                     "WHERE status IN ('pending', 'sending')").fetchone()[0]
+        except sqlite3.OperationalError:
+            remaining = 0   # Nothing was ever queued
+        finally:
+            conn.close()
+        if not remaining:
+            return time.perf_counter() - started
+        time.sleep(0.05)
+    return None
+
+
+def run_benchmark(requests, concurrency=8, geocode_ms=0.0, distance_ms=0.0, twilio_ms=0.0):
+    """
+    Replay requests against a fresh app with fake upstreams.
+
+    Returns:
+        dict: Summary (throughput, per-endpoint latency and DB statements, upstream calls, spans)
+    """
+    with offline_app(geocode_ms, distance_ms, twilio_ms) as (app, upstreams):
+        import metrics
+        import sms_queue
+
+        results = []          # (path, seconds, status, db statements)
+        results_lock = threading.Lock()
+        local = threading.local()
+
+        def run_conversation(conversation):
+            client = getattr(local, 'client', None)
+            if client is None:
+                client = local.client = app.test_client()
+            timings = []
+            for entry in conversation:
+                started = time.perf_counter()
+                if 'json' in entry:
+                    response = client.post(entry['path'], json=entry['json'])
+                else:
+                    response = client.post(entry['path'], data=entry.get('form', {}))
+                elapsed = time.perf_counter() - started
+                log = metrics.last_request() or {}
+                timings.append((entry['path'], elapsed, response.status_code,
+                                log.get('counters', {}).get('db.statements', 0)))
+            with results_lock:
+                results.extend(timings)
+
+        conversations = group_conversations(requests)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='bench') as pool:
+            for future in [pool.submit(run_conversation, c) for c in conversations]:
+                future.result()
+        elapsed = time.perf_counter() - started
+
+        drain_s = _wait_for_outbound(sms_queue.QUEUE_DATABASE)
+
+        endpoints = {}
+        for path in sorted({r[0] for r in results}):
+            rows = [r for r in results if r[0] == path]
+            endpoints[path] = {
+                'requests': len(rows),
+                'errors': sum(r[2] >= 500 for r in rows),
+                **_percentiles([r[1] for r in rows]),
+                'db_statements_per_request': round(sum(r[3] for r in rows) / len(rows), 2),
+            }
+        spans = sorted(metrics.snapshot().items(), key=lambda item: -item[1]['p99_ms'])
+        return {
+            'conversations': len(conversations),
+            'requests': len(results),
+            'concurrency': concurrency,
+            'wall_s': round(elapsed, 3),
+            'throughput_rps': round(len(results) / elapsed, 1) if elapsed else 0.0,
+            'latency': _percentiles([r[1] for r in results]),
+            'endpoints': endpoints,
+            'upstream_calls': dict(upstreams.calls),
+            'outbound_drain_s': round(drain_s, 3) if drain_s is not None else None,
+            'spans': dict(spans),
+        }
+
+
+def print_report(summary):
+    print(f"{summary['requests']} requests in {summary['conversations']} conversations, "
+          f"concurrency {summary['concurrency']}: {summary['throughput_rps']} req/s "
+          f"over {summary['wall_s']}s")
+    latency = summary['latency']
+    print(f"latency p50 {latency['p50_ms']} ms, p95 {latency['p95_ms']} ms, p99 {latency['p99_ms']} ms")
+    print()
+    print(f"{'endpoint':<20} {'requests':>8} {'errors':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'db stmts':>9}")
+    for path, row in summary['endpoints'].items():
+        print(f"{path:<20} {row['requests']:>8} {row['errors']:>6} {row['p50_ms']:>9.2f} "
+              f"{row['p95_ms']:>9.2f} {row['p99_ms']:>9.2f} {row['db_statements_per_request']:>9.2f}")
+    print()
+    print(f"upstream calls: {summary['upstream_calls']}")
+    drain = summary['outbound_drain_s']
+    print(f"outbound queue drained in {drain}s" if drain is not None else "outbound queue did not drain")
+    print()
+    print(f"{'span':<36} {'count':>7} {'mean ms':>9} {'p99 ms':>9}")
+    for name, row in list(summary['spans'].items())[:12]:
+        print(f"{name:<36} {row['count']:>7} {row['mean_ms']:>9.2f} {row['p99_ms']:>9.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the webhooks offline.')
+    parser.add_argument('--conversations', type=int, default=50, help='Synthetic conversations per kind')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--geocode-ms', type=float, default=30.0, help='Fake Geocoding API delay')
+    parser.add_argument('--distance-ms', type=float, default=60.0, help='Fake Distance Matrix delay')
+    parser.add_argument('--twilio-ms', type=float, default=100.0, help='Fake Twilio Messages delay')
+    parser.add_argument('--record', help='Write the generated workload to this JSONL file')
+    parser.add_argument('--replay', help='Run a recorded JSONL workload instead of generating one')
+    parser.add_argument('--json', action='store_true', help='Print the summary as JSON')
+    args = parser.parse_args(argv)
+
+    requests = load_workload(args.replay) if args.replay else generate_workload(args.conversations, args.seed)
+    if args.record:
+        save_workload(requests, args.record)
+        print(f"Workload saved to {args.record}")
+
+    summary = run_benchmark(requests, args.concurrency, args.geocode_ms, args.distance_ms, args.twilio_ms)
+    if args.json:
+        print(json.dumps(summary))
+    else:
+        print_report(summary)
+
+
+if __name__ == '__main__':
+    main()
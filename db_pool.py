@@ -0,0 +1,131 @@
+# db_pool.py
+
+"""
+Shared SQLite Connection Layer
+
+Both the driver registration app (app.py) and the passenger service
+(passenger_reg.py) open their databases through this module. Instead of
+connecting and closing on every query, each thread keeps one connection per
+database file and reuses it for the lifetime of the thread.
+
+Every new connection is configured with:
+- WAL journal mode, so readers never block the single writer
+- tuned pragmas (synchronous, busy timeout, cache size, temp store)
+- a larger prepared-statement cache, so repeated queries skip re-parsing
+
+With DB_COUNT_STATEMENTS=true every executed statement is also counted
+against the current request (see metrics.py), for benchmarks; it costs a
+Python call per statement, so it is off by default.
+"""
+
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import metrics
+
+# Seconds a connection waits on a locked database before raising
+BUSY_TIMEOUT = 20
+
+# Number of compiled statements kept per connection (sqlite3 default is 128)
+STATEMENT_CACHE_SIZE = 256
+
+# Applied once to every new connection
+PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',  # Safe with WAL, avoids an fsync per commit
+    f'PRAGMA busy_timeout={BUSY_TIMEOUT * 1000}',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-8000',    # ~8 MB page cache per connection
+)
+
+# Count executed statements per request (see metrics.count)
+COUNT_STATEMENTS = os.getenv('DB_COUNT_STATEMENTS', 'false').lower() in ('1', 'true', 'yes')
+
+_local = threading.local()
+
+
+def _statement_executed(statement):
+    metrics.count('db.statements')
+
+
+def _open_connection(database):
+    """
+    Open and configure a new SQLite connection.
+
+    Args:
+        database (str): Path of the SQLite database file
+
+    Returns:
+        sqlite3.Connection: Configured connection
+    """
+    conn = sqlite3.connect(
+        database,
+        timeout=BUSY_TIMEOUT,
+        cached_statements=STATEMENT_CACHE_SIZE,
+    )
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    if COUNT_STATEMENTS:
+        conn.set_trace_callback(_statement_executed)
+    return conn
+
+
+def get_connection(database):
+    """
+    Return this thread's connection to the given database, opening it on first use.
+
+    Connections inherited from a parent process (e.g. after a pre-fork server
+    forks its workers) are discarded and reopened, since SQLite handles must
+    not be shared across processes.
+
+    Args:
+        database (str): Path of the SQLite database file
+
+    Returns:
+        sqlite3.Connection: Reusable connection owned by the calling thread
+    """
+    if getattr(_local, 'pid', None) != os.getpid():
+        _local.pid = os.getpid()
+        _local.connections = {}
+
+    conn = _local.connections.get(database)
+    if conn is None:
+        conn = _open_connection(database)
+        _local.connections[database] = conn
+    return conn
+
+
+@contextmanager
+def transaction(database):
+    """
+    Context manager that runs a block inside a transaction on the pooled connection.
+    Commits on success and rolls back if the block raises.
+
+    Yields:
+        sqlite3.Connection: This thread's connection to the database
+
+    Usage:
+        with transaction('profiles.db') as conn:
+            conn.execute(query, params)
+    """
+    conn = get_connection(database)
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    else:
+        conn.commit()
+
+
+def close_connections():
+    """Close every connection owned by the calling thread."""
+    connections = getattr(_local, 'connections', None) or {}
+    for conn in connections.values():
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+    _local.connections = {}
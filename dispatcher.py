@@ -0,0 +1,330 @@
+# dispatcher.py
+
+"""
+Batched Ride Dispatch Scheduler
+
+Runs as its own process, next to the Flask apps:
+
+    python dispatcher.py
+
+Every DISPATCH_INTERVAL seconds it takes the rides saved as 'pending' in
+profiles.db, solves one assignment problem for the whole batch against the
+available drivers in drivers.db, marks the rides 'assigned' and the drivers
+busy, and queues an SMS to both the passenger and the driver through the
+outbound queue (sms_queue.py).
+
+Batch solving:
+- candidate drivers per ride come from the grid index (driver_matching.py),
+  which already applies capability and passenger-preference filters
+- pickup ETAs for the whole batch are one vectorized distance_matrix call
+- the assignment minimising total ETA is found with SciPy's Hungarian
+  solver when SciPy is installed (pip install scipy), otherwise with a
+  greedy cheapest-pair-first pass
+
+Rides nobody can take are retried on the next batches and marked
+'unassigned' (passenger notified) after DISPATCH_TIMEOUT seconds.
+
+Simulation / replay: python simulate_dispatch.py
+"""
+
+import os
+import signal
+import time
+from datetime import datetime
+
+import numpy as np
+
+import http_client
+from db_pool import get_connection
+from driver_matching import load_driver_index, ride_requirements
+from geo_distance import distance_matrix
+from records import Driver, Ride, fetch_all, fetch_one
+import services
+
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:
+    linear_sum_assignment = None
+
+# Configuration constants
+DISPATCH_INTERVAL = float(os.getenv('DISPATCH_INTERVAL', '1'))        # Seconds between batches
+DISPATCH_BATCH_SIZE = int(os.getenv('DISPATCH_BATCH_SIZE', '500'))
+DISPATCH_CANDIDATES = int(os.getenv('DISPATCH_CANDIDATES', '8'))      # Nearest drivers considered per ride
+DISPATCH_TIMEOUT = float(os.getenv('DISPATCH_TIMEOUT', '300'))        # Seconds before giving up on a ride
+DRIVER_REFRESH_INTERVAL = float(os.getenv('DRIVER_REFRESH_INTERVAL', '5'))
+AVERAGE_SPEED_KMH = float(os.getenv('AVERAGE_SPEED_KMH', '30'))
+GEOCODE_URL = f"{os.getenv('GOOGLE_MAPS_API_URL', 'https://maps.googleapis.com/maps/api')}/geocode/json"
+
+
+def greedy_assignment(cost):
+    """
+    Assign cheapest (ride, driver) pairs first.
+
+    Args:
+        cost (numpy.ndarray): (rides, drivers) matrix, inf where not allowed
+
+    Returns:
+        list: (ride_index, driver_index) pairs
+    """
+    taken_rides, taken_drivers, pairs = set(), set(), []
+    for flat in np.argsort(cost, axis=None):
+        r, d = divmod(int(flat), cost.shape[1])
+        if not np.isfinite(cost[r, d]):
+            break
+        if r in taken_rides or d in taken_drivers:
+            continue
+        taken_rides.add(r)
+        taken_drivers.add(d)
+        pairs.append((r, d))
+    return pairs
+
+
+def optimal_assignment(cost):
+    """Minimum total cost assignment (SciPy's Hungarian solver); falls back to greedy."""
+    if linear_sum_assignment is None:
+        return greedy_assignment(cost)
+    allowed = np.isfinite(cost)
+    # Forbidden pairs get a cost no real assignment can reach
+    penalty = (cost[allowed].max() + 1) * (min(cost.shape) + 1) if allowed.any() else 1.0
+    rows, cols = linear_sum_assignment(np.where(allowed, cost, penalty))
+    return [(int(r), int(d)) for r, d in zip(rows, cols) if allowed[r, d]]
+
+
+SOLVERS = {'greedy': greedy_assignment, 'optimal': optimal_assignment}
+
+
+def geocode_location(address):
+    """Coordinates of a formatted address, {'lat', 'lng'} or None (cached, see geocode_cache.py)."""
+    response = services.geocode_cache().get(address)
+    if response is None:
+        response = http_client.get_json(GEOCODE_URL, {'address': address,
+                                                      'key': os.getenv('GEOCODING_API_KEY')})
+        services.geocode_cache().put(address, None, response)
+    if response.get('status') == 'OK' and response.get('results'):
+        return response['results'][0]['geometry']['location']
+    return None
+
+
+class Dispatcher:
+    """
+    Assigns pending rides to drivers in micro-batches.
+
+    Args:
+        profiles_db (str): Database with the rides and profiles tables
+        drivers_db (str): Database with the drivers and driver_locations tables
+        outbound_queue: OutboundQueue (or anything with enqueue_many) for notifications
+        solver (str): 'optimal' or 'greedy'
+        geocoder (callable): address -> {'lat', 'lng'} or None, for rides saved without coordinates
+        from_number (str): Sender number for notifications (default TWILIO_PHONE_NUMBER)
+    """
+
+    def __init__(self, profiles_db='profiles.db', drivers_db='drivers.db', outbound_queue=None,
+                 solver='optimal', geocoder=geocode_location, from_number=None):
+        self.profiles_db = profiles_db
+        self.drivers_db = drivers_db
+        self.outbound_queue = outbound_queue
+        self.solve = SOLVERS[solver]
+        self.geocoder = geocoder
+        self.from_number = from_number or os.getenv('TWILIO_PHONE_NUMBER')
+        self.driver_index = None
+        self._index_loaded_at = 0.0
+        self.stats = {'batches': 0, 'assigned': 0, 'unassigned': 0, 'solve_seconds': 0.0, 'pickup_km': 0.0}
+
+    def refresh_drivers(self, now, force=False):
+        """Reload the driver index from drivers.db every DRIVER_REFRESH_INTERVAL seconds."""
+        if force or self.driver_index is None or now - self._index_loaded_at >= DRIVER_REFRESH_INTERVAL:
+            self.driver_index = load_driver_index(self.drivers_db)
+            self._index_loaded_at = now
+
+    def pending_rides(self):
+        conn = get_connection(self.profiles_db)
+        return fetch_all(conn, Ride, '''SELECT * FROM rides WHERE status = 'pending'
+                                        ORDER BY created_at LIMIT ?''', (DISPATCH_BATCH_SIZE,))
+
+    def _locate(self, rides):
+        """Fill in missing pickup coordinates, storing them so each address is geocoded once."""
+        located, updates = [], []
+        for ride in rides:
+            if ride.pickup_lat is None:
+                try:
+                    location = self.geocoder(ride.pickup)
+                except Exception as e:
+                    print(f"Dispatch geocoding error for ride {ride.id}: {str(e)}")
+                    location = None
+                if not location:
+                    continue
+                ride = ride._replace(pickup_lat=location['lat'], pickup_lng=location['lng'])
+                updates.append((ride.pickup_lat, ride.pickup_lng, ride.id))
+            located.append(ride)
+        if updates:
+            conn = get_connection(self.profiles_db)
+            conn.executemany('UPDATE rides SET pickup_lat = ?, pickup_lng = ? WHERE id = ?', updates)
+            conn.commit()
+        return located
+
+    def _passenger_genders(self, rides):
+        conn = get_connection(self.profiles_db)
+        phones = sorted({ride.phone_number for ride in rides})
+        placeholders = ','.join('?' * len(phones))
+        rows = conn.execute(f'SELECT phone_number, gender FROM profiles WHERE phone_number IN ({placeholders})',
+                            phones)
+        return dict(rows.fetchall())
+
+    def plan(self, rides):
+        """
+        Solve the assignment for a batch of located rides.
+
+        Returns:
+            list: (ride, driver_id, distance_km) for every ride that got a driver
+        """
+        genders = self._passenger_genders(rides) if rides else {}
+        candidates = []
+        for ride in rides:
+            matches = self.driver_index.nearest(
+                ride.pickup_lat, ride.pickup_lng, k=DISPATCH_CANDIDATES,
+                required_mask=ride_requirements(passenger_gender=genders.get(ride.phone_number)))
+            candidates.append([driver_id for _, driver_id in matches])
+
+        driver_ids = sorted({driver_id for ids in candidates for driver_id in ids})
+        if not driver_ids:
+            return []
+        column = {driver_id: i for i, driver_id in enumerate(driver_ids)}
+        positions = np.array([self.driver_index.position(driver_id) for driver_id in driver_ids])
+        pickups = np.array([(ride.pickup_lat, ride.pickup_lng) for ride in rides])
+
+        # Pickup distance for every (ride, candidate driver) pair in one call
+        distances = distance_matrix(pickups, positions)
+        cost = np.full(distances.shape, np.inf)
+        for r, ids in enumerate(candidates):
+            cols = [column[driver_id] for driver_id in ids]
+            cost[r, cols] = distances[r, cols]
+
+        return [(rides[r], driver_ids[d], float(distances[r, d])) for r, d in self.solve(cost)]
+
+    def _commit(self, assignments, now):
+        """Mark rides assigned and drivers busy; returns the assignments that won the race."""
+        assigned_at = datetime.fromtimestamp(now)
+        conn = get_connection(self.profiles_db)
+        committed = []
+        for ride, driver_id, distance in assignments:
+            c = conn.execute('''UPDATE rides SET status = 'assigned', driver_id = ?, assigned_at = ?
+                                WHERE id = ? AND status = 'pending' ''', (driver_id, assigned_at, ride.id))
+            if c.rowcount:
+                committed.append((ride, driver_id, distance))
+        conn.commit()
+
+        drivers_conn = get_connection(self.drivers_db)
+        drivers_conn.executemany('UPDATE driver_locations SET is_available = 0 WHERE driver_id = ?',
+                                 [(driver_id,) for _, driver_id, _ in committed])
+        drivers_conn.commit()
+        for _, driver_id, _ in committed:
+            self.driver_index.remove(driver_id)
+        return committed
+
+    def _notify_assigned(self, committed):
+        if self.outbound_queue is None or not committed:
+            return
+        conn = get_connection(self.drivers_db)
+        messages = []
+        for ride, driver_id, distance in committed:
+            driver = fetch_one(conn, Driver, 'SELECT * FROM drivers WHERE id = ?', (driver_id,))
+            eta = max(1, round(distance / AVERAGE_SPEED_KMH * 60))
+            messages.append((
+                ride.phone_number,
+                f"Your driver {driver.name} is about {eta} min away in a {driver.car_color} {driver.model}, "
+                f"plate {driver.license_plate}.",
+                self.from_number, f"ride-assigned:{ride.id}:passenger"))
+            messages.append((
+                driver.phone,
+                f"New ride: pick up at {ride.pickup} ({distance:.1f} km away), going to {ride.destination}. "
+                f"Passenger: {ride.phone_number}",
+                self.from_number, f"ride-assigned:{ride.id}:driver"))
+        self.outbound_queue.enqueue_many(messages)
+
+    def _expire(self, rides, now):
+        """Give up on rides that waited longer than DISPATCH_TIMEOUT."""
+        expired = [ride for ride in rides
+                   if ride.created_at and now - _timestamp(ride.created_at) >= DISPATCH_TIMEOUT]
+        if not expired:
+            return 0
+        conn = get_connection(self.profiles_db)
+        conn.executemany('''UPDATE rides SET status = 'unassigned' WHERE id = ? AND status = 'pending' ''',
+                         [(ride.id,) for ride in expired])
+        conn.commit()
+        if self.outbound_queue is not None:
+            self.outbound_queue.enqueue_many([
+                (ride.phone_number,
+                 "Sorry, no driver is available for your ride right now. Please book again later.",
+                 self.from_number, f"ride-unassigned:{ride.id}")
+                for ride in expired])
+        return len(expired)
+
+    def run_batch(self, now=None):
+        """
+        Dispatch one batch of pending rides.
+
+        Args:
+            now (float): Current time as a Unix timestamp (simulations pass their own clock)
+
+        Returns:
+            dict: {'pending', 'assigned', 'unassigned', 'solve_ms'} for this batch
+        """
+        now = time.time() if now is None else now
+        self.refresh_drivers(now)
+        rides = self.pending_rides()
+        located = self._locate(rides)
+
+        start = time.perf_counter()
+        assignments = self.plan(located)
+        solve_seconds = time.perf_counter() - start
+
+        committed = self._commit(assignments, now)
+        self._notify_assigned(committed)
+        assigned_ids = {ride.id for ride, _, _ in committed}
+        unassigned = self._expire([ride for ride in rides if ride.id not in assigned_ids], now)
+
+        self.stats['batches'] += 1
+        self.stats['assigned'] += len(committed)
+        self.stats['unassigned'] += unassigned
+        self.stats['solve_seconds'] += solve_seconds
+        self.stats['pickup_km'] += sum(distance for _, _, distance in committed)
+        return {'pending': len(rides), 'assigned': len(committed), 'unassigned': unassigned,
+                'solve_ms': solve_seconds * 1000}
+
+    def run_forever(self, interval=DISPATCH_INTERVAL):
+        """Run batches every `interval` seconds until SIGINT / SIGTERM."""
+        stopping = []
+        signal.signal(signal.SIGTERM, lambda *_: stopping.append(True))
+        try:
+            while not stopping:
+                started = time.monotonic()
+                try:
+                    result = self.run_batch()
+                    if result['pending']:
+                        print(f"Dispatch batch: {result}")
+                except Exception as e:
+                    print(f"Dispatch error: {str(e)}")
+                time.sleep(max(0.0, interval - (time.monotonic() - started)))
+        except KeyboardInterrupt:
+            pass
+
+
+def _timestamp(value):
+    """Unix time of a TIMESTAMP column value (datetime or ISO string)."""
+    if isinstance(value, datetime):
+        return value.timestamp()
+    return datetime.fromisoformat(str(value)).timestamp()
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+
+    from migrations import DRIVERS_MIGRATIONS, PROFILES_MIGRATIONS, migrate
+
+    load_dotenv()
+    migrate('profiles.db', PROFILES_MIGRATIONS)
+    migrate('drivers.db', DRIVERS_MIGRATIONS)
+    dispatcher = Dispatcher(outbound_queue=services.outbound_queue())
+    solver = 'Hungarian (SciPy)' if linear_sum_assignment is not None else 'greedy'
+    print(f"Dispatcher running every {DISPATCH_INTERVAL}s, {solver} assignment")
+    dispatcher.run_forever()
@@ -0,0 +1,430 @@
+# driver_import.py
+
+"""
+Bulk Driver Import
+
+Imports fleet partner driver lists (thousands of rows) through
+POST /api/drivers/import (see app.py) or from the command line:
+
+    python driver_import.py drivers.csv [--errors errors.csv] [--no-sms] [--wait]
+
+Rows are streamed and processed in chunks of CHUNK_SIZE:
+1. each row is validated and converted (same fields as /api/submit)
+2. duplicates are rejected: against earlier rows of the same import, and
+   against the drivers table with one set-based query per chunk over the
+   license_number / license_plate unique indexes
+3. the remaining rows are inserted with executemany in one transaction per
+   chunk; if a concurrent registration wins a race for a license, the chunk
+   falls back to row-by-row inserts so only that row fails
+4. the confirmation SMS of the chunk are queued with one enqueue_many call
+
+Every rejected row is reported with its row number (1 = first data row) and
+the reason; the rows around it are still imported. JSON lines are passed in
+unparsed, so a line that is not valid JSON is rejected like any other bad
+row. JSON arrays are read one element at a time (read_json_array). If the
+input itself becomes unreadable (bad encoding, broken CSV), the
+import stops there and reports what was imported up to that row.
+
+Input columns (CSV header / JSON keys), as in the registration form:
+    name, phone, email, licenseNumber, licensePlate, gender, Model, carColor,
+    availableSeats, PassengerPreference (required)
+    isNewCar, isLuxury, hasWheelchair, hasBooster, notifyRides,
+    notifyDeliveries (true/false, 1/0, yes/no), carSeatCount (0-2)
+"""
+
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import sys
+import time
+
+from db_pool import get_connection
+
+# Configuration constants
+CHUNK_SIZE = int(os.getenv('DRIVER_IMPORT_CHUNK_SIZE', '500'))
+DATABASE = 'drivers.db'
+
+GENDERS = ('male', 'female')
+PASSENGER_PREFERENCES = ('male only', 'female only', 'male & female')
+MAX_SEATS = 15
+
+INSERT_DRIVER = '''
+    INSERT INTO drivers (
+        name, phone, email, license_number, license_plate,
+        gender, Model, car_color, available_seats,
+        is_new_car, is_luxury, has_wheelchair,
+        car_seat_count, has_booster,
+        notify_rides, notify_deliveries, PassengerPreference
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+REQUIRED_FIELDS = ('name', 'phone', 'email', 'licenseNumber', 'licensePlate', 'gender',
+                   'Model', 'carColor', 'availableSeats', 'PassengerPreference')
+
+
+def _text(row, field):
+    value = row.get(field)
+    value = '' if value is None else str(value).strip()
+    if not value and field in REQUIRED_FIELDS:
+        raise ValueError(f"{field} is required")
+    return value
+
+
+def _flag(row, field):
+    value = row.get(field)
+    if isinstance(value, bool):
+        return value
+    text = '' if value is None else str(value).strip().lower()
+    if text in ('', '0', 'false', 'no', 'n', 'off'):
+        return False
+    if text in ('1', 'true', 'yes', 'y', 'on'):
+        return True
+    raise ValueError(f"{field} must be true or false")
+
+
+def _integer(row, field, low, high, default=None):
+    value = row.get(field)
+    if value is None or str(value).strip() == '':
+        if default is None:
+            raise ValueError(f"{field} is required")
+        return default
+    try:
+        number = int(str(value).strip())
+    except ValueError:
+        raise ValueError(f"{field} must be a number") from None
+    if not low <= number <= high:
+        raise ValueError(f"{field} must be between {low} and {high}")
+    return number
+
+
+def parse_driver(row):
+    """
+    Validate one input row and convert it to drivers column values.
+
+    Args:
+        row (dict or str): CSV row or JSON object keyed like the registration
+            form, or one unparsed JSON line
+
+    Returns:
+        tuple: Values in INSERT_DRIVER order
+
+    Raises:
+        ValueError: With a message naming the offending field
+    """
+    if isinstance(row, str):
+        try:
+            row = json.loads(row)
+        except ValueError as e:
+            raise ValueError(f"Invalid JSON: {str(e)}") from None
+    if not isinstance(row, dict):
+        raise ValueError("row must be an object with the registration fields")
+    gender = _text(row, 'gender')
+    if gender.lower() not in GENDERS:
+        raise ValueError("gender must be Male or Female")
+    preference = _text(row, 'PassengerPreference').lower()
+    if preference not in PASSENGER_PREFERENCES:
+        raise ValueError(f"PassengerPreference must be one of: {', '.join(PASSENGER_PREFERENCES)}")
+    email = _text(row, 'email')
+    if '@' not in email:
+        raise ValueError("email is not valid")
+    return (
+        _text(row, 'name'), _text(row, 'phone'), email,
+        _text(row, 'licenseNumber'), _text(row, 'licensePlate'),
+        gender, _text(row, 'Model'), _text(row, 'carColor'),
+        _integer(row, 'availableSeats', 1, MAX_SEATS),
+        _flag(row, 'isNewCar'), _flag(row, 'isLuxury'), _flag(row, 'hasWheelchair'),
+        _integer(row, 'carSeatCount', 0, 2, default=0), _flag(row, 'hasBooster'),
+        _flag(row, 'notifyRides'), _flag(row, 'notifyDeliveries'), preference,
+    )
+
+
+def find_registered(conn, license_numbers, license_plates):
+    """
+    Which of the given license numbers and plates are already registered,
+    in one query using both unique indexes.
+
+    Returns:
+        tuple: (set of registered numbers, set of registered plates)
+    """
+    rows = conn.execute('''SELECT license_number, license_plate FROM drivers
+                           WHERE license_number IN (SELECT value FROM json_each(?))
+                              OR license_plate IN (SELECT value FROM json_each(?))''',
+                        (json.dumps(list(license_numbers)), json.dumps(list(license_plates)))).fetchall()
+    numbers = set(license_numbers)
+    plates = set(license_plates)
+    return ({number for number, _ in rows if number in numbers},
+            {plate for _, plate in rows if plate in plates})
+
+
+def _license_number(row):
+    """licenseNumber of a raw row for error reports, None if it cannot be read."""
+    if isinstance(row, str):
+        try:
+            row = json.loads(row)
+        except ValueError:
+            return None
+    return row.get('licenseNumber') if isinstance(row, dict) else None
+
+
+def read_json_array(stream, read_size=65536):
+    """
+    Yield the elements of a JSON array one at a time, reading the text stream
+    in read_size pieces instead of loading the whole document.
+
+    Raises:
+        ValueError: If the input is not a JSON array or stops being valid JSON
+    """
+    decoder = json.JSONDecoder()
+    buffer, position, at_end = '', 0, False
+
+    def read_more():
+        nonlocal buffer, position, at_end
+        data = stream.read(read_size)
+        if not data:
+            at_end = True
+            return False
+        buffer = buffer[position:] + data
+        position = 0
+        return True
+
+    def next_char():
+        """Skip whitespace, return the next character ('' at the end of the input)."""
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position].isspace():
+                position += 1
+            if position < len(buffer):
+                return buffer[position]
+            if not read_more():
+                return ''
+
+    if next_char() != '[':
+        raise ValueError("Expected a JSON array of drivers")
+    position += 1
+    if next_char() == ']':
+        return
+    while True:
+        next_char()
+        while True:
+            try:
+                element, end = decoder.raw_decode(buffer, position)
+            except ValueError as e:
+                # The element may just be cut off at the end of what was read so far
+                if at_end or not read_more():
+                    raise ValueError(f"Invalid JSON: {getattr(e, 'msg', str(e))}") from None
+                continue
+            # A number ending the buffer ("-15" of "-1500.5") may continue in the next read
+            if (end == len(buffer) or buffer[end] not in ' \t\r\n,]') and not at_end and read_more():
+                continue
+            break
+        position = end
+        yield element
+        separator = next_char()
+        if separator == ']':
+            return
+        if separator != ',':
+            raise ValueError("Invalid JSON: expected ',' or ']' after a driver")
+        position += 1
+
+
+def _chunks(rows, size, unreadable):
+    """(row_number, row) lists of up to size rows; calls unreadable(row_number, error) and stops on bad input."""
+    chunk = []
+    row_number = 0
+    rows = iter(rows)
+    while True:
+        try:
+            row = next(rows)
+        except StopIteration:
+            break
+        except (csv.Error, ValueError) as e:   # Broken CSV, bad encoding or JSON array
+            unreadable(row_number + 1, f"Unreadable input, import stopped at this row: {str(e)}")
+            break
+        row_number += 1
+        chunk.append((row_number, row))
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _insert_chunk(conn, drivers):
+    """
+    Insert (row_number, values) pairs in one transaction.
+
+    Returns:
+        tuple: (inserted pairs, [(row_number, error)] for rows that lost a uniqueness race)
+    """
+    try:
+        conn.executemany(INSERT_DRIVER, [values for _, values in drivers])
+        conn.commit()
+        return drivers, []
+    except sqlite3.IntegrityError:
+        conn.rollback()
+
+    inserted, errors = [], []
+    try:
+        for row_number, values in drivers:
+            try:
+                conn.execute(INSERT_DRIVER, values)
+                inserted.append((row_number, values))
+            except sqlite3.IntegrityError:
+                errors.append((row_number, "License details already registered"))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return inserted, errors
+
+
+def import_drivers(rows, database=DATABASE, outbound_queue=None, from_number=None, registry=None,
+                   chunk_size=CHUNK_SIZE, queued_keys=None):
+    """
+    Import driver rows in chunks.
+
+    Args:
+        rows (iterable): Dicts keyed like the registration form (e.g. a csv.DictReader)
+            or unparsed JSON lines
+        database (str): drivers.db path
+        outbound_queue: OutboundQueue for confirmation SMS, None to send none
+        from_number (str): SMS sender number
+        registry (LicenseRegistry): Registry to add imported licenses to, optional
+        chunk_size (int): Rows per transaction
+        queued_keys (list): Receives the dedup keys of the confirmation SMS queued, optional
+
+    Returns:
+        dict: {'rows', 'imported', 'failed', 'smsQueued', 'errors': [{'row', 'licenseNumber', 'error'}]}
+    """
+    conn = get_connection(database)
+    seen_numbers, seen_plates = set(), set()
+    result = {'rows': 0, 'imported': 0, 'failed': 0, 'smsQueued': 0, 'errors': []}
+
+    def reject(row_number, license_number, error):
+        result['failed'] += 1
+        result['errors'].append({'row': row_number, 'licenseNumber': license_number, 'error': error})
+
+    def unreadable(row_number, error):
+        result['rows'] += 1
+        reject(row_number, None, error)
+
+    for chunk in _chunks(rows, chunk_size, unreadable):
+        result['rows'] += len(chunk)
+        drivers = []
+        for row_number, row in chunk:
+            try:
+                values = parse_driver(row)
+            except ValueError as e:
+                reject(row_number, _license_number(row), str(e))
+                continue
+            license_number, license_plate = values[3], values[4]
+            if license_number in seen_numbers or license_plate in seen_plates:
+                reject(row_number, license_number, "Duplicate license number or plate in this import")
+                continue
+            seen_numbers.add(license_number)
+            seen_plates.add(license_plate)
+            drivers.append((row_number, values))
+        if not drivers:
+            continue
+
+        registered_numbers, registered_plates = find_registered(
+            conn, [values[3] for _, values in drivers], [values[4] for _, values in drivers])
+        if registered_numbers or registered_plates:
+            new_drivers = []
+            for row_number, values in drivers:
+                if values[3] in registered_numbers or values[4] in registered_plates:
+                    reject(row_number, values[3], "License details already registered")
+                else:
+                    new_drivers.append((row_number, values))
+            drivers = new_drivers
+
+        inserted, race_errors = _insert_chunk(conn, drivers)
+        if race_errors:
+            license_numbers = {row_number: values[3] for row_number, values in drivers}
+            for row_number, error in race_errors:
+                reject(row_number, license_numbers[row_number], error)
+        result['imported'] += len(inserted)
+
+        if registry is not None:
+            for _, values in inserted:
+                registry.add(values[3], values[4])
+        if outbound_queue is not None and inserted:
+            messages = [
+                (values[1],
+                 f"Thank you {values[0]} license no- {values[3]} for registering as a driver!",
+                 from_number,
+                 f"driver-registration:{values[3]}")
+                for _, values in inserted
+            ]
+            try:
+                result['smsQueued'] += outbound_queue.enqueue_many(messages)
+                if queued_keys is not None:
+                    queued_keys.extend(message[3] for message in messages)
+            except Exception as e:
+                print(f"Twilio SMS Error: {str(e)}")
+
+    result['errors'].sort(key=lambda error: error['row'])
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Import drivers from a CSV file.')
+    parser.add_argument('csv_file', help="CSV with a header row ('-' for stdin)")
+    parser.add_argument('--database', default=DATABASE)
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--errors', help='Write rejected rows (row, licenseNumber, error) to this CSV')
+    parser.add_argument('--no-sms', action='store_true', help='Do not queue confirmation SMS')
+    parser.add_argument('--wait', action='store_true',
+                        help="Stay until this import's SMS are sent (by default the app's outbound queue workers "
+                             "send them)")
+    args = parser.parse_args(argv)
+
+    from migrations import DRIVERS_MIGRATIONS, migrate
+    migrate(args.database, DRIVERS_MIGRATIONS)
+
+    outbound_queue = from_number = None
+    queued_keys = []
+    if not args.no_sms:
+        import services
+        outbound_queue, from_number = services.outbound_queue(), services.TWILIO_PHONE_NUMBER
+
+    source = sys.stdin if args.csv_file == '-' else open(args.csv_file, newline='', encoding='utf-8-sig')
+    try:
+        result = import_drivers(csv.DictReader(source), args.database, outbound_queue, from_number,
+                                chunk_size=args.chunk_size, queued_keys=queued_keys)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+
+    print(f"{result['imported']} of {result['rows']} drivers imported, {result['failed']} rejected, "
+          f"{result['smsQueued']} confirmation SMS queued")
+    if args.errors:
+        with open(args.errors, 'w', newline='', encoding='utf-8') as out:
+            writer = csv.DictWriter(out, fieldnames=['row', 'licenseNumber', 'error'])
+            writer.writeheader()
+            writer.writerows(result['errors'])
+    else:
+        for error in result['errors'][:20]:
+            print(f"row {error['row']} ({error['licenseNumber']}): {error['error']}")
+        if len(result['errors']) > 20:
+            print(f"... {len(result['errors']) - 20} more, use --errors to write them all")
+
+    if outbound_queue is not None:
+        if args.wait and queued_keys:
+            print("Sending confirmation SMS (Ctrl+C to leave the rest queued)...")
+            try:
+                # Only this import's messages; retries waiting out their backoff are left to the app
+                while outbound_queue.outstanding(queued_keys):
+                    time.sleep(1)
+            except KeyboardInterrupt:
+                pass
+        # Let a send in progress finish, the rest stays queued for the app's workers
+        outbound_queue.stop()
+        print(f"Outbound queue: {outbound_queue.counts()}")
+    return 1 if result['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
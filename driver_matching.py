@@ -0,0 +1,291 @@
+# driver_matching.py
+
+"""
+Driver Matching Engine
+
+Finds the k nearest registered drivers able to take a ride.
+
+Driver positions live in an in-memory grid of CELL_DEGREES x CELL_DEGREES
+cells (a fixed-precision, geohash-style bucketing): a search scans rings of
+cells around the pickup point, nearest ring first, and stops as soon as no
+unscanned cell can hold a closer driver than the k-th best found so far.
+
+Capabilities (accessibility equipment, car type, accepted passenger
+genders) are folded into one integer bitmask per driver when it is indexed,
+so eligibility is a single `mask & required == required` test instead of
+several column comparisons per candidate.
+
+Locations are persisted in the driver_locations table of drivers.db
+(see migrations.py); load_driver_index() rebuilds the index from it.
+
+Benchmark: python bench_matching.py
+"""
+
+import heapq
+import math
+import os
+import threading
+from datetime import datetime
+
+from db_pool import get_connection
+from geo_distance import calculate_distance
+from records import Driver
+
+# Configuration constants
+CELL_DEGREES = float(os.getenv('MATCH_CELL_DEGREES', '0.01'))        # ~1.1 km cells
+MAX_MATCH_RADIUS_KM = float(os.getenv('MAX_MATCH_RADIUS_KM', '50'))
+KM_PER_DEGREE = 111.2
+
+# Capability bits
+CAP_NEW_CAR = 1 << 0
+CAP_LUXURY = 1 << 1
+CAP_WHEELCHAIR = 1 << 2
+CAP_BOOSTER = 1 << 3
+CAP_CAR_SEAT = 1 << 4            # At least one car seat
+CAP_TWO_CAR_SEATS = 1 << 5
+CAP_ACCEPTS_MALE = 1 << 6        # From PassengerPreference
+CAP_ACCEPTS_FEMALE = 1 << 7
+
+
+def capability_mask(driver):
+    """
+    Fold a driver's capability columns into a bitmask.
+
+    Args:
+        driver (records.Driver): Driver row
+
+    Returns:
+        int: CAP_* bits the driver offers
+    """
+    mask = 0
+    if driver.is_new_car:
+        mask |= CAP_NEW_CAR
+    if driver.is_luxury:
+        mask |= CAP_LUXURY
+    if driver.has_wheelchair:
+        mask |= CAP_WHEELCHAIR
+    if driver.has_booster:
+        mask |= CAP_BOOSTER
+    car_seats = driver.car_seat_count or 0
+    if car_seats >= 1:
+        mask |= CAP_CAR_SEAT
+    if car_seats >= 2:
+        mask |= CAP_TWO_CAR_SEATS
+
+    # PassengerPreference is 'male only', 'female only' or 'male & female'
+    preference = (driver.passenger_preference or '').lower()
+    if not preference or 'male' in preference.replace('female', ''):
+        mask |= CAP_ACCEPTS_MALE
+    if not preference or 'female' in preference:
+        mask |= CAP_ACCEPTS_FEMALE
+    return mask
+
+
+def ride_requirements(passenger_gender=None, wheelchair=False, booster=False, car_seats=0,
+                      luxury=False, new_car=False):
+    """
+    Build the capability mask a ride needs.
+
+    Args:
+        passenger_gender (str): 'Male' or 'Female' (profile gender), None for no constraint
+        wheelchair, booster, luxury, new_car (bool): Required equipment / car type
+        car_seats (int): Number of child car seats needed (0-2)
+
+    Returns:
+        int: CAP_* bits a driver must have
+    """
+    mask = 0
+    if passenger_gender:
+        mask |= CAP_ACCEPTS_FEMALE if passenger_gender.lower() == 'female' else CAP_ACCEPTS_MALE
+    if wheelchair:
+        mask |= CAP_WHEELCHAIR
+    if booster:
+        mask |= CAP_BOOSTER
+    if car_seats >= 1:
+        mask |= CAP_CAR_SEAT
+    if car_seats >= 2:
+        mask |= CAP_TWO_CAR_SEATS
+    if luxury:
+        mask |= CAP_LUXURY
+    if new_car:
+        mask |= CAP_NEW_CAR
+    return mask
+
+
+class DriverIndex:
+    """
+    Grid index of available drivers.
+
+    Args:
+        cell_degrees (float): Grid cell size in degrees of latitude / longitude
+    """
+
+    def __init__(self, cell_degrees=CELL_DEGREES):
+        self.cell_degrees = cell_degrees
+        self._cells = {}      # (row, col) -> set of driver ids
+        self._drivers = {}    # driver id -> (lat, lng, mask, seats, cell)
+        self._lock = threading.Lock()
+
+    def _cell(self, lat, lng):
+        return (math.floor(lat / self.cell_degrees), math.floor(lng / self.cell_degrees))
+
+    def upsert(self, driver_id, lat, lng, mask, seats):
+        """Add a driver or move it to a new position / capability set."""
+        cell = self._cell(lat, lng)
+        with self._lock:
+            previous = self._drivers.get(driver_id)
+            if previous is not None and previous[4] != cell:
+                self._discard_from_cell(driver_id, previous[4])
+            self._drivers[driver_id] = (lat, lng, mask, seats, cell)
+            self._cells.setdefault(cell, set()).add(driver_id)
+
+    def remove(self, driver_id):
+        """Take a driver out of matching (offline or busy)."""
+        with self._lock:
+            previous = self._drivers.pop(driver_id, None)
+            if previous is not None:
+                self._discard_from_cell(driver_id, previous[4])
+
+    def _discard_from_cell(self, driver_id, cell):
+        members = self._cells.get(cell)
+        if members is not None:
+            members.discard(driver_id)
+            if not members:
+                del self._cells[cell]
+
+    def nearest(self, lat, lng, k=5, required_mask=0, seats=1, max_km=MAX_MATCH_RADIUS_KM):
+        """
+        Find the k nearest eligible drivers.
+
+        Args:
+            lat, lng (float): Pickup location in degrees
+            k (int): Number of drivers to return
+            required_mask (int): CAP_* bits every match must have (see ride_requirements)
+            seats (int): Passenger seats needed
+            max_km (float): Search radius
+
+        Returns:
+            list: (distance_km, driver_id) tuples, nearest first
+        """
+        row, col = self._cell(lat, lng)
+        # Smallest width of a cell in km near the pickup, used to bound unscanned rings
+        cos_lat = max(math.cos(math.radians(min(abs(lat) + 1, 89.9))), 0.01)
+        cell_km = self.cell_degrees * KM_PER_DEGREE * cos_lat
+        max_ring = int(max_km / cell_km) + 1
+        # Equirectangular approximation for the scan, exact haversine for the result
+        lng_scale = math.cos(math.radians(lat))
+        best = []  # max-heap of (-approx_km, driver_id), size <= k
+
+        with self._lock:
+            cells = self._cells
+            drivers = self._drivers
+            for ring in range(max_ring + 1):
+                # Every driver in rings beyond this one is at least (ring - 1) cells away
+                if len(best) == k and (ring - 1) * cell_km > -best[0][0]:
+                    break
+                for cell in _ring_cells(row, col, ring):
+                    members = cells.get(cell)
+                    if not members:
+                        continue
+                    for driver_id in members:
+                        d_lat, d_lng, mask, free_seats, _ = drivers[driver_id]
+                        if mask & required_mask != required_mask or free_seats < seats:
+                            continue
+                        dy = d_lat - lat
+                        dx = (d_lng - lng) * lng_scale
+                        approx_km = math.sqrt(dx * dx + dy * dy) * KM_PER_DEGREE
+                        if approx_km > max_km:
+                            continue
+                        if len(best) < k:
+                            heapq.heappush(best, (-approx_km, driver_id))
+                        elif approx_km < -best[0][0]:
+                            heapq.heapreplace(best, (-approx_km, driver_id))
+            positions = {driver_id: drivers[driver_id] for _, driver_id in best}
+
+        origin = {'lat': lat, 'lng': lng}
+        matches = [
+            (calculate_distance(origin, {'lat': positions[driver_id][0], 'lng': positions[driver_id][1]}),
+             driver_id)
+            for _, driver_id in best
+        ]
+        matches.sort()
+        return matches
+
+    def position(self, driver_id):
+        """(lat, lng) of an indexed driver."""
+        lat, lng, _, _, _ = self._drivers[driver_id]
+        return lat, lng
+
+    def __contains__(self, driver_id):
+        return driver_id in self._drivers
+
+    def __len__(self):
+        return len(self._drivers)
+
+
+def _ring_cells(row, col, ring):
+    """Cells at Chebyshev distance `ring` from (row, col)."""
+    if ring == 0:
+        yield (row, col)
+        return
+    for c in range(col - ring, col + ring + 1):
+        yield (row - ring, c)
+        yield (row + ring, c)
+    for r in range(row - ring + 1, row + ring):
+        yield (r, col - ring)
+        yield (r, col + ring)
+
+
+def load_driver_index(database='drivers.db', cell_degrees=CELL_DEGREES):
+    """
+    Build an index of every available driver with a known location.
+
+    Returns:
+        DriverIndex
+    """
+    index = DriverIndex(cell_degrees)
+    conn = get_connection(database)
+    rows = conn.execute('''SELECT d.*, l.lat, l.lng
+                           FROM drivers d JOIN driver_locations l ON l.driver_id = d.id
+                           WHERE l.is_available''')
+    width = len(Driver._fields)
+    for row in rows:
+        driver = Driver._make(row[:width])
+        lat, lng = row[width:]
+        index.upsert(driver.id, lat, lng, capability_mask(driver), driver.available_seats)
+    return index
+
+
+def report_location(database, driver_id, lat, lng, is_available=True, index=None):
+    """
+    Store a driver's position (and availability) and update an index with it.
+
+    Args:
+        database (str): drivers.db path
+        driver_id (int): drivers.id
+        lat, lng (float): Current position in degrees
+        is_available (bool): False takes the driver out of matching
+        index (DriverIndex): Index to keep in sync, optional
+
+    Returns:
+        bool: False if the driver does not exist
+    """
+    conn = get_connection(database)
+    row = conn.execute('SELECT * FROM drivers WHERE id = ?', (driver_id,)).fetchone()
+    if row is None:
+        return False
+    conn.execute('''INSERT INTO driver_locations (driver_id, lat, lng, is_available, updated_at)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(driver_id) DO UPDATE SET
+                        lat = excluded.lat, lng = excluded.lng,
+                        is_available = excluded.is_available, updated_at = excluded.updated_at''',
+                 (driver_id, lat, lng, bool(is_available), datetime.now()))
+    conn.commit()
+
+    if index is not None:
+        if is_available:
+            driver = Driver._make(row)
+            index.upsert(driver_id, lat, lng, capability_mask(driver), driver.available_seats)
+        else:
+            index.remove(driver_id)
+    return True
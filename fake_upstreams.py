@@ -0,0 +1,231 @@
+# fake_upstreams.py
+
+"""
+Local Stand-ins for Google Maps and Twilio
+
+A threaded HTTP server answering the three upstream APIs the services call,
+with a configurable delay per API, so benchmarks and replays run offline and
+reproducibly:
+
+- GET  /maps/api/geocode/json            Geocoding API
+- GET  /maps/api/distancematrix/json     Distance Matrix API
+- POST /2010-04-01/Accounts/<sid>/Messages.json   Twilio Messages
+
+Geocoding answers are deterministic: an address is placed within a few km of
+NEAR_CENTER, with the ZIP code of the query (or 10001), so the same address
+always resolves to the same place. Addresses starting with "nowhere" return
+ZERO_RESULTS and addresses starting with "far" are placed ~1000 km away.
+
+Usage:
+    with FakeUpstreams(geocode_ms=40, distance_ms=80, twilio_ms=120) as upstreams:
+        upstreams.install()      # point passenger_reg, travel_time, dispatcher and Twilio at it
+        ...
+        print(upstreams.calls)   # {'geocode': n, 'distancematrix': n, 'messages': n}
+
+Standalone, for a separately started server:
+    python fake_upstreams.py --port 8081 --geocode-ms 40
+    GOOGLE_MAPS_API_URL=http://127.0.0.1:8081/maps/api TWILIO_API_URL=http://127.0.0.1:8081 \
+        gunicorn -c gunicorn.conf.py wsgi:application
+"""
+
+import argparse
+import hashlib
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+NEAR_CENTER = (40.7506, -73.9972)
+FAR_CENTER = (49.2827, -81.1207)
+DEFAULT_ZIP = '10001'
+
+
+def _fraction(text, salt):
+    """Stable pseudo-random number in [0, 1) for a string."""
+    digest = hashlib.sha1(f"{salt}:{text}".encode('utf-8')).digest()
+    return int.from_bytes(digest[:4], 'big') / 2 ** 32
+
+
+def geocode_response(query):
+    """Geocoding API response for an address query ("123 Main St, 10001")."""
+    query = query.strip()
+    address = query.split(',')[0].strip()
+    if not address or address.lower().startswith('nowhere'):
+        return {'status': 'ZERO_RESULTS', 'results': []}
+
+    zip_match = re.search(r'\b(\d{5})\b\s*$', query)
+    zip_code = zip_match.group(1) if zip_match and zip_match.group(1) != address else DEFAULT_ZIP
+    far = address.lower().startswith('far')
+    if far:
+        zip_code = '99999'
+    center = FAR_CENTER if far else NEAR_CENTER
+    lat = center[0] + (_fraction(query, 'lat') - 0.5) * 0.05
+    lng = center[1] + (_fraction(query, 'lng') - 0.5) * 0.05
+    if re.fullmatch(r'\d{5}', address):
+        formatted = f"New York, NY {address}, USA"
+        zip_code = address
+    else:
+        formatted = f"{address.title()}, New York, NY {zip_code}, USA"
+    return {
+        'status': 'OK',
+        'results': [{
+            'formatted_address': formatted,
+            'geometry': {'location': {'lat': round(lat, 6), 'lng': round(lng, 6)}},
+            'address_components': [
+                {'long_name': 'New York', 'short_name': 'New York', 'types': ['locality']},
+                {'long_name': zip_code, 'short_name': zip_code, 'types': ['postal_code']},
+            ],
+        }],
+    }
+
+
+def distance_matrix_response(origins, destinations):
+    """Distance Matrix response with a stable 5-45 minute duration per pair."""
+    rows = []
+    for origin in origins:
+        elements = []
+        for destination in destinations:
+            minutes = 5 + int(_fraction(origin + '|' + destination, 'minutes') * 40)
+            elements.append({'status': 'OK',
+                             'duration': {'text': f"{minutes} mins", 'value': minutes * 60},
+                             'distance': {'text': f"{minutes * 0.6:.1f} mi", 'value': minutes * 965}})
+        rows.append({'elements': elements})
+    return {'status': 'OK', 'origin_addresses': origins, 'destination_addresses': destinations,
+            'rows': rows}
+
+
+class FakeUpstreams:
+    """
+    Fake Google Maps + Twilio server on a local port.
+
+    Args:
+        geocode_ms, distance_ms, twilio_ms (float): Delay added to each call of that API
+        port (int): Port to listen on, 0 for any free port
+    """
+
+    def __init__(self, geocode_ms=0.0, distance_ms=0.0, twilio_ms=0.0, port=0):
+        self.delays = {'geocode': geocode_ms / 1000, 'distancematrix': distance_ms / 1000,
+                       'messages': twilio_ms / 1000}
+        self.calls = {'geocode': 0, 'distancematrix': 0, 'messages': 0}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _count(self, api):
+        with self._lock:
+            self.calls[api] += 1
+        delay = self.delays[api]
+        if delay:
+            time.sleep(delay)
+
+    def _handler_class(self):
+        upstreams = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'   # Keep-alive, like the real APIs
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                if url.path.endswith('/geocode/json'):
+                    upstreams._count('geocode')
+                    self._send(200, geocode_response(query.get('address', [''])[0]))
+                elif url.path.endswith('/distancematrix/json'):
+                    upstreams._count('distancematrix')
+                    self._send(200, distance_matrix_response(query.get('origins', [''])[0].split('|'),
+                                                             query.get('destinations', [''])[0].split('|')))
+                else:
+                    self._send(404, {'status': 'NOT_FOUND'})
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                form = parse_qs(self.rfile.read(length).decode('utf-8'))
+                if not self.path.endswith('/Messages.json'):
+                    self._send(404, {'message': 'Not found'})
+                    return
+                upstreams._count('messages')
+                with upstreams._lock:
+                    sid = f"SM{upstreams.calls['messages']:032d}"
+                self._send(201, {'sid': sid, 'status': 'queued',
+                                 'to': form.get('To', [''])[0], 'from': form.get('From', [''])[0],
+                                 'body': form.get('Body', [''])[0]})
+
+            def _send(self, status, payload):
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-upstreams',
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def install(self):
+        """
+        Point the running process at this server: the Google URLs of
+        passenger_reg, travel_time and dispatcher, and a real Twilio client
+        (services.twilio_client()) whose API base URL is this server.
+        """
+        import dispatcher
+        import passenger_reg
+        import services
+        import travel_time
+        from twilio.rest import Client
+
+        passenger_reg.GEOCODE_URL = f"{self.base_url}/maps/api/geocode/json"
+        dispatcher.GEOCODE_URL = passenger_reg.GEOCODE_URL
+        travel_time.DISTANCE_MATRIX_URL = f"{self.base_url}/maps/api/distancematrix/json"
+
+        client = Client('AC' + '0' * 32, 'fake-auth-token')
+        client.api.base_url = self.base_url
+        with services._lock:
+            services._instances['twilio_client'] = client
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve fake Google Maps and Twilio APIs.')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--geocode-ms', type=float, default=0.0)
+    parser.add_argument('--distance-ms', type=float, default=0.0)
+    parser.add_argument('--twilio-ms', type=float, default=0.0)
+    args = parser.parse_args(argv)
+
+    upstreams = FakeUpstreams(args.geocode_ms, args.distance_ms, args.twilio_ms, args.port)
+    print(f"Fake upstreams listening on {upstreams.base_url}")
+    try:
+        upstreams._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(upstreams.calls))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+# geo_distance.py
+
+"""
+Great-Circle Distance Calculations
+
+Scalar and vectorized haversine distances in kilometers.
+calculate_distance handles a single pair of Geocoding API locations
+({'lat': ..., 'lng': ...}); the NumPy functions compute whole batches in one
+call, which is what ranking large candidate sets (and driver pools) needs.
+Below SCALAR_CUTOFF dict points, distances_from loops calculate_distance
+instead: NumPy's per-call overhead makes it about half as fast for the
+handful of results a Geocoding response carries.
+
+Benchmark: python bench_distance.py
+"""
+
+import math
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371  # Earth's radius in kilometers
+SCALAR_CUTOFF = 32      # Fewer dict points than this are faster without NumPy (bench_distance.py)
+
+
+def calculate_distance(point1, point2):
+    """Calculate great-circle distance between two geographic points"""
+    if not point1 or not point2:
+        return float('inf')
+
+    lat1, lon1 = math.radians(point1['lat']), math.radians(point1['lng'])
+    lat2, lon2 = math.radians(point2['lat']), math.radians(point2['lng'])
+
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+
+    a = (math.sin(dlat/2)**2 +
+         math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2)
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
+
+    return EARTH_RADIUS_KM * c  # Distance in kilometers
+
+
+def locations_to_array(locations):
+    """
+    Convert a list of {'lat', 'lng'} dicts into an (N, 2) float array of degrees.
+    Arrays are passed through unchanged.
+    """
+    if isinstance(locations, np.ndarray):
+        return locations.reshape(-1, 2).astype(np.float64, copy=False)
+    return np.array([(loc['lat'], loc['lng']) for loc in locations],
+                    dtype=np.float64).reshape(-1, 2)
+
+
+def haversine(lat1, lng1, lat2, lng2):
+    """
+    Vectorized haversine distance.
+
+    All arguments are degrees and may be scalars or arrays of broadcastable
+    shapes, e.g. one origin against N points or N origins against N points.
+
+    Returns:
+        numpy.ndarray: Distances in kilometers
+    """
+    lat1, lng1, lat2, lng2 = map(np.radians, (lat1, lng1, lat2, lng2))
+    dlat = lat2 - lat1
+    dlng = lng2 - lng1
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def pairwise_distances(points1, points2):
+    """
+    Element-wise distances between two equally long coordinate batches.
+
+    Args:
+        points1, points2: (N, 2) arrays or lists of {'lat', 'lng'} dicts
+
+    Returns:
+        numpy.ndarray: Shape (N,) distances in kilometers
+    """
+    a = locations_to_array(points1)
+    b = locations_to_array(points2)
+    return haversine(a[:, 0], a[:, 1], b[:, 0], b[:, 1])
+
+
+def distances_from(origin, points):
+    """
+    One-to-many distances, e.g. a registered ZIP centroid against candidate results.
+
+    Args:
+        origin (dict): {'lat', 'lng'} location, or None
+        points: (N, 2) array or list of {'lat', 'lng'} dicts
+
+    Returns:
+        numpy.ndarray: Shape (N,) distances in kilometers; all inf when
+        origin is missing, matching calculate_distance
+    """
+    if not isinstance(points, np.ndarray) and len(points) < SCALAR_CUTOFF:
+        return np.array([calculate_distance(origin, point) for point in points], dtype=np.float64)
+    b = locations_to_array(points)
+    if not origin:
+        return np.full(len(b), np.inf)
+    return haversine(origin['lat'], origin['lng'], b[:, 0], b[:, 1])
+
+
+def distance_matrix(origins, destinations):
+    """
+    Many-to-many distances.
+
+    Returns:
+        numpy.ndarray: Shape (len(origins), len(destinations)) in kilometers
+    """
+    a = locations_to_array(origins)
+    b = locations_to_array(destinations)
+    return haversine(a[:, 0, None], a[:, 1, None], b[None, :, 0], b[None, :, 1])
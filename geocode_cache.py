@@ -0,0 +1,182 @@
+# geocode_cache.py
+
+"""
+Geocoding Response Cache
+
+Two-tier cache for Google Geocoding API responses:
+- an in-process LRU (per worker) answers repeated lookups without any I/O
+- a SQLite table shared by all workers survives restarts
+
+Entries are keyed by the normalized query text plus the ZIP code used to
+scope it. Successful lookups ('OK') and negative answers ('ZERO_RESULTS') are
+cached with separate TTLs; transient statuses such as OVER_QUERY_LIMIT or
+REQUEST_DENIED are never cached.
+"""
+
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from db_pool import get_connection
+
+# Configuration constants
+CACHE_DATABASE = os.getenv('GEOCODE_CACHE_DB', 'geocode_cache.db')
+MAX_MEMORY_ENTRIES = int(os.getenv('GEOCODE_CACHE_SIZE', '2048'))
+POSITIVE_TTL = int(os.getenv('GEOCODE_CACHE_TTL', str(30 * 24 * 3600)))           # 30 days
+NEGATIVE_TTL = int(os.getenv('GEOCODE_CACHE_NEGATIVE_TTL', str(24 * 3600)))        # 1 day
+
+CACHEABLE_STATUSES = {'OK': POSITIVE_TTL, 'ZERO_RESULTS': NEGATIVE_TTL}
+
+
+def normalize_query(query):
+    """
+    Normalize free-text address input so trivial variations share a cache entry.
+
+    "  123  Main St., " and "123 main st" both become "123 main st".
+    """
+    query = (query or '').lower()
+    query = re.sub(r'[^\w\s#-]', ' ', query)
+    return ' '.join(query.split())
+
+
+class GeocodeCache:
+    """
+    In-process LRU in front of a SQLite-backed table of geocoding responses.
+
+    Args:
+        database (str): SQLite file holding the persistent tier
+        max_entries (int): Capacity of the in-process LRU
+    """
+
+    def __init__(self, database=CACHE_DATABASE, max_entries=MAX_MEMORY_ENTRIES):
+        self.database = database
+        self.max_entries = max_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._table_ready = False
+        self.stats = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'negative_hits': 0,
+            'misses': 0,
+            'stores': 0,
+        }
+
+    def _connection(self):
+        conn = get_connection(self.database)
+        if not self._table_ready:
+            conn.execute('''CREATE TABLE IF NOT EXISTS geocode_cache
+                            (cache_key TEXT PRIMARY KEY,
+                             status TEXT NOT NULL,
+                             response TEXT NOT NULL,
+                             expires_at REAL NOT NULL)''')
+            conn.commit()
+            self._table_ready = True
+        return conn
+
+    @staticmethod
+    def make_key(query, zip_code=None):
+        """Build the cache key for a query scoped to an optional ZIP code."""
+        return f"{normalize_query(query)}|{zip_code or ''}"
+
+    def _remember(self, key, expires_at, response):
+        """Insert into the LRU, evicting the least recently used entry when full."""
+        with self._lock:
+            self._memory[key] = (expires_at, response)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def _count(self, counter, response):
+        with self._lock:
+            self.stats[counter] += 1
+            if response.get('status') == 'ZERO_RESULTS':
+                self.stats['negative_hits'] += 1
+
+    def get(self, query, zip_code=None):
+        """
+        Look up a cached geocoding response.
+
+        Returns:
+            dict or None: The cached API response, or None on a miss
+        """
+        key = self.make_key(query, zip_code)
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._memory.move_to_end(key)
+                else:
+                    del self._memory[key]
+                    entry = None
+        if entry is not None:
+            self._count('memory_hits', entry[1])
+            return entry[1]
+
+        try:
+            row = self._connection().execute(
+                'SELECT response, expires_at FROM geocode_cache WHERE cache_key = ?',
+                (key,)
+            ).fetchone()
+        except Exception as e:
+            print(f"Geocode cache read error: {e}")
+            row = None
+
+        if row and row[1] > now:
+            response = json.loads(row[0])
+            self._remember(key, row[1], response)
+            self._count('disk_hits', response)
+            return response
+
+        with self._lock:
+            self.stats['misses'] += 1
+        return None
+
+    def put(self, query, zip_code, response):
+        """
+        Store a geocoding response if its status is cacheable.
+
+        Args:
+            query (str): Address text that was geocoded
+            zip_code (str): ZIP code the query was scoped to, or None
+            response (dict): Decoded Geocoding API response
+        """
+        ttl = CACHEABLE_STATUSES.get(response.get('status'))
+        if ttl is None:
+            return
+
+        key = self.make_key(query, zip_code)
+        expires_at = time.time() + ttl
+        self._remember(key, expires_at, response)
+
+        try:
+            conn = self._connection()
+            conn.execute('''INSERT OR REPLACE INTO geocode_cache
+                            (cache_key, status, response, expires_at)
+                            VALUES (?, ?, ?, ?)''',
+                         (key, response['status'], json.dumps(response), expires_at))
+            conn.commit()
+        except Exception as e:
+            print(f"Geocode cache write error: {e}")
+
+        with self._lock:
+            self.stats['stores'] += 1
+
+    def purge_expired(self):
+        """Delete expired rows from the persistent tier. Returns the number removed."""
+        conn = self._connection()
+        deleted = conn.execute('DELETE FROM geocode_cache WHERE expires_at <= ?',
+                               (time.time(),)).rowcount
+        conn.commit()
+        return deleted
+
+    def hit_ratio(self):
+        """Fraction of lookups answered from either tier."""
+        hits = self.stats['memory_hits'] + self.stats['disk_hits']
+        total = hits + self.stats['misses']
+        return hits / total if total else 0.0
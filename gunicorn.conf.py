@@ -0,0 +1,65 @@
+# gunicorn.conf.py
+
+"""
+Gunicorn settings for wsgi:application
+
+    gunicorn -c gunicorn.conf.py wsgi:application
+
+Tuning knobs (environment variables):
+- WEB_BIND: address to listen on (default 0.0.0.0:8000)
+- WEB_WORKERS: worker processes (default 1). Conversation state is shared
+  through profiles.db (or Redis) as long as no worker caches it, so more
+  than one worker is refused when STATE_CACHE_TTL is above 0, write-behind
+  is on or STATE_BACKEND=fakeredis (in-memory, per process); see
+  state_store.py. Each worker keeps its own driver location index, reloaded
+  every DRIVER_INDEX_REFRESH seconds.
+- WEB_THREADS: threads per worker (default 8). Webhooks mostly wait on
+  Google / SQLite, so threads are the way to add concurrency.
+- WEB_TIMEOUT: seconds before a stuck worker is restarted (default 30,
+  Twilio gives up on webhooks after 15)
+- WEB_MAX_REQUESTS: recycle a worker after this many requests, 0 = never
+- WEB_ACCESS_LOG: '-' for stdout, empty (default) to disable
+- METRICS_DIR: directory where the workers share their /metrics totals
+  (default gunicorn_metrics, emptied when the server starts; see metrics.py)
+"""
+
+import os
+
+bind = os.getenv('WEB_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('WEB_WORKERS', '1'))
+threads = int(os.getenv('WEB_THREADS', '8'))
+worker_class = 'gthread'
+timeout = int(os.getenv('WEB_TIMEOUT', '30'))
+graceful_timeout = 30
+keepalive = 5
+max_requests = int(os.getenv('WEB_MAX_REQUESTS', '0'))
+max_requests_jitter = max_requests // 10
+accesslog = os.getenv('WEB_ACCESS_LOG') or None
+
+# Import the app (migrations, index loading) once in the master, then fork
+preload_app = True
+
+# /metrics answers with the sum over all workers (set before the app imports metrics.py)
+os.environ.setdefault('METRICS_DIR', 'gunicorn_metrics')
+
+# Several workers would each replay conversations from their own stale state cache
+# (same settings as state_store.py, read here because the config loads before the app)
+shared_state = (os.getenv('STATE_BACKEND', 'sqlite') != 'fakeredis'
+                and float(os.getenv('STATE_CACHE_TTL', '0')) == 0
+                and os.getenv('STATE_WRITE_BEHIND', 'false').lower() not in ('1', 'true', 'yes'))
+if workers > 1 and not shared_state:
+    raise RuntimeError(f"WEB_WORKERS={workers} needs conversation state shared between processes: set "
+                       "STATE_CACHE_TTL=0 and STATE_WRITE_BEHIND=false with the sqlite or redis backend, "
+                       "or run one worker with more WEB_THREADS")
+
+
+def on_starting(server):
+    """Drop the metrics totals of the previous run, counters start from zero with the server."""
+    import metrics
+    metrics.clear_totals_dir()
+
+
+def post_fork(server, worker):
+    """Start the outbound SMS workers in each worker, sending what was queued before a restart."""
+    import services
+    services.outbound_queue()
@@ -0,0 +1,113 @@
+# http_client.py
+
+"""
+Shared HTTP Client for Upstream APIs
+
+One pooled requests.Session per process for all Google Maps calls:
+- keep-alive connections reused across requests and threads
+- connect/read timeouts on every call
+- automatic retries with exponential backoff on connection errors,
+  429 and 5xx responses
+
+Also provides run_concurrently() for issuing independent lookups in
+parallel, so a request waits for the slowest call instead of their sum.
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Configuration constants
+CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '3.05'))
+READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', '10'))
+MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', '3'))
+BACKOFF_FACTOR = float(os.getenv('HTTP_BACKOFF_FACTOR', '0.3'))  # 0.3s, 0.6s, 1.2s ...
+POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '20'))
+LOOKUP_WORKERS = int(os.getenv('HTTP_LOOKUP_WORKERS', '16'))
+
+_state = threading.local()
+_lock = threading.Lock()
+_session = None
+_executor = None
+_owner_pid = None
+
+
+def _build_session():
+    retry = Retry(
+        total=MAX_RETRIES,
+        connect=MAX_RETRIES,
+        read=MAX_RETRIES,
+        backoff_factor=BACKOFF_FACTOR,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(['GET']),
+        respect_retry_after_header=True,
+    )
+    adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def _ensure_process_state():
+    """(Re)create the session and lookup pool in a fresh or forked process."""
+    global _session, _executor, _owner_pid
+    if _owner_pid != os.getpid():
+        with _lock:
+            if _owner_pid != os.getpid():
+                _session = _build_session()
+                _executor = ThreadPoolExecutor(max_workers=LOOKUP_WORKERS,
+                                               thread_name_prefix='http-lookup')
+                _owner_pid = os.getpid()
+
+
+def get_session():
+    """Return the process-wide pooled session."""
+    _ensure_process_state()
+    return _session
+
+
+def get_json(url, params=None):
+    """
+    GET a JSON endpoint through the shared session.
+
+    Args:
+        url (str): Endpoint URL
+        params (dict): Query string parameters, encoded by requests
+
+    Returns:
+        dict: Decoded JSON body
+
+    Raises:
+        requests.RequestException: On timeouts, exhausted retries or HTTP errors
+    """
+    response = get_session().get(url, params=params, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+    response.raise_for_status()
+    return response.json()
+
+
+def run_concurrently(func, arg_tuples):
+    """
+    Call func(*args) for every args tuple in parallel and return results in order.
+
+    Calls made from inside a lookup worker run inline, so nested use can never
+    exhaust the pool and deadlock.
+    """
+    arg_tuples = list(arg_tuples)
+    if len(arg_tuples) <= 1 or getattr(_state, 'in_worker', False):
+        return [func(*args) for args in arg_tuples]
+
+    _ensure_process_state()
+
+    def call(args):
+        _state.in_worker = True
+        try:
+            return func(*args)
+        finally:
+            _state.in_worker = False
+
+    return list(_executor.map(call, arg_tuples))
@@ -0,0 +1,84 @@
+# license_registry.py
+
+"""
+In-Memory License Registry
+
+Keeps the set of registered license numbers and license plates in memory so
+/api/check-license can answer "not registered" without touching SQLite.
+
+The sets are loaded once and then kept in sync two ways:
+- add() is called right after a successful insert in this process
+- refresh() pulls rows inserted by other worker processes, using the
+  drivers.id autoincrement as a watermark; it runs at most once every
+  REFRESH_INTERVAL seconds
+
+A miss in the sets can therefore be up to REFRESH_INTERVAL stale for rows
+written by another process. That is fine for this advisory check, since
+submit_form relies on the UNIQUE indexes for the authoritative answer.
+"""
+
+import os
+import threading
+import time
+
+from db_pool import get_connection
+
+# Seconds between incremental reloads from the drivers table
+REFRESH_INTERVAL = float(os.getenv('LICENSE_REGISTRY_REFRESH', '2'))
+
+
+class LicenseRegistry:
+    """
+    Set-backed membership index over drivers.license_number and drivers.license_plate.
+
+    Args:
+        database (str): Path of the drivers database
+        refresh_interval (float): Minimum seconds between incremental reloads
+    """
+
+    def __init__(self, database, refresh_interval=REFRESH_INTERVAL):
+        self.database = database
+        self.refresh_interval = refresh_interval
+        self._numbers = set()
+        self._plates = set()
+        self._last_id = 0
+        self._last_refresh = 0.0
+        self._lock = threading.Lock()
+
+    def refresh(self, force=False):
+        """Load drivers inserted since the last refresh (throttled unless force=True)."""
+        now = time.monotonic()
+        if not force and now - self._last_refresh < self.refresh_interval:
+            return
+        with self._lock:
+            if not force and now - self._last_refresh < self.refresh_interval:
+                return
+            rows = get_connection(self.database).execute(
+                'SELECT id, license_number, license_plate FROM drivers WHERE id > ? ORDER BY id',
+                (self._last_id,)
+            ).fetchall()
+            for driver_id, license_number, license_plate in rows:
+                self._numbers.add(license_number)
+                self._plates.add(license_plate)
+                self._last_id = driver_id
+            self._last_refresh = now
+
+    def add(self, license_number, license_plate):
+        """Record a driver this process has just inserted."""
+        with self._lock:
+            self._numbers.add(license_number)
+            self._plates.add(license_plate)
+
+    def might_exist(self, license_number, license_plate):
+        """
+        Check the in-memory sets.
+
+        Returns:
+            tuple: (license_number_known, license_plate_known); (False, False)
+            means neither is registered and the database need not be queried
+        """
+        self.refresh()
+        return license_number in self._numbers, license_plate in self._plates
+
+    def __len__(self):
+        return len(self._numbers)
@@ -0,0 +1,423 @@
+# metrics.py
+
+"""
+Latency Instrumentation
+
+Times the hot path of every webhook: the request itself, the database
+helpers, address resolution, geocoding, Distance Matrix and Twilio sends.
+
+- span(name) / @timed(name) record how long a block or function takes in a
+  per-name latency histogram (fixed buckets, Prometheus style); exceptions
+  are counted per span as well
+- metrics_blueprint, registered by app_factory.create_app(), times each
+  request, writes one JSON log line per request with its status, duration
+  and the spans it spent time in, and serves every histogram at /metrics in
+  the Prometheus text format
+
+Spans recorded on a request's thread count toward that request; lookups run
+on other threads do too when the function is wrapped with propagate() (see
+passenger_reg.resolve_addresses). Background work (outbound queue,
+background resolution) only feeds the histograms.
+
+Each process keeps its own histograms. Behind one gunicorn bind a scrape
+reaches a random worker, so a worker reporting only its own counters would
+make them jump between workers' values (rate() sees every jump down as a
+counter reset). With METRICS_DIR set (gunicorn.conf.py sets it), every
+process serving requests writes its totals to METRICS_DIR/metrics_<pid>.json
+every METRICS_WRITE_INTERVAL seconds and /metrics serves the sum over all
+files, including those of exited workers so the totals never go down.
+Without it (the debug servers, one process) /metrics reports this process.
+
+    rate(span_duration_seconds_sum{span="google.geocode"}[5m])
+      / rate(span_duration_seconds_count{span="google.geocode"}[5m])
+    histogram_quantile(0.99, rate(span_duration_seconds_bucket{span="http.sms.sms"}[5m]))
+"""
+
+import bisect
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from flask import Blueprint, Response, g, request
+
+from state_machine import state_metrics
+
+# Configuration constants
+REQUEST_LOG = os.getenv('REQUEST_LOG', 'true').lower() in ('1', 'true', 'yes')
+METRICS_DIR = os.getenv('METRICS_DIR', '')    # Shared by the worker processes of one server, '' = this process only
+METRICS_WRITE_INTERVAL = float(os.getenv('METRICS_WRITE_INTERVAL', '5'))
+# Histogram bucket upper bounds in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Cumulative latency histogram over BUCKETS."""
+
+    __slots__ = ('counts', 'total', 'count', 'errors')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)   # Last slot is +Inf
+        self.total = 0.0
+        self.count = 0
+        self.errors = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding quantile q (0-1), in seconds."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, bucket_count in zip(BUCKETS, self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+_histograms = {}     # span name -> Histogram
+_requests = {}       # (endpoint, status) -> count
+_lock = threading.Lock()
+_current = threading.local()
+_writer_pid = None
+_writer_lock = threading.Lock()
+
+
+def observe(name, seconds, error=False):
+    """Record one timing of span `name`, also against the current request if there is one."""
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram()
+        histogram.observe(seconds)
+        if error:
+            histogram.errors += 1
+    collector = getattr(_current, 'collector', None)
+    if collector is not None:
+        collector.add(name, seconds)
+
+
+@contextmanager
+def span(name):
+    """Time the enclosed block as span `name`."""
+    start = time.perf_counter()
+    error = False
+    try:
+        yield
+    except BaseException:
+        error = True
+        raise
+    finally:
+        observe(name, time.perf_counter() - start, error)
+
+
+def timed(name):
+    """Decorator timing every call of a function as span `name`."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name, n=1):
+    """Add n to counter `name` of the current request (no-op outside a request)."""
+    collector = getattr(_current, 'collector', None)
+    if collector is not None:
+        collector.count(name, n)
+
+
+class RequestSpans:
+    """Per-request span totals and counters, shared with the lookup threads working for the request."""
+
+    __slots__ = ('spans', 'counters', '_lock')
+
+    def __init__(self):
+        self.spans = {}      # name -> [count, seconds]
+        self.counters = {}   # name -> count
+        self._lock = threading.Lock()
+
+    def count(self, name, n):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def add(self, name, seconds):
+        with self._lock:
+            totals = self.spans.get(name)
+            if totals is None:
+                totals = self.spans[name] = [0, 0.0]
+            totals[0] += 1
+            totals[1] += seconds
+
+    def summary(self):
+        with self._lock:
+            return {name: {'count': count, 'ms': round(seconds * 1000, 3)}
+                    for name, (count, seconds) in self.spans.items()}
+
+
+def last_request():
+    """Log entry of the last request finished on this thread, or None (benchmarks, replays)."""
+    return getattr(_current, 'last_entry', None)
+
+
+def propagate(func):
+    """
+    Wrap func so spans it records on another thread count toward the
+    request running now (e.g. for http_client.run_concurrently).
+    """
+    collector = getattr(_current, 'collector', None)
+    if collector is None:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        previous = getattr(_current, 'collector', None)
+        _current.collector = collector
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _current.collector = previous
+    return wrapper
+
+
+def snapshot():
+    """
+    Per-span statistics of this process.
+
+    Returns:
+        dict: {span: {'count', 'errors', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms'}},
+        percentiles are bucket upper bounds
+    """
+    with _lock:
+        return {
+            name: {
+                'count': h.count,
+                'errors': h.errors,
+                'mean_ms': round(h.total * 1000 / h.count, 3) if h.count else 0.0,
+                'p50_ms': h.quantile(0.50) * 1000,
+                'p95_ms': h.quantile(0.95) * 1000,
+                'p99_ms': h.quantile(0.99) * 1000,
+            }
+            for name, h in _histograms.items()
+        }
+
+
+def reset():
+    """Forget every recorded timing (benchmarks, between runs)."""
+    with _lock:
+        _histograms.clear()
+        _requests.clear()
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _totals():
+    """This process's counters as JSON-serializable totals (the unit that is summed across processes)."""
+    with _lock:
+        totals = {
+            'spans': {name: {'buckets': list(h.counts), 'sum': h.total, 'count': h.count, 'errors': h.errors}
+                      for name, h in _histograms.items()},
+            'requests': [[endpoint, status, count] for (endpoint, status), count in _requests.items()],
+        }
+    totals['states'] = {flow: {state: [stats['count'], stats['total_ms'] / 1000]
+                               for state, stats in states.items()}
+                        for flow, states in state_metrics().items()}
+    return totals
+
+
+def _merge(all_totals):
+    """Sum the totals of several processes."""
+    merged = {'spans': {}, 'requests': {}, 'states': {}}
+    for totals in all_totals:
+        for name, h in totals['spans'].items():
+            into = merged['spans'].setdefault(
+                name, {'buckets': [0] * (len(BUCKETS) + 1), 'sum': 0.0, 'count': 0, 'errors': 0})
+            into['buckets'] = [a + b for a, b in zip(into['buckets'], h['buckets'])]
+            into['sum'] += h['sum']
+            into['count'] += h['count']
+            into['errors'] += h['errors']
+        for endpoint, status, count in totals['requests']:
+            key = (endpoint, status)
+            merged['requests'][key] = merged['requests'].get(key, 0) + count
+        for flow, states in totals['states'].items():
+            for state, (count, seconds) in states.items():
+                into = merged['states'].setdefault(flow, {}).setdefault(state, [0, 0.0])
+                into[0] += count
+                into[1] += seconds
+    return merged
+
+
+def _totals_path(pid):
+    return os.path.join(METRICS_DIR, f'metrics_{pid}.json')
+
+
+def write_totals():
+    """Write this process's totals to METRICS_DIR (atomically, readers never see half a file)."""
+    path = _totals_path(os.getpid())
+    temporary = path + '.tmp'
+    with open(temporary, 'w') as f:
+        json.dump(_totals(), f)
+    os.replace(temporary, path)
+
+
+def _read_all_totals():
+    all_totals = []
+    for filename in os.listdir(METRICS_DIR):
+        if not (filename.startswith('metrics_') and filename.endswith('.json')):
+            continue
+        try:
+            with open(os.path.join(METRICS_DIR, filename)) as f:
+                all_totals.append(json.load(f))
+        except (OSError, ValueError) as e:
+            print(f"Metrics read error ({filename}): {str(e)}")
+    return all_totals
+
+
+def _ensure_writer():
+    """Start the thread writing this process's totals to METRICS_DIR (once per process)."""
+    global _writer_pid
+    if not METRICS_DIR or _writer_pid == os.getpid():
+        return
+    with _writer_lock:
+        if _writer_pid == os.getpid():
+            return
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        threading.Thread(target=_write_loop, name='metrics-writer', daemon=True).start()
+        _writer_pid = os.getpid()
+
+
+def _write_loop():
+    while True:
+        time.sleep(METRICS_WRITE_INTERVAL)
+        try:
+            write_totals()
+        except OSError as e:
+            print(f"Metrics write error: {str(e)}")
+
+
+def clear_totals_dir():
+    """Remove the totals of a previous server run (gunicorn on_starting)."""
+    if not METRICS_DIR or not os.path.isdir(METRICS_DIR):
+        return
+    for filename in os.listdir(METRICS_DIR):
+        if filename.startswith('metrics_'):
+            os.remove(os.path.join(METRICS_DIR, filename))
+
+
+def render_prometheus():
+    """
+    All metrics in the Prometheus text exposition format: the sum over every
+    process of the server when METRICS_DIR is set, else this process's.
+    """
+    if METRICS_DIR:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        write_totals()
+        totals = _merge(_read_all_totals())
+    else:
+        totals = _merge([_totals()])
+
+    lines = [
+        '# HELP span_duration_seconds Latency of instrumented operations.',
+        '# TYPE span_duration_seconds histogram',
+    ]
+    spans = sorted(totals['spans'].items())
+    for name, h in spans:
+        label = _label(name)
+        cumulative = 0
+        for bound, bucket_count in zip(BUCKETS, h['buckets']):
+            cumulative += bucket_count
+            lines.append(f'span_duration_seconds_bucket{{span="{label}",le="{bound}"}} {cumulative}')
+        lines.append(f'span_duration_seconds_bucket{{span="{label}",le="+Inf"}} {h["count"]}')
+        lines.append(f'span_duration_seconds_sum{{span="{label}"}} {h["sum"]:.6f}')
+        lines.append(f'span_duration_seconds_count{{span="{label}"}} {h["count"]}')
+
+    lines.append('# HELP span_errors_total Instrumented operations that raised.')
+    lines.append('# TYPE span_errors_total counter')
+    for name, h in spans:
+        lines.append(f'span_errors_total{{span="{_label(name)}"}} {h["errors"]}')
+
+    lines.append('# HELP http_requests_total Requests by endpoint and status code.')
+    lines.append('# TYPE http_requests_total counter')
+    for (endpoint, status), count in sorted(totals['requests'].items()):
+        lines.append(f'http_requests_total{{endpoint="{_label(endpoint)}",status="{status}"}} {count}')
+
+    lines.append('# HELP state_dispatch_total Conversation state handler calls.')
+    lines.append('# TYPE state_dispatch_total counter')
+    flows = sorted(totals['states'].items())
+    for flow, states in flows:
+        for state, (count, _) in sorted(states.items()):
+            lines.append(f'state_dispatch_total{{flow="{_label(flow)}",state="{_label(state)}"}} {count}')
+    lines.append('# HELP state_dispatch_seconds_total Time spent in conversation state handlers.')
+    lines.append('# TYPE state_dispatch_seconds_total counter')
+    for flow, states in flows:
+        for state, (_, seconds) in sorted(states.items()):
+            lines.append(f'state_dispatch_seconds_total{{flow="{_label(flow)}",state="{_label(state)}"}} '
+                         f'{seconds:.6f}')
+    return '\n'.join(lines) + '\n'
+
+
+# Request timing and /metrics
+metrics_blueprint = Blueprint('metrics', __name__)
+
+
+@metrics_blueprint.before_app_request
+def start_request_timer():
+    _ensure_writer()
+    g.request_started = time.perf_counter()
+    _current.collector = RequestSpans()
+
+
+@metrics_blueprint.after_app_request
+def record_status(response):
+    g.response_status = response.status_code
+    return response
+
+
+@metrics_blueprint.teardown_app_request
+def finish_request(exc):
+    started = g.pop('request_started', None)
+    collector = getattr(_current, 'collector', None)
+    _current.collector = None
+    if started is None or request.endpoint == 'metrics.metrics':
+        return
+    elapsed = time.perf_counter() - started
+    status = 500 if exc is not None else g.pop('response_status', 200)
+    endpoint = request.endpoint or 'unmatched'
+    observe(f"http.{endpoint}", elapsed, error=exc is not None)
+    with _lock:
+        _requests[(endpoint, status)] = _requests.get((endpoint, status), 0) + 1
+
+    entry = {
+        'ts': datetime.now(timezone.utc).isoformat(timespec='milliseconds'),
+        'method': request.method,
+        'path': request.path,
+        'endpoint': endpoint,
+        'status': status,
+        'duration_ms': round(elapsed * 1000, 3),
+        'spans': collector.summary() if collector is not None else {},
+    }
+    if collector is not None and collector.counters:
+        entry['counters'] = dict(collector.counters)
+    if exc is not None:
+        entry['error'] = f"{type(exc).__name__}: {exc}"
+    _current.last_entry = entry
+    if REQUEST_LOG:
+        print(json.dumps(entry), flush=True)
+
+
+@metrics_blueprint.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus scrape endpoint."""
+    return Response(render_prometheus(), mimetype='text/plain; version=0.0.4')
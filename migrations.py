@@ -0,0 +1,192 @@
+# migrations.py
+
+"""
+Versioned Schema Migrations
+
+Each database tracks its schema version in SQLite's built-in
+PRAGMA user_version. migrate() applies every migration newer than the
+stored version, in order, each inside its own transaction, so running it
+on every startup is cheap and idempotent.
+
+To change a schema, append a new (version, description, statements) entry
+to the relevant list; never edit a migration that has already shipped.
+
+Usage:
+    python migrations.py            # migrate drivers.db and profiles.db
+"""
+
+import sqlite3
+
+from db_pool import get_connection
+
+DRIVERS_MIGRATIONS = [
+    (1, 'create drivers table', [
+        '''CREATE TABLE IF NOT EXISTS drivers (
+               id INTEGER PRIMARY KEY AUTOINCREMENT,
+               name TEXT NOT NULL,
+               phone TEXT NOT NULL,
+               email TEXT NOT NULL,
+               license_number TEXT NOT NULL,
+               license_plate TEXT NOT NULL,
+               gender TEXT NOT NULL,
+               Model TEXT NOT NULL,
+               car_color TEXT NOT NULL,
+               available_seats INTEGER NOT NULL,
+               is_new_car BOOLEAN,
+               is_luxury BOOLEAN,
+               has_wheelchair BOOLEAN,
+               car_seat_count INTEGER,
+               has_booster BOOLEAN,
+               notify_rides BOOLEAN,
+               notify_deliveries BOOLEAN,
+               PassengerPreference TEXT NOT NULL
+           )''',
+    ]),
+    (2, 'unique license indexes and phone index', [
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_drivers_license_number ON drivers (license_number)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_drivers_license_plate ON drivers (license_plate)',
+        'CREATE INDEX IF NOT EXISTS idx_drivers_phone ON drivers (phone)',
+    ]),
+    (3, 'driver locations for matching', [
+        '''CREATE TABLE IF NOT EXISTS driver_locations (
+               driver_id INTEGER PRIMARY KEY REFERENCES drivers (id),
+               lat REAL NOT NULL,
+               lng REAL NOT NULL,
+               is_available BOOLEAN NOT NULL DEFAULT 1,
+               updated_at TIMESTAMP
+           )''',
+    ]),
+]
+
+PROFILES_MIGRATIONS = [
+    (1, 'create profiles, rides and user_state tables', [
+        '''CREATE TABLE IF NOT EXISTS profiles
+           (phone_number TEXT PRIMARY KEY,
+            profile_name TEXT,
+            gender TEXT,
+            zip_code TEXT,
+            created_at TIMESTAMP)''',
+        '''CREATE TABLE IF NOT EXISTS rides
+           (id INTEGER PRIMARY KEY AUTOINCREMENT,
+            phone_number TEXT,
+            pickup TEXT,
+            destination TEXT,
+            travel_time TEXT,
+            created_at TIMESTAMP)''',
+        '''CREATE TABLE IF NOT EXISTS user_state
+           (phone_number TEXT PRIMARY KEY,
+            current_step TEXT,
+            temp_profile_name TEXT,
+            temp_gender TEXT,
+            temp_zip_code TEXT,
+            temp_pickup TEXT,
+            temp_destination TEXT,
+            temp_travel_time TEXT,
+            channel TEXT)''',
+    ]),
+    (2, 'index rides by phone number and creation time', [
+        'CREATE INDEX IF NOT EXISTS idx_rides_phone_number ON rides (phone_number)',
+        'CREATE INDEX IF NOT EXISTS idx_rides_created_at ON rides (created_at)',
+    ]),
+    (3, 'ride dispatch status, assigned driver and pickup coordinates', [
+        "ALTER TABLE rides ADD COLUMN status TEXT NOT NULL DEFAULT 'pending'",
+        # Rides booked before dispatch existed are history, not work for the dispatcher
+        "UPDATE rides SET status = 'legacy'",
+        'ALTER TABLE rides ADD COLUMN driver_id INTEGER',
+        'ALTER TABLE rides ADD COLUMN assigned_at TIMESTAMP',
+        'ALTER TABLE rides ADD COLUMN pickup_lat REAL',
+        'ALTER TABLE rides ADD COLUMN pickup_lng REAL',
+        'CREATE INDEX IF NOT EXISTS idx_rides_status ON rides (status, created_at)',
+    ]),
+    (4, 'index profiles by creation time', [
+        'CREATE INDEX IF NOT EXISTS idx_profiles_created_at ON profiles (created_at)',
+    ]),
+    (5, 'start time of background ride resolution', [
+        'ALTER TABLE user_state ADD COLUMN resolving_started_at REAL',
+    ]),
+]
+
+# Aggregates refreshed by analytics.py, kept out of profiles.db
+ANALYTICS_MIGRATIONS = [
+    (1, 'create aggregate and watermark tables', [
+        '''CREATE TABLE IF NOT EXISTS watermarks
+           (source TEXT PRIMARY KEY,
+            created_at TIMESTAMP NOT NULL,
+            refreshed_at TIMESTAMP NOT NULL)''',
+        '''CREATE TABLE IF NOT EXISTS rides_per_zip_hour
+           (zip_code TEXT NOT NULL,
+            hour TEXT NOT NULL,
+            rides INTEGER NOT NULL,
+            PRIMARY KEY (zip_code, hour))''',
+        'CREATE INDEX IF NOT EXISTS idx_rides_per_zip_hour_hour ON rides_per_zip_hour (hour)',
+        '''CREATE TABLE IF NOT EXISTS pickup_destination_pairs
+           (pickup TEXT NOT NULL,
+            destination TEXT NOT NULL,
+            rides INTEGER NOT NULL,
+            last_ride_at TIMESTAMP,
+            PRIMARY KEY (pickup, destination))''',
+        'CREATE INDEX IF NOT EXISTS idx_pickup_destination_pairs_rides ON pickup_destination_pairs (rides)',
+        '''CREATE TABLE IF NOT EXISTS first_rides
+           (phone_number TEXT PRIMARY KEY,
+            profile_created_at TIMESTAMP,
+            first_ride_at TIMESTAMP)''',
+        '''CREATE TABLE IF NOT EXISTS conversion_daily
+           (day TEXT PRIMARY KEY,
+            profiles INTEGER NOT NULL,
+            converted INTEGER NOT NULL,
+            avg_hours_to_first_ride REAL)''',
+    ]),
+]
+
+
+def get_schema_version(conn):
+    """Return the schema version stored in the database header."""
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(database, migrations):
+    """
+    Bring a database up to the latest schema version.
+
+    Args:
+        database (str): Path of the SQLite database file
+        migrations (list): (version, description, statements) tuples in ascending order
+
+    Returns:
+        int: Schema version after migrating
+
+    Raises:
+        sqlite3.Error: If a migration fails; that migration is rolled back and
+        the version stays at the last one applied successfully
+    """
+    conn = get_connection(database)
+    current = get_schema_version(conn)
+
+    for version, description, statements in migrations:
+        if version <= current:
+            continue
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            # Another process may have migrated while we waited for the lock
+            if get_schema_version(conn) >= version:
+                conn.rollback()
+                current = get_schema_version(conn)
+                continue
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f'PRAGMA user_version = {int(version)}')
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            print(f"Migration {database} v{version} ({description}) failed: {str(e)}")
+            raise
+        print(f"Migrated {database} to v{version}: {description}")
+        current = version
+
+    return current
+
+
+if __name__ == '__main__':
+    for database, migrations in (('drivers.db', DRIVERS_MIGRATIONS),
+                                 ('profiles.db', PROFILES_MIGRATIONS)):
+        print(f"{database}: schema version {migrate(database, migrations)}")
@@ -1,140 +1,170 @@
-from flask import Flask, request, redirect
+from flask import Blueprint, Flask, request, redirect
 from twilio.twiml.voice_response import VoiceResponse, Gather
 from twilio.twiml.messaging_response import MessagingResponse
-import sqlite3
+import time
 from datetime import datetime
-import requests
-import googlemaps
 import os
-import math
-import urllib.parse
 from dotenv import load_dotenv
-from twilio.rest import Client
+from db_pool import get_connection
+from migrations import migrate, PROFILES_MIGRATIONS
+from zip_centroids import zip_centroid
+import address_index
+from geo_distance import calculate_distance, distances_from
+import background_jobs
+import http_client
+import travel_time as travel_time_service
+import services
+import metrics
+from state_store import create_state_store
+import request_cache
+from records import Profile, UserState, fetch_one
+from state_machine import StateMachine, Turn, is_profile_name, is_gender_choice, is_zip_code
 
 # Load environment variables
 load_dotenv()
 
 TWILIO_PHONE_NUMBER = os.getenv('TWILIO_PHONE_NUMBER')
-TWILIO_SID = os.getenv('TWILIO_SID')
 GEOCODING_API_KEY = os.getenv('GEOCODING_API_KEY') 
-TWILIO_AUTH_TOKEN = os.getenv('TWILIO_AUTH_TOKEN')
-
-app = Flask(__name__)
-client = Client(TWILIO_SID, TWILIO_AUTH_TOKEN)
+DATABASE = 'profiles.db'
+GOOGLE_MAPS_API_URL = os.getenv('GOOGLE_MAPS_API_URL', 'https://maps.googleapis.com/maps/api')
+GEOCODE_URL = f"{GOOGLE_MAPS_API_URL}/geocode/json"
+# Answer ride bookings immediately and resolve addresses in the background
+ASYNC_RESOLUTION = os.getenv('ASYNC_RESOLUTION', 'false').lower() in ('1', 'true', 'yes')
+# Seconds after which a background resolution is considered lost (worker recycled, crash, deploy)
+RESOLVING_TIMEOUT = float(os.getenv('RESOLVING_TIMEOUT', '120'))
+
+# Twilio webhooks, served with the driver registration routes by app_factory.create_app()
+sms_blueprint = Blueprint('sms', __name__)
+whatsapp_blueprint = Blueprint('whatsapp', __name__)
+voice_blueprint = Blueprint('voice', __name__)
+state_store = create_state_store(DATABASE)
 
 def setup_database():
-    conn = sqlite3.connect('profiles.db')
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS profiles
-                 (phone_number TEXT PRIMARY KEY,
-                  profile_name TEXT,
-                  gender TEXT,
-                  zip_code TEXT,
-                  created_at TIMESTAMP)''')
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS rides
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  phone_number TEXT,
-                  pickup TEXT,
-                  destination TEXT,
-                  travel_time TEXT,
-                  created_at TIMESTAMP)''')
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS user_state
-                 (phone_number TEXT PRIMARY KEY,
-                  current_step TEXT,
-                  temp_profile_name TEXT,
-                  temp_gender TEXT,
-                  temp_zip_code TEXT,
-                  temp_pickup TEXT,
-                  temp_destination TEXT,
-                  temp_travel_time TEXT,
-                  channel TEXT)''')
-    conn.commit()
-    conn.close()
+    """Create or upgrade the profiles.db schema (see migrations.py)"""
+    migrate(DATABASE, PROFILES_MIGRATIONS)
+
+for blueprint in (sms_blueprint, whatsapp_blueprint, voice_blueprint):
+    blueprint.record_once(lambda state: setup_database())
 
 def get_profile(phone_number):
-    conn = sqlite3.connect('profiles.db')
-    c = conn.cursor()
-    c.execute('SELECT * FROM profiles WHERE phone_number = ?', (phone_number,))
-    result = c.fetchone()
-    conn.close()
-    return result
+    """Profile row, fetched at most once per request"""
+    return request_cache.load('profile', phone_number, fetch_profile)
 
-def get_user_state(phone_number):
-    conn = sqlite3.connect('profiles.db')
-    c = conn.cursor()
-    c.execute('SELECT * FROM user_state WHERE phone_number = ?', (phone_number,))
-    result = c.fetchone()
-    conn.close()
-    return result
-
-def update_user_state(phone_number, state, temp_profile_name=None, temp_gender=None, 
-                     temp_zip_code=None, temp_pickup=None, temp_destination=None, 
-                     temp_travel_time=None, channel=None):
-    conn = sqlite3.connect('profiles.db')
-    c = conn.cursor()
-    c.execute('''INSERT OR REPLACE INTO user_state 
-                 (phone_number, current_step, temp_profile_name, temp_gender, 
-                  temp_zip_code, temp_pickup, temp_destination, temp_travel_time, channel)
-                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-              (phone_number, state, temp_profile_name, temp_gender, 
-               temp_zip_code, temp_pickup, temp_destination, temp_travel_time, channel))
-    conn.commit()
-    conn.close()
+@metrics.timed('db.fetch_profile')
+def fetch_profile(phone_number):
+    conn = get_connection(DATABASE)
+    return fetch_one(conn, Profile, 'SELECT * FROM profiles WHERE phone_number = ?', (phone_number,))
 
+def get_user_state(phone_number):
+    """Current conversation state row, fetched at most once per request"""
+    return request_cache.load('state', phone_number, fetch_user_state)
+
+@metrics.timed('db.fetch_user_state')
+def fetch_user_state(phone_number):
+    return state_store.get(phone_number)
+
+# Temporary answers each step still needs; the others are cleared on entering it so a later
+# step never acts on a stale value (e.g. a zip suggestion made before the user changed the zip by hand)
+BOOKING_TEMP_FIELDS = ('temp_pickup', 'temp_destination', 'temp_travel_time', 'temp_zip_code')
+STEP_TEMP_FIELDS = {
+    'AWAITING_PROFILE_NAME': (),
+    'AWAITING_GENDER': ('temp_profile_name',),
+    'AWAITING_ZIP': ('temp_profile_name', 'temp_gender'),
+    'MENU_CHOICE': (),
+    'UPDATING_ZIP': (),
+    'AWAITING_RIDE_BOOKING': ('temp_zip_code',),
+    'RESOLVING': BOOKING_TEMP_FIELDS,
+    'AWAITING_PICKUP': BOOKING_TEMP_FIELDS,
+    'AWAITING_DESTINATION_ADDRESS': BOOKING_TEMP_FIELDS,
+    'AWAITING_CONFIRMATION': BOOKING_TEMP_FIELDS,
+    'AWAITING_NEW_PICKUP': BOOKING_TEMP_FIELDS,
+    'AWAITING_NEW_DESTINATION': BOOKING_TEMP_FIELDS,
+}
+TEMP_FIELDS = tuple(field for field in UserState._fields if field.startswith('temp_'))
+
+@metrics.timed('db.update_user_state')
+def update_user_state(phone_number, state=None, **changes):
+    """Move to a new step (if given) and set the given UserState fields, keeping the others"""
+    if state is not None:
+        changes['current_step'] = state
+        kept = STEP_TEMP_FIELDS.get(state, TEMP_FIELDS)
+        for field in TEMP_FIELDS:
+            if field not in kept:
+                changes.setdefault(field, None)
+    row = state_store.update(phone_number, changes)
+    request_cache.remember('state', phone_number, row)
+
+@metrics.timed('db.clear_user_state')
 def clear_user_state(phone_number):
-    conn = sqlite3.connect('profiles.db')
-    c = conn.cursor()
-    c.execute('DELETE FROM user_state WHERE phone_number = ?', (phone_number,))
-    conn.commit()
-    conn.close()
+    state_store.delete(phone_number)
+    request_cache.remember('state', phone_number, None)
 
+@metrics.timed('db.save_profile')
 def save_profile(phone_number, profile_name, gender, zip_code):
-    conn = sqlite3.connect('profiles.db')
+    conn = get_connection(DATABASE)
     c = conn.cursor()
     c.execute('''INSERT OR REPLACE INTO profiles 
                  (phone_number, profile_name, gender, zip_code, created_at)
                  VALUES (?, ?, ?, ?, ?)''',
               (phone_number, profile_name, gender, zip_code, datetime.now()))
     conn.commit()
-    conn.close()
+    request_cache.invalidate('profile', phone_number)
 
+@metrics.timed('db.update_zip_code')
 def update_zip_code(phone_number, new_zip_code):
-    conn = sqlite3.connect('profiles.db')
+    conn = get_connection(DATABASE)
     c = conn.cursor()
     c.execute('''UPDATE profiles 
                  SET zip_code = ?
                  WHERE phone_number = ?''',
               (new_zip_code, phone_number))
     conn.commit()
-    conn.close()
+    request_cache.invalidate('profile', phone_number)
 
+@metrics.timed('db.save_ride')
 def save_ride(phone_number, pickup, destination,travel_time):
-    conn = sqlite3.connect('profiles.db')
+    conn = get_connection(DATABASE)
     c = conn.cursor()
     c.execute('''INSERT INTO rides 
                  (phone_number, pickup, destination,travel_time, created_at)
                  VALUES (?, ?, ?, ?, ?)''',
               (phone_number, pickup, destination,travel_time, datetime.now()))
     conn.commit()
-    conn.close()
+
+@metrics.timed('db.update_zip_code_from_suggestion')
 def update_zip_code_from_suggestion(phone_number, suggested_zip):
     """Update user's zip code based on suggested location"""
-    conn = sqlite3.connect('profiles.db')
+    conn = get_connection(DATABASE)
     c = conn.cursor()
     c.execute('''UPDATE profiles 
                  SET zip_code = ?
                  WHERE phone_number = ?''',
               (suggested_zip, phone_number))
     conn.commit()
-    conn.close()   
+    request_cache.invalidate('profile', phone_number)
+
+@metrics.timed('google.geocode')
+def geocode(address, zip_code=None):
+    """Geocode an address, optionally scoped to a zip code, answering from cache when possible"""
+    cached = services.geocode_cache().get(address, zip_code)
+    if cached is not None:
+        return cached
+    
+    # Parameters are URL encoded by the shared session
+    query = f"{address}, {zip_code}" if zip_code else address
+    response = http_client.get_json(GEOCODE_URL, {'address': query, 'key': GEOCODING_API_KEY})
+    services.geocode_cache().put(address, zip_code, response)
+    return response
 
 def get_zip_coordinates(zip_code):
     """Fetch coordinates for a given zip code"""
+    # Offline centroid index first, geocoder only for unknown zip codes
+    centroid = zip_centroid(zip_code)
+    if centroid:
+        return centroid
+    
     try:
-        url = f"https://maps.googleapis.com/maps/api/geocode/json?address={zip_code}&key={GEOCODING_API_KEY}"
-        response = requests.get(url).json()
+        response = geocode(zip_code)
         
         if response['status'] == 'OK' and response['results']:
             return response['results'][0]['geometry']['location']
@@ -143,29 +173,11 @@ def get_zip_coordinates(zip_code):
         print(f"Geocoding error: {e}")
         return None
 
-def calculate_distance(point1, point2):
-    """Calculate great-circle distance between two geographic points"""
-    if not point1 or not point2:
-        return float('inf')
-    
-    R = 6371  # Earth's radius in kilometers
-    
-    lat1, lon1 = math.radians(point1['lat']), math.radians(point1['lng'])
-    lat2, lon2 = math.radians(point2['lat']), math.radians(point2['lng'])
-    
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
-    
-    a = (math.sin(dlat/2)**2 + 
-         math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2)
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-    
-    return R * c  # Distance in kilometers
-
 def calculate_address_relevance(result, original_query):
     """Calculate relevance score for an address result"""
-    formatted_address = result['formatted_address'].lower()
-    query = original_query.lower()
+    # Compare normalized tokens, so "main street" matches "Main St"
+    formatted_address = ' '.join(address_index.tokenize(result['formatted_address']))
+    query = ' '.join(address_index.tokenize(original_query))
     
     # Exact match scoring
     if query in formatted_address:
@@ -182,6 +194,9 @@ def calculate_address_relevance(result, original_query):
 
 def rank_address_results(results, original_query, registered_zip_code=None):
     """Rank geocoding results by relevance and proximity"""
+    # Look up the registered zip once, not once per result
+    zip_coords = get_zip_coordinates(registered_zip_code) if registered_zip_code else None
+    
     def calculate_total_score(result):
         # Calculate base relevance score
         relevance_score = calculate_address_relevance(result, original_query)
@@ -189,7 +204,6 @@ def rank_address_results(results, original_query, registered_zip_code=None):
         # Add proximity bonus if zip code is available
         if registered_zip_code:
             try:
-                zip_coords = get_zip_coordinates(registered_zip_code)
                 result_coords = result['geometry']['location']
                 
                 if zip_coords:
@@ -217,42 +231,42 @@ def handle_ambiguous_address(address_results):
         return response
     return None
 
-def resolve_partial_address(partial_address, registered_zip_code=None):
-    """Enhanced address resolution with proximity context and zip code update suggestion"""
-    # URL encode the address to handle special characters
-    encoded_address = urllib.parse.quote(partial_address)
-    
-    # Prepare full address query
-    full_address = encoded_address
-    if registered_zip_code:
-        full_address += f",+{registered_zip_code}"
-    
-    # Geocoding API request
-    url = (f"https://maps.googleapis.com/maps/api/geocode/json"
-           f"?address={full_address}&key={GEOCODING_API_KEY}")
-    
+@metrics.timed('address.resolve_partial')
+def resolve_partial_address(partial_address, registered_zip_code=None, phone_number=None):
+    """Enhanced address resolution with proximity context and zip code update suggestion
+
+    A suggested zip code is kept in the user's state (when phone_number is given)
+    until they reply 'UPDATE ZIP'.
+    """
     try:
-        response = requests.get(url).json()
+        # An address the registered zip code's index identifies unambiguously is answered offline
+        if registered_zip_code:
+            local_result = address_index.get_index().match(partial_address, registered_zip_code)
+            if local_result:
+                return local_result['formatted_address'], None
+        
+        # Geocoding API request (cached per address and zip code)
+        response = geocode(partial_address, registered_zip_code)
         
         # Successful geocoding
         if response['status'] == 'OK':
             results = response['results']
+            address_index.get_index().learn(results)
             
             # If registered zip code exists, check proximity
             if registered_zip_code:
                 registered_coords = get_zip_coordinates(registered_zip_code)
                 
-                # Annotate results with distance from registered zip
-                for result in results:
-                    result_coords = result['geometry']['location']
-                    result['distance'] = calculate_distance(registered_coords, result_coords)
-                
-                # Sort results by distance
-                sorted_results = sorted(results, key=lambda x: x['distance'])
+                # Distance from registered zip to every result in one vectorized call
+                distances = distances_from(
+                    registered_coords, [result['geometry']['location'] for result in results])
+                closest = results[int(distances.argmin())]
                 
                 # If closest result is too far (e.g., >50 km), suggest zip code update
-                if sorted_results[0]['distance'] > 50:
-                    new_zip = sorted_results[0]['address_components'][-1]['long_name']
+                if distances.min() > 50:
+                    new_zip = closest['address_components'][-1]['long_name']
+                    if phone_number:
+                        update_user_state(phone_number, temp_zip_code=new_zip)
                     return None, (
                         f"Address seems far from your registered zip code {registered_zip_code}. "
                         f"Suggested zip code: {new_zip}. "
@@ -260,7 +274,7 @@ def resolve_partial_address(partial_address, registered_zip_code=None):
                     )
                 
                 # Return the closest result
-                return sorted_results[0]['formatted_address'], None
+                return closest['formatted_address'], None
             
             # If no registered zip, return first result
             return results[0]['formatted_address'], None
@@ -276,6 +290,12 @@ def resolve_partial_address(partial_address, registered_zip_code=None):
     except Exception as e:
         return None, f"Address resolution failed: {str(e)}"
     
+def resolve_addresses(addresses, registered_zip_code=None, phone_number=None):
+    """Resolve several partial addresses concurrently, returning (address, error) pairs in order"""
+    return http_client.run_concurrently(
+        metrics.propagate(resolve_partial_address),
+        [(address, registered_zip_code, phone_number) for address in addresses])
+
 def is_match_significantly_closer(sorted_results):
     """Determine if the first result is significantly closer"""
     # If the first result is at least 50% closer than the second, consider it a clear match
@@ -294,27 +314,6 @@ def parse_addresses(message):
         return [line for line in lines if line]
     return [message]
 
-def rank_address_results(results, original_query):
-    """Rank geocoding results by relevance"""
-    def calculate_relevance_score(result, query):
-        formatted_address = result['formatted_address'].lower()
-        query = query.lower()
-        
-        # Exact match gets highest score
-        if query in formatted_address:
-            return 100
-        
-        # Partial match scoring
-        words_matched = sum(word in formatted_address for word in query.split())
-        return words_matched * 10
-    
-    # Sort results by relevance score
-    return sorted(
-        results, 
-        key=lambda r: calculate_relevance_score(r, original_query), 
-        reverse=True
-    )
-   
 def handle_ride_confirmation(phone_number, origin, destination):
     """Handle ride confirmation process"""
     response = MessagingResponse()
@@ -336,19 +335,10 @@ def handle_ride_confirmation(phone_number, origin, destination):
                      temp_pickup=origin, temp_destination=destination)
     return str(response)
 
+@metrics.timed('google.travel_time')
 def calculate_travel_time(origin, destination):
-    """Calculate travel time between two addresses using Distance Matrix API."""
-    url = (
-        f"https://maps.googleapis.com/maps/api/distancematrix/json"
-        f"?origins={origin}&destinations={destination}&key={GEOCODING_API_KEY}"
-    )
-    response = requests.get(url).json()
-    
-    if response['status'] == 'OK' and response['rows'][0]['elements'][0]['status'] == 'OK':
-        duration = response['rows'][0]['elements'][0]['duration']['text']
-        return duration, None
-    else:
-        return None, "Error calculating travel time. Please check your addresses."
+    """Calculate travel time between two addresses using Distance Matrix API (cached, see travel_time.py)."""
+    return travel_time_service.get_travel_time(origin, destination)
 
 
 def handle_partial_addresses(phone_number, message):
@@ -356,11 +346,10 @@ def handle_partial_addresses(phone_number, message):
     response = MessagingResponse()
     user_state = get_user_state(phone_number)
 
-    if user_state and user_state[1] == 'AWAITING_DESTINATION_ADDRESS':
+    if user_state and user_state.current_step == 'AWAITING_DESTINATION_ADDRESS':
         # Destination address received
-        origin = user_state[5]
-        travel_time=user_state[7]
-        destination, error = resolve_partial_address(message, user_state[4])
+        origin = user_state.temp_pickup
+        destination, error = resolve_partial_address(message, get_profile(phone_number).zip_code)
         if error:
             response.message(error)
         else:
@@ -372,7 +361,7 @@ def handle_partial_addresses(phone_number, message):
             clear_user_state(phone_number)
     else:
         # First address received
-        address, error = resolve_partial_address(message, get_profile(phone_number)[3])
+        address, error = resolve_partial_address(message, get_profile(phone_number).zip_code)
         if error:
             response.message(error)
         else:
@@ -389,7 +378,7 @@ def handle_ivr_address_collection(phone_number, speech_result, state):
             gather.say("Please say your pickup address, then press pound.")
             response.append(gather)
         else:
-            address, error = resolve_partial_address(speech_result, get_profile(phone_number)[3])
+            address, error = resolve_partial_address(speech_result, get_profile(phone_number).zip_code)
             if error:
                 response.say(error)
                 gather = Gather(input='speech', action='/voice')
@@ -402,13 +391,13 @@ def handle_ivr_address_collection(phone_number, speech_result, state):
                 update_user_state(phone_number, 'AWAITING_DESTINATION_ADDRESS', temp_pickup=address)
     
     elif state == 'AWAITING_DESTINATION_ADDRESS':
-        origin = get_user_state(phone_number)[5]
+        origin = get_user_state(phone_number).temp_pickup
         if not speech_result:
             gather = Gather(input='speech', action='/voice')
             gather.say("Please say your destination address, then press pound.")
             response.append(gather)
         else:
-            destination, error = resolve_partial_address(speech_result, get_profile(phone_number)[3])
+            destination, error = resolve_partial_address(speech_result, get_profile(phone_number).zip_code)
             if error:
                 response.say(error)
                 gather = Gather(input='speech', action='/voice')
@@ -419,7 +408,6 @@ def handle_ivr_address_collection(phone_number, speech_result, state):
                 if error:
                     response.say(error)
                 else:
-                    travel_time, error = calculate_travel_time(origin, destination)
                     response.say(f"From {origin} to {destination}. Estimated travel time: {travel_time}.")
                     gather = Gather(num_digits=1, action='/voice')
                     gather.say("To confirm addresses press 1, to change pickup address press 2, to change destination press 3.")
@@ -432,10 +420,10 @@ def handle_ivr_address_collection(phone_number, speech_result, state):
     elif state == 'AWAITING_CONFIRMATION':
         user_state = get_user_state(phone_number)
         if speech_result == '1':
-            save_ride(phone_number, user_state[5], user_state[6],user_state[7])
+            save_ride(phone_number, user_state.temp_pickup, user_state.temp_destination, user_state.temp_travel_time)
             response.say("Ride confirmed! You will receive a confirmation SMS. Thank you for using our service.")
             send_sms_notification(phone_number, 
-                f"Ride confirmed!\nPickup: {user_state[5]}\nDestination: {user_state[6]}\nEstimated travel time: {user_state[7]}")
+                f"Ride confirmed!\nPickup: {user_state.temp_pickup}\nDestination: {user_state.temp_destination}\nEstimated travel time: {user_state.temp_travel_time}")
             clear_user_state(phone_number)
         elif speech_result == '2':
             response.say("Please say your new pickup address, then press pound.")
@@ -452,185 +440,16 @@ def handle_ivr_address_collection(phone_number, speech_result, state):
             gather.say("Invalid option. To confirm addresses press 1, to change pickup address press 2, to change destination press 3.")
             response.append(gather)
     
-    return str(response)
-def handle_whatsapp_profile_creation(phone_number, message, state):
-    """Handle WhatsApp profile creation flow"""
-    response = MessagingResponse()
-    user_state = get_user_state(phone_number)
-    
-    if state == 'AWAITING_PROFILE_NAME':
-        if len(message) == 4 and message.isdigit():
-            response.message("Please enter your gender:\n1️⃣ for Male\n2️⃣ for Female")
-            update_user_state(phone_number, 'AWAITING_GENDER', message, channel='WHATSAPP')
-        else:
-            response.message("⚠️ Please enter exactly 4 digits for your profile name.")
-            
-    elif state == 'AWAITING_GENDER':
-        if message in ['1', '2']:
-            gender = 'Male' if message == '1' else 'Female'
-            response.message("Please enter your 5-digit zip code 📍")
-            update_user_state(phone_number, 'AWAITING_ZIP', temp_profile_name=user_state[2], 
-                            temp_gender=gender, channel='WHATSAPP')
-        else:
-            response.message("❌ Invalid selection. Enter 1 for Male or 2 for Female")
-            
-    elif state == 'AWAITING_ZIP':
-        if len(message) == 5 and message.isdigit():
-            save_profile(phone_number, user_state[2], user_state[3], message)
-            response.message(
-                
-                f"Account: {user_state[2]}, gender {user_state[3].lower()}, zip code {message}"
-                "✅ Profile created successfully! To Change your zip code text #, To book a ride, text your pickup address, coma, then destination address.\n\n"
-                "🚗 Let's book a ride now!\n"
-                "Send pickup address, comma, destination address\n"
-                "Example: 123 Main St, 456 Oak Rd\n"
-                "⚠️ Please provide both addresses in one of these formats:\n\n"
-                "1️⃣ address1 , address2\n"
-                "2️⃣ address1 ## address2\n"
-                "3️⃣ address1 (on first line)\n"
-                "   address2 (on second line)"
-            )
-            update_user_state(phone_number, 'AWAITING_RIDE_BOOKING', channel='WHATSAPP')
-        else:
-            response.message("⚠️ Please enter a valid 5-digit zip code")
-            
-    return str(response)
-def handle_whatsapp(phone_number, message):
-    """Main WhatsApp message handler"""
-    response = MessagingResponse()
-    user_state = get_user_state(phone_number)
-    profile = get_profile(phone_number)
-    if profile:
-            # Handle zip code update suggestion
-            if user_state and user_state[8] and 'UPDATE ZIP' in message.upper():
-                # Extract suggested zip from previous message
-                suggested_zip = user_state[8].split()[-1]
-                update_zip_code(phone_number, suggested_zip)
-                response.message(f"Zip code updated to {suggested_zip}")
-                clear_user_state(phone_number)
-                return str(response)
-    # New user registration
-    if not profile:
-        if not user_state:
-            response.message(
-                "👋 Welcome to Safe Drive !\n\n"
-                "Let's create your profile 📝\n"
-                "Please enter a 4-digit profile name"
-            )
-            update_user_state(phone_number, 'AWAITING_PROFILE_NAME', channel='WHATSAPP')
-        else:
-            return handle_whatsapp_profile_creation(phone_number, message, user_state[1])
-    
-    # Existing user interactions
-    else:
-        if message.lower() == '#':
-            response.message("📍 Enter your new zip code")
-            update_user_state(phone_number, 'UPDATING_ZIP', channel='WHATSAPP')
-            
-        elif user_state and user_state[1] == 'UPDATING_ZIP':
-            if len(message) == 5 and message.isdigit():
-                update_zip_code(phone_number, message)
-                response.message(
-                    "✅ ZIP code updated successfully!\n\n"
-                    f"{get_current_user_info(phone_number)}\n" 
-                    "🚗 Ready to book a ride!\n"
-                    "Send pickup address, comma, destination address\n"
-                    "Example: 123 Main St, 456 Oak Rd\n"
-                    "⚠️ Please provide both addresses in one of these formats:\n\n"
-                    "1️⃣ address1 , address2\n"
-                    "2️⃣ address1 ## address2\n"
-                    "3️⃣ address1 (on first line)\n"
-                    "   address2 (on second line)\n\n"
-
-                    "⚠️To Change your zip code text #"
-                )
-                update_user_state(phone_number, 'AWAITING_RIDE_BOOKING', channel='WHATSAPP')
-            else:
-                response.message("⚠️ Please enter a valid 5-digit zip code")
-                
-        elif user_state and user_state[1] == 'AWAITING_CONFIRMATION':
-            if message == '1':
-                save_ride(phone_number, user_state[5], user_state[6],user_state[7])
-                response.message(
-                    "✅ Ride confirmed!\n\n"
-                    f"📍 Pickup: {user_state[5]}\n"
-                    f"🎯 Destination: {user_state[6]}"
-                    f"⏱ Travel Time: {user_state[7]}"
-                )
-                clear_user_state(phone_number)
-            elif message in ['2', '3']:
-                response.message("📍 Please enter the new address:")
-                update_user_state(phone_number, 
-                                'AWAITING_NEW_PICKUP' if message == '2' else 'AWAITING_NEW_DESTINATION',
-                                temp_pickup=user_state[5],
-                                temp_destination=user_state[6],
-                                channel='WHATSAPP')
-            else:
-                response.message(
-                    "❌ Invalid option\n\n"
-                    "1️⃣ Confirm booking\n"
-                    "2️⃣ Change pickup address\n"
-                    "3️⃣ Change destination address\n\n\n"
-                    "⚠️To Change your zip code text #, To book a ride, text your pickup address, coma, then destination address."
-                )
-                
-        elif user_state and user_state[1].startswith('AWAITING_NEW_'):
-            if user_state[1] == 'AWAITING_NEW_PICKUP':
-                address_full, error = resolve_partial_address(message, profile[3])
-                if error:
-                    response.message(f"❌ {error}")
-                else:
-                    return handle_whatsapp_ride_booking(phone_number, [address_full, user_state[6]], profile)
-            else:  # AWAITING_NEW_DESTINATION
-                address_full, error = resolve_partial_address(message, profile[3])
-                if error:
-                    response.message(f"❌ {error}")
-                else:
-                    return handle_whatsapp_ride_booking(phone_number, [user_state[5], address_full], profile)
-                
-        else:
-            addresses = parse_addresses(message)
-            return handle_whatsapp_ride_booking(phone_number, addresses, profile)
-    
     return str(response)
 def handle_whatsapp_ride_booking(phone_number, addresses, profile):
     """Handle WhatsApp ride booking process"""
     response = MessagingResponse()
     
     if len(addresses) == 2:
-        pickup, destination = addresses
-        pickup_full, error = resolve_partial_address(pickup, profile[3])
-        if error:
-            response.message(f"❌ Pickup address error: {error}")
-            return str(response)
-            
-        destination_full, error = resolve_partial_address(destination, profile[3])
-        if error:
-            response.message(f"❌ Destination address error: {error}")
-            return str(response)
-        
-        travel_time, error = calculate_travel_time(pickup_full, destination_full)
-        if error:
-            response.message(f"❌ {error}")
-            return str(response)
-        
-        msg = (
-            f"🚗 Ride Details:\n\n"
-            f"📍 From: {pickup_full}\n"
-            f"🎯 To: {destination_full}\n"
-            f"⏱️ Estimated time: {travel_time}\n\n"
-            f"Please confirm:\n"
-            f"1️⃣ Confirm booking\n"
-            f"2️⃣ Change pickup address\n"
-            f"3️⃣ Change destination address\n\n\n"
-            "⚠️To Change your zip code text #, To book a ride, text your pickup address, coma, then destination address."
-        )
-        response.message(msg)
-        update_user_state(phone_number, 'AWAITING_CONFIRMATION', 
-                         temp_pickup=pickup_full, 
-                         temp_destination=destination_full,
-                         temp_travel_time=travel_time,
-                         channel='WHATSAPP')
+        if ASYNC_RESOLUTION:
+            response.message(start_ride_resolution(phone_number, addresses, profile.zip_code, 'WHATSAPP'))
+        else:
+            response.message(complete_whatsapp_ride_booking(phone_number, addresses, profile.zip_code))
         
     else:
         response.message(
@@ -644,22 +463,109 @@ def handle_whatsapp_ride_booking(phone_number, addresses, profile):
         )
     
     return str(response)
+def complete_whatsapp_ride_booking(phone_number, addresses, zip_code):
+    """Resolve both addresses and the travel time, return the WhatsApp reply text"""
+    # Both lookups run in parallel on the shared HTTP session
+    (pickup_full, error), (destination_full, destination_error) = resolve_addresses(addresses, zip_code, phone_number)
+    if error:
+        return f"❌ Pickup address error: {error}"
+        
+    if destination_error:
+        return f"❌ Destination address error: {destination_error}"
+    
+    travel_time, error = calculate_travel_time(pickup_full, destination_full)
+    if error:
+        return f"❌ {error}"
+    
+    update_user_state(phone_number, 'AWAITING_CONFIRMATION', 
+                     temp_pickup=pickup_full, 
+                     temp_destination=destination_full,
+                     temp_travel_time=travel_time,
+                     temp_zip_code=None,
+                     channel='WHATSAPP')
+    return (
+        f"🚗 Ride Details:\n\n"
+        f"📍 From: {pickup_full}\n"
+        f"🎯 To: {destination_full}\n"
+        f"⏱️ Estimated time: {travel_time}\n\n"
+        f"Please confirm:\n"
+        f"1️⃣ Confirm booking\n"
+        f"2️⃣ Change pickup address\n"
+        f"3️⃣ Change destination address\n\n\n"
+        "⚠️To Change your zip code text #, To book a ride, text your pickup address, coma, then destination address."
+    )
 def get_current_user_info(phone_number):
     """Get formatted user information string"""
     profile = get_profile(phone_number)
     if profile:
-        return f"Account {profile[1]}, gender {profile[2].lower()}, zip code {profile[3]}"
+        return f"Account {profile.profile_name}, gender {profile.gender.lower()}, zip code {profile.zip_code}"
     return None
 def send_sms_notification(phone_number, message):
+    """Queue an SMS, delivered by the outbound queue workers"""
     try:
-        client.messages.create(
+        services.outbound_queue().enqueue(
+            to=phone_number,
             body=message,
-            from_=TWILIO_PHONE_NUMBER,
-            to=phone_number
+            from_=TWILIO_PHONE_NUMBER
         )
     except Exception as e:
         print(f"Error sending SMS: {str(e)}")
 
+def send_whatsapp_notification(phone_number, message):
+    """Queue a WhatsApp message, delivered by the outbound queue workers"""
+    try:
+        services.outbound_queue().enqueue(
+            to=f"whatsapp:{phone_number}",
+            body=message,
+            from_=f"whatsapp:{TWILIO_PHONE_NUMBER}"
+        )
+    except Exception as e:
+        print(f"Error sending WhatsApp message: {str(e)}")
+
+# Background ride resolution
+def start_ride_resolution(phone_number, addresses, zip_code, channel):
+    """Acknowledge the booking right away and resolve the addresses on a background worker"""
+    started_at = time.time()
+    update_user_state(phone_number, 'RESOLVING', temp_pickup=addresses[0],
+                      temp_destination=addresses[1], channel=channel, resolving_started_at=started_at)
+    background_jobs.submit(finish_ride_resolution, phone_number, addresses, zip_code, channel, started_at)
+    return "Looking up your addresses, you will receive the ride details in a moment."
+
+def resolution_expired(user_state):
+    """True if the user is stuck in RESOLVING because the background job was lost"""
+    started_at = user_state.resolving_started_at if user_state else None
+    return (user_state is not None and user_state.current_step == 'RESOLVING'
+            and (started_at is None or time.time() - started_at > RESOLVING_TIMEOUT))
+
+def finish_ride_resolution(phone_number, addresses, zip_code, channel, started_at=None):
+    """Background worker: resolve a booking and deliver the result as an outbound message"""
+    # The user gave up on this lookup (timed out and started over) while it was queued
+    user_state = get_user_state(phone_number)
+    if started_at is not None and (user_state is None or user_state.current_step != 'RESOLVING'
+                                   or user_state.resolving_started_at != started_at):
+        print(f"Dropping expired ride resolution for {phone_number}")
+        return
+    
+    if channel == 'WHATSAPP':
+        complete, send = complete_whatsapp_ride_booking, send_whatsapp_notification
+    else:
+        complete, send = complete_sms_ride_booking, send_sms_notification
+    
+    try:
+        message = complete(phone_number, addresses, zip_code)
+    except Exception as e:
+        print(f"Ride resolution error: {str(e)}")
+        message = "Sorry, we could not look up your ride. Please send your pickup and destination addresses again."
+    
+    # Resolution failed, let the user start a new booking
+    user_state = get_user_state(phone_number)
+    if user_state and user_state.current_step == 'RESOLVING':
+        update_user_state(phone_number, 'AWAITING_RIDE_BOOKING', channel=channel, resolving_started_at=None)
+    elif user_state and user_state.resolving_started_at is not None:
+        update_user_state(phone_number, resolving_started_at=None)
+    
+    send(phone_number, message)
+
 # IVR Handlers
 def handle_voice_welcome(phone_number):
     response = VoiceResponse()
@@ -681,128 +587,58 @@ def handle_voice_welcome(phone_number):
     return str(response)
 
 def handle_voice_profile_creation(phone_number, digits, state):
+    turn = Turn(phone_number, digits, get_user_state(phone_number), channel='IVR', digits=digits)
+    return voice_profile_flow.dispatch(turn, state)
+
+def handle_voice_ride_booking(phone_number, speech_result, digits, state):
+    turn = Turn(phone_number, digits, get_user_state(phone_number), channel='IVR',
+                digits=digits, speech=speech_result)
+    return voice_ride_flow.dispatch(turn, state)
+
+def complete_voice_profile(turn):
+    user_state = turn.user_state
+    save_profile(turn.phone_number, user_state.temp_profile_name, user_state.temp_gender, turn.text)
+    send_sms_notification(turn.phone_number, 
+        f" Account: {user_state.temp_profile_name},Name: {user_state.temp_gender},Zipcode: {turn.text}. Profile created successfully! To Change your zip code text #, To book a ride, text your pickup address, coma, then destination address.\n\n")
     response = VoiceResponse()
-    user_state = get_user_state(phone_number)
-    
-    if state == 'AWAITING_PROFILE_NAME':
-        if len(digits) == 4:
-            gather = Gather(num_digits=1, action='/voice')
-            gather.say("Press 1 for Male, press 2 for Female.")
-            response.append(gather)
-            update_user_state(phone_number, 'AWAITING_GENDER', digits, channel='IVR')
-        else:
-            gather = Gather(num_digits=4, action='/voice')
-            gather.say("Please enter exactly 4 digits for your profile name.")
-            response.append(gather)
-            
-    elif state == 'AWAITING_GENDER':
-        if digits in ['1', '2']:
-            gender = 'Male' if digits == '1' else 'Female'
-            gather = Gather(num_digits=5, action='/voice')
-            gather.say("Please enter your 5-digit zip code.")
-            response.append(gather)
-            update_user_state(phone_number, 'AWAITING_ZIP', temp_profile_name=user_state[2], 
-                            temp_gender=gender, channel='IVR')
-        else:
-            gather = Gather(num_digits=1, action='/voice')
-            gather.say("Invalid selection. Press 1 for Male or 2 for Female.")
-            response.append(gather)
-            
-    elif state == 'AWAITING_ZIP':
-        if len(digits) == 5 and digits.isdigit():
-            save_profile(phone_number, user_state[2], user_state[3], digits)
-            send_sms_notification(phone_number, 
-                f" Account: {user_state[2]},Name: {user_state[3]},Zipcode: {digits}. Profile created successfully! To Change your zip code text #, To book a ride, text your pickup address, coma, then destination address.\n\n")
-            response.say("Profile created successfully!To Change your zip code text #, To book a ride, text your pickup address, coma, then destination address. Let's book your ride.")
-            gather = Gather(input='speech', action='/voice')
-            gather.say("Please say your pickup address, then press pound.")
-            response.append(gather)
-            update_user_state(phone_number, 'AWAITING_PICKUP', channel='IVR')
-        else:
-            gather = Gather(num_digits=5, action='/voice')
-            gather.say("Please enter a valid 5-digit zip code.")
-            response.append(gather)
-            
+    response.say("Profile created successfully!To Change your zip code text #, To book a ride, text your pickup address, coma, then destination address. Let's book your ride.")
+    gather = Gather(input='speech', action='/voice')
+    gather.say("Please say your pickup address, then press pound.")
+    response.append(gather)
+    update_user_state(turn.phone_number, 'AWAITING_PICKUP', channel='IVR')
     return str(response)
 
-def handle_voice_ride_booking(phone_number, speech_result, digits, state):
+def voice_menu_choice(turn):
+    if turn.digits == '1':
+        update_user_state(turn.phone_number, 'AWAITING_PICKUP', channel='IVR')
+        return reply(turn, 'ask_pickup')
+    if turn.digits == '2':
+        update_user_state(turn.phone_number, 'UPDATING_ZIP', channel='IVR')
+        return reply(turn, 'ask_new_zip')
+    return reply(turn, 'invalid_menu_choice')
+
+def voice_collect_address(turn):
+    return handle_ivr_address_collection(turn.phone_number, turn.speech, turn.state)
+
+def voice_confirmation(turn):
+    return handle_ivr_address_collection(turn.phone_number, turn.digits, turn.state)
+
+def voice_zip_updated(turn):
+    update_zip_code(turn.phone_number, turn.text)
     response = VoiceResponse()
-    user_state = get_user_state(phone_number)
-    
-    if state == 'MENU_CHOICE':
-        if digits == '1':
-            gather = Gather(input='speech', action='/voice')
-            gather.say("Please say your pickup address, then press pound.")
-            response.append(gather)
-            update_user_state(phone_number, 'AWAITING_PICKUP', channel='IVR')
-        elif digits == '2':
-            gather = Gather(num_digits=5, action='/voice')
-            gather.say("Please enter your new 5-digit ZIP code.")
-            response.append(gather)
-            update_user_state(phone_number, 'UPDATING_ZIP', channel='IVR')
-        else:
-            gather = Gather(num_digits=1, action='/voice')
-            gather.say("Invalid option. Press 1 to book a ride, press 2 to update your ZIP code.")
-            response.append(gather)
-    
-    elif state == 'AWAITING_PICKUP':
-        return handle_ivr_address_collection(phone_number, speech_result, state)
-    
-    elif state == 'AWAITING_DESTINATION_ADDRESS':
-        return handle_ivr_address_collection(phone_number, speech_result, state)
-    
-    elif state == 'AWAITING_CONFIRMATION':
-        return handle_ivr_address_collection(phone_number, digits, state)
-    
-    elif state == 'UPDATING_ZIP':
-        if len(digits) == 5 and digits.isdigit():
-            update_zip_code(phone_number, digits)
-            response.say("ZIP code updated successfully! To Change your zip code text #, To book a ride, text your pickup address, coma, then destination address.\n\n")
-            clear_user_state(phone_number)
-        else:
-            gather = Gather(num_digits=5, action='/voice')
-            gather.say("Please enter a valid 5-digit ZIP code.")
-            response.append(gather)
-    
+    response.say("ZIP code updated successfully! To Change your zip code text #, To book a ride, text your pickup address, coma, then destination address.\n\n")
+    clear_user_state(turn.phone_number)
     return str(response)
+
 def handle_sms_ride_booking(phone_number, addresses, profile):
     """Handle SMS ride booking process"""
     response = MessagingResponse()
     
     if len(addresses) == 2:
-        pickup, destination = addresses
-        pickup_full, error = resolve_partial_address(pickup, profile[3])
-        if error:
-            response.message(f"Pickup address error: {error}")
-            return str(response)
-            
-        destination_full, error = resolve_partial_address(destination, profile[3])
-        if error:
-            response.message(f"Destination address error: {error}")
-            return str(response)
-        
-        travel_time, error = calculate_travel_time(pickup_full, destination_full)
-        if error:
-            response.message(f"{error}")
-            return str(response)
-        
-        msg = (
-            f"Ride Details:\n\n"
-            f"From: {pickup_full}\n"
-            f"To: {destination_full}\n"
-            f"Estimated time: {travel_time}\n\n"
-            f"Please confirm:\n"
-            f"1.Confirm booking\n"
-            f"2.Change pickup address\n"
-            f"3.Change destination address\n\n"
-            " To Change your zip code text #, To book a ride, text your pickup address, coma, then destination address."
-        )
-        response.message(msg)
-        update_user_state(phone_number, 'AWAITING_CONFIRMATION', 
-                         temp_pickup=pickup_full, 
-                         temp_destination=destination_full,
-                         temp_travel_time=travel_time,
-                         channel='SMS')
+        if ASYNC_RESOLUTION:
+            response.message(start_ride_resolution(phone_number, addresses, profile.zip_code, 'SMS'))
+        else:
+            response.message(complete_sms_ride_booking(phone_number, addresses, profile.zip_code))
         
     else:
         response.message(
@@ -816,142 +652,325 @@ def handle_sms_ride_booking(phone_number, addresses, profile):
         )
     
     return str(response)
-# SMS Handlers
-def handle_sms(phone_number, message):
-    response = MessagingResponse()
-    user_state = get_user_state(phone_number)
-    profile = get_profile(phone_number)
-    if profile:
-        # Handle zip code update suggestion
-        if user_state and user_state[8] and 'UPDATE ZIP' in message.upper():
-            # Extract suggested zip from previous message
-            suggested_zip = user_state[8].split()[-1]
-            update_zip_code(phone_number, suggested_zip)
-            response.message(f"Zip code updated to {suggested_zip}")
-            clear_user_state(phone_number)
-            return str(response)
-    # New user registration
-    if not profile:
-        if not user_state:
-            response.message("Welcome to RideSafe Local!\nLet's create your profile.\nPlease enter a 4-digit profile name.")
-            update_user_state(phone_number, 'AWAITING_PROFILE_NAME', channel='SMS')
-        else:
-            return handle_sms_profile_creation(phone_number, message, user_state[1])
-    
-    # Existing user interactions
-    else:
-        if message.lower() == '#':
-            response.message("Enter your new zip code")
-            update_user_state(phone_number, 'UPDATING_ZIP', channel='SMS')
-            
-        elif user_state and user_state[1] == 'UPDATING_ZIP':
-            if len(message) == 5 and message.isdigit():
-                update_zip_code(phone_number, message)
-                send_sms_notification(phone_number, 
-                    f" Account: {profile[1]}, Name: {profile[2]}, Zipcode: {message}. Profile Updated successfully! To Change your zip code text #, To book a ride, text your pickup address, coma, then destination address.")
-                response.message(
-                   f"Send pickup address, comma, destination address\n"
-                    "Example: 123 Main St, 456 Oak Rd\n"
-                    "Please provide both addresses in one of these formats:\n\n"
-                    "1.address1 , address2\n"
-                    "2.address1 ## address2\n"
-                    "3.address1 (on first line)\n"
-                    "address2 (on second line)\n\n\n"
-                    "To Change your zip code text #, To book a ride, text your pickup address, coma, then destination address."
-                )
-                update_user_state(phone_number, 'AWAITING_RIDE_BOOKING', channel='SMS')
-            else:
-                response.message("Please enter a valid 5-digit zip code.")
-        
-        elif user_state and user_state[1] == 'AWAITING_CONFIRMATION':
-            if message == '1':
-                save_ride(phone_number, user_state[5], user_state[6], user_state[7])
-                response.message(
-                    "Ride confirmed!\n\n"
-                    f"Pickup: {user_state[5]}\n"
-                    f"Destination: {user_state[6]}\n"
-                    f"Travel Time: {user_state[7]}"
-                )
-                clear_user_state(phone_number)
-            elif message in ['2', '3']:
-                response.message("Please enter the new address:")
-                update_user_state(phone_number, 
-                                'AWAITING_NEW_PICKUP' if message == '2' else 'AWAITING_NEW_DESTINATION',
-                                temp_pickup=user_state[5],
-                                temp_destination=user_state[6],
-                                channel='SMS')
-            else:
-                response.message(
-                    "  Invalid option\n\n"
-                    "1. Confirm booking\n"
-                    "2. Change pickup address\n"
-                    "3. Change destination address"
-                )
-        
-        elif user_state and user_state[1].startswith('AWAITING_NEW_'):
-            if user_state[1] == 'AWAITING_NEW_PICKUP':
-                address_full, error = resolve_partial_address(message, profile[3])
-                if error:
-                    response.message(f"{error}")
-                else:
-                    return handle_sms_ride_booking(phone_number, [address_full, user_state[6]], profile)
-            else:  # AWAITING_NEW_DESTINATION
-                address_full, error = resolve_partial_address(message, profile[3])
-                if error:
-                    response.message(f" {error}")
-                else:
-                    return handle_sms_ride_booking(phone_number, [user_state[5], address_full], profile)
+def complete_sms_ride_booking(phone_number, addresses, zip_code):
+    """Resolve both addresses and the travel time, return the SMS reply text"""
+    # Both lookups run in parallel on the shared HTTP session
+    (pickup_full, error), (destination_full, destination_error) = resolve_addresses(addresses, zip_code, phone_number)
+    if error:
+        return f"Pickup address error: {error}"
         
-        else:
-            addresses = parse_addresses(message)
-            return handle_sms_ride_booking(phone_number, addresses, profile)
+    if destination_error:
+        return f"Destination address error: {destination_error}"
     
+    travel_time, error = calculate_travel_time(pickup_full, destination_full)
+    if error:
+        return f"{error}"
+    
+    update_user_state(phone_number, 'AWAITING_CONFIRMATION', 
+                     temp_pickup=pickup_full, 
+                     temp_destination=destination_full,
+                     temp_travel_time=travel_time,
+                     temp_zip_code=None,
+                     channel='SMS')
+    return (
+        f"Ride Details:\n\n"
+        f"From: {pickup_full}\n"
+        f"To: {destination_full}\n"
+        f"Estimated time: {travel_time}\n\n"
+        f"Please confirm:\n"
+        f"1.Confirm booking\n"
+        f"2.Change pickup address\n"
+        f"3.Change destination address\n\n"
+        " To Change your zip code text #, To book a ride, text your pickup address, coma, then destination address."
+    )
+# Conversation flows (see state_machine.py)
+
+# Texts per messaging channel, formatted with the fields passed to reply()
+MESSAGES = {
+    'SMS': {
+        'welcome': "Welcome to RideSafe Local!\nLet's create your profile.\nPlease enter a 4-digit profile name.",
+        'ask_gender': "Please enter your gender 1 for Male, 2 for Female:",
+        'invalid_profile_name': "Please enter exactly 4 digits for your profile name.",
+        'ask_zip': "Please enter your zip code:",
+        'invalid_gender': "Invalid selection. Enter 1 for Male or 2 for Female:",
+        'invalid_zip': "Please enter a valid 5-digit zip code:",
+        'profile_created': (
+            "Account: {profile_name}, gender {gender}, zip code {zip_code}\n\n"
+            "Profile created successfully! To Change your zip code text #, To book a ride, text your pickup address, coma, then destination address.\n\n"
+            "Let's book a ride now!\n"
+            "Send pickup address, comma, destination address\n"
+            "Example: 123 Main St, 456 Oak Rd"
+            "Please provide both addresses in one of these formats:\n\n"
+            "1.address1 , address2\n"
+            "2.address1 ## address2\n"
+            "3.address1 (on first line)\n"
+            "address2 (on second line)"
+        ),
+        'zip_suggestion_accepted': "Zip code updated to {zip_code}",
+        'resolving': "Still looking up your addresses, the ride details are on their way.",
+        'ask_new_zip': "Enter your new zip code",
+        'zip_updated': (
+            "Send pickup address, comma, destination address\n"
+            "Example: 123 Main St, 456 Oak Rd\n"
+            "Please provide both addresses in one of these formats:\n\n"
+            "1.address1 , address2\n"
+            "2.address1 ## address2\n"
+            "3.address1 (on first line)\n"
+            "address2 (on second line)\n\n\n"
+            "To Change your zip code text #, To book a ride, text your pickup address, coma, then destination address."
+        ),
+        'zip_updated_notification': " Account: {profile_name}, Name: {gender}, Zipcode: {zip_code}. Profile Updated successfully! To Change your zip code text #, To book a ride, text your pickup address, coma, then destination address.",
+        'invalid_new_zip': "Please enter a valid 5-digit zip code.",
+        'ride_confirmed': (
+            "Ride confirmed!\n\n"
+            "Pickup: {pickup}\n"
+            "Destination: {destination}\n"
+            "Travel Time: {travel_time}"
+        ),
+        'ask_new_address': "Please enter the new address:",
+        'invalid_option': (
+            "  Invalid option\n\n"
+            "1. Confirm booking\n"
+            "2. Change pickup address\n"
+            "3. Change destination address"
+        ),
+        'address_error': "{error}",
+        'destination_error': " {error}",
+    },
+    'WHATSAPP': {
+        'welcome': (
+            "👋 Welcome to Safe Drive !\n\n"
+            "Let's create your profile 📝\n"
+            "Please enter a 4-digit profile name"
+        ),
+        'ask_gender': "Please enter your gender:\n1️⃣ for Male\n2️⃣ for Female",
+        'invalid_profile_name': "⚠️ Please enter exactly 4 digits for your profile name.",
+        'ask_zip': "Please enter your 5-digit zip code 📍",
+        'invalid_gender': "❌ Invalid selection. Enter 1 for Male or 2 for Female",
+        'invalid_zip': "⚠️ Please enter a valid 5-digit zip code",
+        'profile_created': (
+            "Account: {profile_name}, gender {gender}, zip code {zip_code}"
+            "✅ Profile created successfully! To Change your zip code text #, To book a ride, text your pickup address, coma, then destination address.\n\n"
+            "🚗 Let's book a ride now!\n"
+            "Send pickup address, comma, destination address\n"
+            "Example: 123 Main St, 456 Oak Rd\n"
+            "⚠️ Please provide both addresses in one of these formats:\n\n"
+            "1️⃣ address1 , address2\n"
+            "2️⃣ address1 ## address2\n"
+            "3️⃣ address1 (on first line)\n"
+            "   address2 (on second line)"
+        ),
+        'zip_suggestion_accepted': "Zip code updated to {zip_code}",
+        'resolving': "⏳ Still looking up your addresses, the ride details are on their way.",
+        'ask_new_zip': "📍 Enter your new zip code",
+        'zip_updated': (
+            "✅ ZIP code updated successfully!\n\n"
+            "{user_info}\n"
+            "🚗 Ready to book a ride!\n"
+            "Send pickup address, comma, destination address\n"
+            "Example: 123 Main St, 456 Oak Rd\n"
+            "⚠️ Please provide both addresses in one of these formats:\n\n"
+            "1️⃣ address1 , address2\n"
+            "2️⃣ address1 ## address2\n"
+            "3️⃣ address1 (on first line)\n"
+            "   address2 (on second line)\n\n"
+            "⚠️To Change your zip code text #"
+        ),
+        'zip_updated_notification': None,
+        'invalid_new_zip': "⚠️ Please enter a valid 5-digit zip code",
+        'ride_confirmed': (
+            "✅ Ride confirmed!\n\n"
+            "📍 Pickup: {pickup}\n"
+            "🎯 Destination: {destination}"
+            "⏱ Travel Time: {travel_time}"
+        ),
+        'ask_new_address': "📍 Please enter the new address:",
+        'invalid_option': (
+            "❌ Invalid option\n\n"
+            "1️⃣ Confirm booking\n"
+            "2️⃣ Change pickup address\n"
+            "3️⃣ Change destination address\n\n\n"
+            "⚠️To Change your zip code text #, To book a ride, text your pickup address, coma, then destination address."
+        ),
+        'address_error': "❌ {error}",
+        'destination_error': "❌ {error}",
+    },
+}
+
+# IVR prompts: (text, digits to gather), None gathers speech instead
+VOICE_PROMPTS = {
+    'ask_gender': ("Press 1 for Male, press 2 for Female.", 1),
+    'invalid_profile_name': ("Please enter exactly 4 digits for your profile name.", 4),
+    'ask_zip': ("Please enter your 5-digit zip code.", 5),
+    'invalid_gender': ("Invalid selection. Press 1 for Male or 2 for Female.", 1),
+    'invalid_zip': ("Please enter a valid 5-digit zip code.", 5),
+    'ask_pickup': ("Please say your pickup address, then press pound.", None),
+    'ask_new_zip': ("Please enter your new 5-digit ZIP code.", 5),
+    'invalid_menu_choice': ("Invalid option. Press 1 to book a ride, press 2 to update your ZIP code.", 1),
+    'invalid_new_zip': ("Please enter a valid 5-digit ZIP code.", 5),
+}
+
+def reply(turn, key, **fields):
+    """Render a conversation text as TwiML for the turn's channel"""
+    if turn.channel == 'IVR':
+        text, num_digits = VOICE_PROMPTS[key]
+        response = VoiceResponse()
+        if num_digits:
+            gather = Gather(num_digits=num_digits, action='/voice')
+        else:
+            gather = Gather(input='speech', action='/voice')
+        gather.say(text)
+        response.append(gather)
+    else:
+        response = MessagingResponse()
+        response.message(MESSAGES[turn.channel][key].format(**fields))
     return str(response)
 
+def reprompt(key):
+    """Handler that answers with a fixed text and keeps the current state"""
+    return lambda turn: reply(turn, key)
+
+# Profile creation, shared by every channel
+def accept_profile_name(turn):
+    update_user_state(turn.phone_number, 'AWAITING_GENDER', temp_profile_name=turn.text, channel=turn.channel)
+    return reply(turn, 'ask_gender')
+
+def accept_gender(turn):
+    gender = 'Male' if turn.text == '1' else 'Female'
+    update_user_state(turn.phone_number, 'AWAITING_ZIP', temp_gender=gender, channel=turn.channel)
+    return reply(turn, 'ask_zip')
+
+def complete_messaging_profile(turn):
+    user_state = turn.user_state
+    save_profile(turn.phone_number, user_state.temp_profile_name, user_state.temp_gender, turn.text)
+    update_user_state(turn.phone_number, 'AWAITING_RIDE_BOOKING', channel=turn.channel)
+    return reply(turn, 'profile_created', profile_name=user_state.temp_profile_name,
+                 gender=user_state.temp_gender.lower(), zip_code=turn.text)
+
+def build_profile_flow(name, complete_profile, empty_response, profile_name_check=is_profile_name):
+    flow = StateMachine(name, fallback=lambda turn: str(empty_response()))
+    flow.step('AWAITING_PROFILE_NAME', profile_name_check, accept_profile_name, reprompt('invalid_profile_name'))
+    flow.step('AWAITING_GENDER', is_gender_choice, accept_gender, reprompt('invalid_gender'))
+    flow.step('AWAITING_ZIP', is_zip_code, complete_profile, reprompt('invalid_zip'))
+    return flow
+
+# Ride booking for existing SMS / WhatsApp users
+def messaging_zip_updated(turn):
+    update_zip_code(turn.phone_number, turn.text)
+    notification = MESSAGES[turn.channel]['zip_updated_notification']
+    if notification:
+        send_sms_notification(turn.phone_number, notification.format(
+            profile_name=turn.profile.profile_name, gender=turn.profile.gender, zip_code=turn.text))
+    response = reply(turn, 'zip_updated', user_info=get_current_user_info(turn.phone_number))
+    update_user_state(turn.phone_number, 'AWAITING_RIDE_BOOKING', channel=turn.channel)
+    return response
+
+def messaging_confirmation(turn):
+    user_state = turn.user_state
+    if turn.text == '1':
+        save_ride(turn.phone_number, user_state.temp_pickup, user_state.temp_destination,
+                  user_state.temp_travel_time)
+        clear_user_state(turn.phone_number)
+        return reply(turn, 'ride_confirmed', pickup=user_state.temp_pickup,
+                     destination=user_state.temp_destination, travel_time=user_state.temp_travel_time)
+    if turn.text in ['2', '3']:
+        update_user_state(turn.phone_number, 
+                        'AWAITING_NEW_PICKUP' if turn.text == '2' else 'AWAITING_NEW_DESTINATION',
+                        channel=turn.channel)
+        return reply(turn, 'ask_new_address')
+    return reply(turn, 'invalid_option')
+
+def messaging_new_pickup(turn):
+    address_full, error = resolve_partial_address(turn.text, turn.profile.zip_code, turn.phone_number)
+    if error:
+        return reply(turn, 'address_error', error=error)
+    return RIDE_BOOKING_HANDLERS[turn.channel](
+        turn.phone_number, [address_full, turn.user_state.temp_destination], turn.profile)
 
-def handle_sms_profile_creation(phone_number, message, state):
-    response = MessagingResponse()
-    user_state = get_user_state(phone_number)
+def messaging_new_destination(turn):
+    address_full, error = resolve_partial_address(turn.text, turn.profile.zip_code, turn.phone_number)
+    if error:
+        return reply(turn, 'destination_error', error=error)
+    return RIDE_BOOKING_HANDLERS[turn.channel](
+        turn.phone_number, [turn.user_state.temp_pickup, address_full], turn.profile)
+
+def messaging_start_booking(turn):
+    addresses = parse_addresses(turn.text)
+    return RIDE_BOOKING_HANDLERS[turn.channel](turn.phone_number, addresses, turn.profile)
+
+def build_messaging_flow(name):
+    flow = StateMachine(name, fallback=messaging_start_booking)
+    flow.on('RESOLVING')(reprompt('resolving'))
+    flow.step('UPDATING_ZIP', is_zip_code, messaging_zip_updated, reprompt('invalid_new_zip'))
+    flow.on('AWAITING_CONFIRMATION')(messaging_confirmation)
+    flow.on('AWAITING_NEW_PICKUP')(messaging_new_pickup)
+    flow.on('AWAITING_NEW_DESTINATION')(messaging_new_destination)
+    return flow
+
+RIDE_BOOKING_HANDLERS = {
+    'SMS': handle_sms_ride_booking,
+    'WHATSAPP': handle_whatsapp_ride_booking,
+}
+
+# (profile creation flow, ride booking flow) per messaging channel
+MESSAGING_FLOWS = {
+    'SMS': (build_profile_flow('sms_profile', complete_messaging_profile, MessagingResponse),
+            build_messaging_flow('sms')),
+    'WHATSAPP': (build_profile_flow('whatsapp_profile', complete_messaging_profile, MessagingResponse),
+                 build_messaging_flow('whatsapp')),
+}
+
+# The keypad only sends digits, so IVR checks the length alone
+voice_profile_flow = build_profile_flow('voice_profile', complete_voice_profile, VoiceResponse,
+                                        profile_name_check=lambda digits: len(digits) == 4)
+
+voice_ride_flow = StateMachine('voice', fallback=lambda turn: str(VoiceResponse()))
+voice_ride_flow.on('MENU_CHOICE')(voice_menu_choice)
+voice_ride_flow.on('AWAITING_PICKUP', 'AWAITING_DESTINATION_ADDRESS')(voice_collect_address)
+voice_ride_flow.on('AWAITING_CONFIRMATION')(voice_confirmation)
+voice_ride_flow.step('UPDATING_ZIP', is_zip_code, voice_zip_updated, reprompt('invalid_new_zip'))
+
+# SMS / WhatsApp Handlers
+def handle_messaging(phone_number, message, channel):
+    """Main SMS / WhatsApp message handler"""
+    turn = Turn(phone_number, message, get_user_state(phone_number), get_profile(phone_number), channel)
+    profile_flow, ride_flow = MESSAGING_FLOWS[channel]
     
-    if state == 'AWAITING_PROFILE_NAME':
-        if len(message) == 4 and message.isdigit():
-            response.message("Please enter your gender 1 for Male, 2 for Female:")
-            update_user_state(phone_number, 'AWAITING_GENDER', message, channel='SMS')
-        else:
-            response.message("Please enter exactly 4 digits for your profile name.")
-            
-    elif state == 'AWAITING_GENDER':
-        if message in ['1', '2']:
-            gender = 'Male' if message == '1' else 'Female'
-            response.message("Please enter your zip code:")
-            update_user_state(phone_number, 'AWAITING_ZIP', temp_profile_name=user_state[2], 
-                            temp_gender=gender, channel='SMS')
-        else:
-            response.message("Invalid selection. Enter 1 for Male or 2 for Female:")
-            
-    elif state == 'AWAITING_ZIP':
-        if len(message) == 5 and message.isdigit():
-            save_profile(phone_number, user_state[2], user_state[3], message)
-            response.message(
-                
-                f"Account: {user_state[2]}, gender {user_state[3].lower()}, zip code {message}\n\n"
-                "Profile created successfully! To Change your zip code text #, To book a ride, text your pickup address, coma, then destination address.\n\n"
-                "Let's book a ride now!\n"
-                "Send pickup address, comma, destination address\n"
-                "Example: 123 Main St, 456 Oak Rd"
-                 "Please provide both addresses in one of these formats:\n\n"
-                "1.address1 , address2\n"
-                "2.address1 ## address2\n"
-                "3.address1 (on first line)\n"
-                "address2 (on second line)"
-            )
-            update_user_state(phone_number, 'AWAITING_RIDE_BOOKING', channel='SMS')
-        else:
-            response.message("Please enter a valid 5-digit zip code:")
-            
-    return str(response)
+    # New user registration
+    if not turn.profile:
+        if not turn.user_state:
+            update_user_state(phone_number, 'AWAITING_PROFILE_NAME', channel=channel)
+            return reply(turn, 'welcome')
+        return profile_flow.dispatch(turn)
+    
+    # Handle zip code update suggestion
+    if turn.user_state and turn.user_state.temp_zip_code and 'UPDATE ZIP' in message.upper():
+        # Zip code suggested by resolve_partial_address
+        suggested_zip = turn.user_state.temp_zip_code
+        update_zip_code_from_suggestion(phone_number, suggested_zip)
+        clear_user_state(phone_number)
+        return reply(turn, 'zip_suggestion_accepted', zip_code=suggested_zip)
+    
+    # A lookup that never finished (job lost with its worker) must not block the user forever
+    if resolution_expired(turn.user_state):
+        update_user_state(phone_number, 'AWAITING_RIDE_BOOKING', channel=channel, resolving_started_at=None)
+        turn.user_state = get_user_state(phone_number)
+    
+    # '#' starts a zip code change from any state, unless a booking is being resolved
+    if message.lower() == '#' and turn.state != 'RESOLVING':
+        update_user_state(phone_number, 'UPDATING_ZIP', channel=channel)
+        return reply(turn, 'ask_new_zip')
+    
+    return ride_flow.dispatch(turn)
 
-@app.route("/voice", methods=['POST','GET'])
+def handle_sms(phone_number, message):
+    return handle_messaging(phone_number, message, 'SMS')
+
+def handle_whatsapp(phone_number, message):
+    """Main WhatsApp message handler"""
+    return handle_messaging(phone_number, message, 'WHATSAPP')
+
+@voice_blueprint.route("/voice", methods=['POST','GET'])
 def voice():
     phone_number = request.form.get('From', '')
     digits = request.form.get('Digits', '')
@@ -962,21 +981,28 @@ def voice():
     if not user_state:
         return handle_voice_welcome(phone_number)
         
-    if user_state[1] in ['AWAITING_PROFILE_NAME', 'AWAITING_GENDER', 'AWAITING_ZIP']:
-        return handle_voice_profile_creation(phone_number, digits, user_state[1])
+    if voice_profile_flow.handles(user_state.current_step):
+        return handle_voice_profile_creation(phone_number, digits, user_state.current_step)
     else:
-        return handle_voice_ride_booking(phone_number, speech_result, digits, user_state[1])
+        return handle_voice_ride_booking(phone_number, speech_result, digits, user_state.current_step)
 
-@app.route("/sms", methods=['POST','GET'])
+@sms_blueprint.route("/sms", methods=['POST','GET'])
 def sms():
     phone_number = request.form.get('From', '')
     message = request.form.get('Body', '').strip()
     return handle_sms(phone_number, message)
-@app.route("/whatsapp", methods=['POST','GET'])
+
+@whatsapp_blueprint.route("/whatsapp", methods=['POST','GET'])
 def whatsapp():
     phone_number = request.form.get('From', '').replace('whatsapp:', '')
     message = request.form.get('Body', '').strip()
     return handle_whatsapp(phone_number, message)
+
+# Standalone passenger app, see app_factory.create_app() for the combined one
+app = Flask(__name__)
+for blueprint in (sms_blueprint, whatsapp_blueprint, voice_blueprint, metrics.metrics_blueprint):
+    app.register_blueprint(blueprint)
+
 if __name__ == "__main__":
-    setup_database()
+    services.outbound_queue()
     app.run(debug=True, port=5001)
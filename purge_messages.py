@@ -0,0 +1,240 @@
+# purge_messages.py
+
+"""
+Bulk Twilio Message Purge
+
+Deletes every message sent after a given date:
+- streams the message list page by page (client.messages.stream), so the
+  full listing is never held in memory and paging is handled by the SDK
+- deletes with a bounded thread pool instead of one request at a time
+- appends each deleted SID to a checkpoint file, so an interrupted run
+  resumes where it stopped
+- --dry-run lists what would be deleted without deleting anything
+- reports throughput, and an ETA when the total is known (--count-first)
+
+Usage:
+    python purge_messages.py 2025-01-08 --workers 16
+    python purge_messages.py 2025-01-08 --dry-run --count-first
+    python purge_messages.py 2025-01-08 --fake 5000     # offline, against FakeTwilioClient
+"""
+
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+# Configuration constants
+DEFAULT_WORKERS = 8
+PAGE_SIZE = 1000          # Maximum page size accepted by the Messages API
+CHECKPOINT_FILE = 'purge_checkpoint.txt'
+REPORT_EVERY = 500        # Progress line every N messages
+
+
+class FakeMessage:
+    def __init__(self, sid, date_sent):
+        self.sid = sid
+        self.date_sent = date_sent
+
+
+class FakeMessageContext:
+    def __init__(self, store, sid):
+        self._store = store
+        self._sid = sid
+
+    def delete(self):
+        time.sleep(self._store.latency)
+        with self._store.lock:
+            return self._store.messages.pop(self._sid, None) is not None
+
+
+class FakeMessageList:
+    """Mimics client.messages: stream(), list() and messages(sid).delete()."""
+
+    def __init__(self, count, latency):
+        start = datetime(2025, 1, 1)
+        self.messages = {
+            f"SM{i:032d}": FakeMessage(f"SM{i:032d}", start + timedelta(minutes=i))
+            for i in range(count)
+        }
+        self.latency = latency
+        self.lock = threading.Lock()
+
+    def stream(self, date_sent_after=None, page_size=50, limit=None):
+        with self.lock:
+            snapshot = list(self.messages.values())
+        for position, message in enumerate(snapshot):
+            if date_sent_after and message.date_sent <= date_sent_after:
+                continue
+            if position % page_size == 0:
+                time.sleep(self.latency)  # One page fetch
+            yield message
+
+    def list(self, **kwargs):
+        return list(self.stream(**kwargs))
+
+    def __call__(self, sid):
+        return FakeMessageContext(self, sid)
+
+
+class FakeTwilioClient:
+    """
+    Offline stand-in for twilio.rest.Client covering the calls used here.
+
+    Args:
+        count (int): Number of fake messages to create
+        latency (float): Simulated seconds per API request
+    """
+
+    def __init__(self, count=1000, latency=0.005):
+        self.messages = FakeMessageList(count, latency)
+
+
+def load_checkpoint(path):
+    """Return the set of SIDs already deleted by a previous run."""
+    if not path or not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        return {line.strip() for line in f if line.strip()}
+
+
+class Progress:
+    """Thread-safe counters with periodic throughput/ETA output."""
+
+    def __init__(self, total=None):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.skipped = 0
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def record(self, ok):
+        with self._lock:
+            if ok:
+                self.done += 1
+            else:
+                self.failed += 1
+            processed = self.done + self.failed
+        if processed % REPORT_EVERY == 0:
+            self.report()
+
+    def report(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        processed = self.done + self.failed
+        rate = processed / elapsed
+        line = f"{self.done} deleted, {self.failed} failed, {self.skipped} skipped | {rate:.1f} msg/s"
+        if self.total:
+            remaining = max(self.total - processed - self.skipped, 0)
+            eta = remaining / rate if rate else float('inf')
+            line += f" | {processed + self.skipped}/{self.total} | ETA {eta:.0f}s"
+        print(line)
+
+
+def purge_messages(client, date_sent_after, workers=DEFAULT_WORKERS, checkpoint=CHECKPOINT_FILE,
+                   dry_run=False, count_first=False):
+    """
+    Delete all messages sent after date_sent_after.
+
+    Args:
+        client: twilio.rest.Client or FakeTwilioClient
+        date_sent_after (datetime): Only messages sent after this moment are deleted
+        workers (int): Concurrent delete requests
+        checkpoint (str): File recording deleted SIDs, or None to disable resuming
+        dry_run (bool): Only list the messages that would be deleted
+        count_first (bool): Do a listing pass first so progress can show an ETA
+
+    Returns:
+        Progress: Final counters
+    """
+    total = None
+    if count_first:
+        total = sum(1 for _ in client.messages.stream(date_sent_after=date_sent_after,
+                                                      page_size=PAGE_SIZE))
+        print(f"{total} messages sent after {date_sent_after:%Y-%m-%d}")
+
+    already_deleted = load_checkpoint(checkpoint)
+    progress = Progress(total)
+    stream = client.messages.stream(date_sent_after=date_sent_after, page_size=PAGE_SIZE)
+
+    if dry_run:
+        for message in stream:
+            if message.sid in already_deleted:
+                progress.skipped += 1
+                continue
+            print(f"Would delete message SID: {message.sid}")
+            progress.record(True)
+        progress.report()
+        return progress
+
+    checkpoint_file = open(checkpoint, 'a') if checkpoint else None
+    checkpoint_lock = threading.Lock()
+    # Bound the number of queued deletes so the stream is consumed lazily
+    in_flight = threading.BoundedSemaphore(workers * 4)
+
+    def delete(sid):
+        try:
+            client.messages(sid).delete()
+        except Exception as e:
+            print(f"Failed to delete {sid}: {str(e)}")
+            progress.record(False)
+        else:
+            if checkpoint_file:
+                with checkpoint_lock:
+                    checkpoint_file.write(sid + '\n')
+                    checkpoint_file.flush()
+            progress.record(True)
+        finally:
+            in_flight.release()
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for message in stream:
+                if message.sid in already_deleted:
+                    progress.skipped += 1
+                    continue
+                in_flight.acquire()
+                pool.submit(delete, message.sid)
+    finally:
+        if checkpoint_file:
+            checkpoint_file.close()
+
+    progress.report()
+    return progress
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Delete Twilio messages sent after a date.')
+    parser.add_argument('date_sent_after', help='YYYY-MM-DD')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='concurrent deletes')
+    parser.add_argument('--checkpoint', default=CHECKPOINT_FILE, help='resume file of deleted SIDs')
+    parser.add_argument('--no-checkpoint', action='store_true', help='do not read or write a checkpoint')
+    parser.add_argument('--dry-run', action='store_true', help='list messages without deleting')
+    parser.add_argument('--count-first', action='store_true', help='count messages first to report an ETA')
+    parser.add_argument('--fake', type=int, metavar='N', help='run against a fake client with N messages')
+    args = parser.parse_args(argv)
+
+    if args.fake is not None:
+        client = FakeTwilioClient(args.fake)
+    else:
+        from dotenv import load_dotenv
+        from twilio.rest import Client
+        load_dotenv()
+        client = Client(os.getenv('TWILIO_ACCOUNT_SID'), os.getenv('TWILIO_AUTH_TOKEN'))
+
+    date_sent_after = datetime.strptime(args.date_sent_after, '%Y-%m-%d')
+    progress = purge_messages(
+        client, date_sent_after,
+        workers=args.workers,
+        checkpoint=None if args.no_checkpoint else args.checkpoint,
+        dry_run=args.dry_run,
+        count_first=args.count_first,
+    )
+    verb = 'Listed' if args.dry_run else 'Deleted'
+    print(f"{verb} {progress.done} messages sent after {args.date_sent_after} "
+          f"({progress.failed} failed, {progress.skipped} already done).")
+
+
+if __name__ == '__main__':
+    main()
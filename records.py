@@ -0,0 +1,96 @@
+# records.py
+
+"""
+Typed Database Records
+
+NamedTuple types for the rows of profiles.db and drivers.db. They are plain
+tuples underneath (no per-instance __dict__), so they cost no more than the
+sqlite3 rows they replace and still support positional access, but fields are
+read by name: user_state.temp_pickup instead of user_state[5].
+
+Fields follow the table column order, so a record is built straight from a
+cursor row with record_factory() / fetch_one() / fetch_all().
+"""
+
+from typing import NamedTuple, Optional
+
+
+class Profile(NamedTuple):
+    phone_number: str
+    profile_name: Optional[str] = None
+    gender: Optional[str] = None
+    zip_code: Optional[str] = None
+    created_at: Optional[str] = None
+
+
+class UserState(NamedTuple):
+    phone_number: str
+    current_step: Optional[str] = None
+    temp_profile_name: Optional[str] = None
+    temp_gender: Optional[str] = None
+    temp_zip_code: Optional[str] = None      # Zip code suggested for a far-away address
+    temp_pickup: Optional[str] = None
+    temp_destination: Optional[str] = None
+    temp_travel_time: Optional[str] = None
+    channel: Optional[str] = None
+    resolving_started_at: Optional[float] = None  # Unix time the RESOLVING step began
+
+
+class Ride(NamedTuple):
+    id: int
+    phone_number: str
+    pickup: Optional[str] = None
+    destination: Optional[str] = None
+    travel_time: Optional[str] = None
+    created_at: Optional[str] = None
+    status: Optional[str] = None             # 'pending', 'assigned', 'unassigned' or 'legacy' (pre-dispatch)
+    driver_id: Optional[int] = None
+    assigned_at: Optional[str] = None
+    pickup_lat: Optional[float] = None
+    pickup_lng: Optional[float] = None
+
+
+class Driver(NamedTuple):
+    id: int
+    name: str
+    phone: str
+    email: str
+    license_number: str
+    license_plate: str
+    gender: str
+    model: str                               # Column "Model"
+    car_color: str
+    available_seats: int
+    is_new_car: Optional[bool] = None
+    is_luxury: Optional[bool] = None
+    has_wheelchair: Optional[bool] = None
+    car_seat_count: Optional[int] = None
+    has_booster: Optional[bool] = None
+    notify_rides: Optional[bool] = None
+    notify_deliveries: Optional[bool] = None
+    passenger_preference: Optional[str] = None  # Column "PassengerPreference"
+
+
+def record_factory(record):
+    """
+    sqlite3 row factory building `record` instances.
+
+    Set it on a cursor (cursor.row_factory = record_factory(Profile)) rather
+    than on the pooled connection, which other queries share.
+    """
+    make = record._make
+    return lambda cursor, row: make(row)
+
+
+def fetch_one(conn, record, query, params=()):
+    """Run a query and return its first row as a `record`, or None."""
+    cursor = conn.cursor()
+    cursor.row_factory = record_factory(record)
+    return cursor.execute(query, params).fetchone()
+
+
+def fetch_all(conn, record, query, params=()):
+    """Run a query and return every row as a `record`."""
+    cursor = conn.cursor()
+    cursor.row_factory = record_factory(record)
+    return cursor.execute(query, params).fetchall()
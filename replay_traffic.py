@@ -0,0 +1,363 @@
+# replay_traffic.py
+
+"""
+Webhook Traffic Replay
+
+Replays a JSONL capture of webhook requests against the app, as a load test
+and as a regression test:
+
+- the capture is streamed line by line (plain or .gz), never loaded whole;
+  at most --max-pending requests are buffered at a time
+- requests of one conversation (phone number) are sent strictly in capture
+  order, one at a time; different conversations run in parallel on
+  --concurrency workers
+- with timestamps in the capture, requests are sent on the original schedule
+  compressed by --speed (10 = ten times faster, 0 = as fast as possible)
+- responses are written in capture order to --output and compared with a
+  baseline (--baseline, a previous --output) or with the "response" recorded
+  in the capture; differences are reported as unified diffs
+
+Capture format, one request per line (the bench_webhooks.py workload format,
+"t" and "response" optional):
+    {"t": 1718000000.25, "path": "/sms", "form": {"From": "+15550000001", "Body": "hi"},
+     "response": "<?xml ...><Response>...</Response>"}
+    {"t": "2024-06-10T06:13:20.5", "phone": "L-1", "path": "/api/submit", "json": {...}}
+The conversation key is "phone", else the form's From (without "whatsapp:").
+
+By default the capture runs in-process on fresh databases with fake Google
+and Twilio backends (see bench_webhooks.offline_app), so runs are
+reproducible; --target sends it to a running server instead.
+
+Usage:
+    python replay_traffic.py capture.jsonl.gz --speed 10 --output run.jsonl
+    python replay_traffic.py capture.jsonl --baseline run.jsonl
+    python replay_traffic.py capture.jsonl --target http://127.0.0.1:8000 --concurrency 32
+"""
+
+import argparse
+import difflib
+import gzip
+import heapq
+import json
+import os
+import sys
+import threading
+import time
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+# Configuration constants
+MAX_DIFFS_SHOWN = 10
+REQUEST_TIMEOUT = 30
+
+
+def _open(path):
+    if path == '-':
+        return sys.stdin
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    return open(path, encoding='utf-8')
+
+
+def read_jsonl(path):
+    """Stream the objects of a JSONL file (plain, .gz or '-' for stdin)."""
+    f = _open(path)
+    try:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def conversation_key(entry):
+    """Key whose requests must stay in order: the phone number of the conversation."""
+    if entry.get('phone'):
+        return entry['phone']
+    sender = (entry.get('form') or {}).get('From')
+    if sender:
+        return sender.replace('whatsapp:', '')
+    return entry.get('path', '')
+
+
+def timestamp(entry):
+    """Capture time of a request in epoch seconds, or None."""
+    t = entry.get('t')
+    if t is None:
+        return None
+    if isinstance(t, (int, float)):
+        return float(t)
+    return datetime.fromisoformat(t).timestamp()
+
+
+class ConversationExecutor:
+    """
+    Runs requests on a thread pool, several conversations at once but the
+    requests of one conversation sequentially and in submission order.
+
+    Args:
+        send (callable): send(seq, entry), called on a worker thread
+        workers (int): Number of worker threads
+        max_pending (int): Requests buffered before submit() blocks
+    """
+
+    def __init__(self, send, workers, max_pending):
+        self.send = send
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='replay')
+        self._waiting = {}       # conversation key -> deque of (seq, entry), while one is in flight
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def submit(self, seq, entry):
+        self._slots.acquire()
+        key = conversation_key(entry)
+        with self._lock:
+            waiting = self._waiting.get(key)
+            if waiting is not None:
+                waiting.append((seq, entry))
+                return
+            self._waiting[key] = deque()
+        self._pool.submit(self._run, key, seq, entry)
+
+    def _run(self, key, seq, entry):
+        while True:
+            try:
+                self.send(seq, entry)
+            finally:
+                self._slots.release()
+            with self._lock:
+                waiting = self._waiting[key]
+                if not waiting:
+                    del self._waiting[key]
+                    return
+                seq, entry = waiting.popleft()
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
+
+
+class ResponseWriter:
+    """
+    Puts responses back in capture order, writes them to an output file and
+    compares each with its baseline.
+
+    Args:
+        output (str): JSONL file for the responses, optional
+        baseline (str): JSONL file of a previous run's responses, optional
+    """
+
+    def __init__(self, output=None, baseline=None):
+        self._out = open(output, 'w', encoding='utf-8') if output else None
+        self._baseline = read_jsonl(baseline) if baseline else None
+        self._heap = []
+        self._next = 0
+        self._lock = threading.Lock()
+        self.compared = 0
+        self.mismatches = 0
+        self.diffs = []
+
+    def add(self, seq, record, expected=None):
+        with self._lock:
+            heapq.heappush(self._heap, (seq, record, expected))
+            while self._heap and self._heap[0][0] == self._next:
+                self._write(*heapq.heappop(self._heap))
+                self._next += 1
+
+    def _write(self, seq, record, expected):
+        if self._out is not None:
+            self._out.write(json.dumps(record) + '\n')
+        if self._baseline is not None:
+            baseline = next(self._baseline, None)
+            expected = None if baseline is None else baseline.get('response')
+        if expected is None:
+            return
+        self.compared += 1
+        if expected != record['response']:
+            self.mismatches += 1
+            if len(self.diffs) < MAX_DIFFS_SHOWN:
+                self.diffs.append('\n'.join(difflib.unified_diff(
+                    _pretty(expected), _pretty(record['response']),
+                    f"baseline #{seq} {record['path']} {record['key']}", f"replay #{seq}", lineterm='')))
+
+    def close(self):
+        if self._out is not None:
+            self._out.close()
+
+
+def _pretty(body):
+    """TwiML / JSON split one element per line, so diffs point at the changed part."""
+    return body.replace('><', '>\n<').splitlines()
+
+
+def in_process_sender(app):
+    """send(entry) -> (status, body) through a Flask test client per worker thread."""
+    local = threading.local()
+
+    def send(entry):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = app.test_client()
+        if 'json' in entry:
+            response = client.post(entry['path'], json=entry['json'])
+        else:
+            response = client.post(entry['path'], data=entry.get('form', {}))
+        return response.status_code, response.get_data(as_text=True)
+    return send
+
+
+def http_sender(target):
+    """send(entry) -> (status, body) over HTTP to a running server, one session per worker thread."""
+    import requests
+
+    local = threading.local()
+    target = target.rstrip('/')
+
+    def send(entry):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        if 'json' in entry:
+            response = session.post(target + entry['path'], json=entry['json'], timeout=REQUEST_TIMEOUT)
+        else:
+            response = session.post(target + entry['path'], data=entry.get('form', {}), timeout=REQUEST_TIMEOUT)
+        return response.status_code, response.text
+    return send
+
+
+def replay(entries, send, concurrency=8, speed=0.0, max_pending=1000, output=None, baseline=None):
+    """
+    Replay a stream of capture entries.
+
+    Args:
+        entries (iterable): Capture entries, in capture order
+        send (callable): send(entry) -> (status, body)
+        concurrency (int): Conversations in flight at once
+        speed (float): Schedule compression factor, 0 for no pacing
+        max_pending (int): Requests read ahead of the workers
+        output, baseline (str): Response files, see ResponseWriter
+
+    Returns:
+        dict: Summary statistics, with up to MAX_DIFFS_SHOWN diffs
+    """
+    writer = ResponseWriter(output, baseline)
+    latencies = {}           # path -> array of seconds
+    errors = {}
+    stats_lock = threading.Lock()
+
+    def run(seq, entry):
+        started = time.perf_counter()
+        try:
+            status, body = send(entry)
+        except Exception as e:
+            status, body = 0, f"{type(e).__name__}: {e}"
+        elapsed = time.perf_counter() - started
+        path = entry.get('path', '')
+        with stats_lock:
+            latencies.setdefault(path, array('d')).append(elapsed)
+            if status == 0 or status >= 500:
+                errors[path] = errors.get(path, 0) + 1
+        writer.add(seq, {'seq': seq, 'key': conversation_key(entry), 'path': path,
+                         'status': status, 'response': body}, entry.get('response'))
+
+    executor = ConversationExecutor(run, concurrency, max_pending)
+    started = time.perf_counter()
+    first_t = None
+    max_lag = 0.0
+    count = 0
+    try:
+        for seq, entry in enumerate(entries):
+            t = timestamp(entry)
+            if speed and t is not None:
+                if first_t is None:
+                    first_t = t
+                due = started + (t - first_t) / speed
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    max_lag = max(max_lag, -delay)
+            executor.submit(seq, entry)
+            count += 1
+    finally:
+        executor.shutdown()
+        writer.close()
+    elapsed = time.perf_counter() - started
+
+    endpoints = {}
+    for path, values in sorted(latencies.items()):
+        ms = np.frombuffer(values, dtype=np.float64) * 1000
+        endpoints[path] = {
+            'requests': len(values),
+            'errors': errors.get(path, 0),
+            'p50_ms': round(float(np.percentile(ms, 50)), 3),
+            'p95_ms': round(float(np.percentile(ms, 95)), 3),
+            'p99_ms': round(float(np.percentile(ms, 99)), 3),
+        }
+    return {
+        'requests': count,
+        'wall_s': round(elapsed, 3),
+        'throughput_rps': round(count / elapsed, 1) if elapsed else 0.0,
+        'max_schedule_lag_s': round(max_lag, 3),
+        'endpoints': endpoints,
+        'compared': writer.compared,
+        'mismatches': writer.mismatches,
+        'diffs': writer.diffs,
+    }
+
+
+def print_report(summary):
+    print(f"{summary['requests']} requests in {summary['wall_s']}s, {summary['throughput_rps']} req/s, "
+          f"max schedule lag {summary['max_schedule_lag_s']}s")
+    print(f"{'endpoint':<20} {'requests':>8} {'errors':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for path, row in summary['endpoints'].items():
+        print(f"{path:<20} {row['requests']:>8} {row['errors']:>6} {row['p50_ms']:>9.2f} "
+              f"{row['p95_ms']:>9.2f} {row['p99_ms']:>9.2f}")
+    if summary['compared']:
+        print(f"\n{summary['mismatches']} of {summary['compared']} responses differ from the baseline")
+        for diff in summary['diffs']:
+            print(diff)
+            print()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay a JSONL capture of webhook requests.')
+    parser.add_argument('capture', help="JSONL capture (.gz allowed, '-' for stdin)")
+    parser.add_argument('--target', help='Base URL of a running server; default replays in-process offline')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--speed', type=float, default=0.0,
+                        help='Replay the capture timestamps N times faster (0 = no pacing)')
+    parser.add_argument('--max-pending', type=int, default=1000, help='Requests read ahead of the workers')
+    parser.add_argument('--output', help='Write the responses, in capture order, to this JSONL file')
+    parser.add_argument('--baseline', help='Compare responses with a previous --output file')
+    parser.add_argument('--geocode-ms', type=float, default=0.0, help='Fake Geocoding API delay (in-process)')
+    parser.add_argument('--distance-ms', type=float, default=0.0, help='Fake Distance Matrix delay (in-process)')
+    parser.add_argument('--twilio-ms', type=float, default=0.0, help='Fake Twilio Messages delay (in-process)')
+    parser.add_argument('--json', action='store_true', help='Print the summary as JSON')
+    args = parser.parse_args(argv)
+    # The in-process app runs in its own temporary directory
+    capture, output, baseline = (os.path.abspath(path) if path and path != '-' else path
+                                 for path in (args.capture, args.output, args.baseline))
+
+    options = dict(concurrency=args.concurrency, speed=args.speed, max_pending=args.max_pending,
+                   output=output, baseline=baseline)
+    if args.target:
+        summary = replay(read_jsonl(capture), http_sender(args.target), **options)
+    else:
+        from bench_webhooks import offline_app
+        with offline_app(args.geocode_ms, args.distance_ms, args.twilio_ms) as (app, upstreams):
+            summary = replay(read_jsonl(capture), in_process_sender(app), **options)
+
+    if args.json:
+        print(json.dumps(summary))
+    else:
+        print_report(summary)
+    return 1 if summary['mismatches'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,55 @@
+# request_cache.py
+
+"""
+Request-Scoped Lookup Memoization
+
+The SMS, WhatsApp and IVR handlers call get_profile / get_user_state from
+several helper functions while handling a single webhook. This module
+memoizes those lookups on Flask's g object, so each value is fetched at most
+once per request. Writes replace or drop the memoized value, so a handler
+never sees stale data after it updates a profile or state.
+
+Outside a request context (background jobs, scripts) every call goes
+straight to the loader.
+"""
+
+from flask import g, has_request_context
+
+_CACHE_ATTR = '_request_lookups'
+
+
+def _cache():
+    cache = getattr(g, _CACHE_ATTR, None)
+    if cache is None:
+        cache = {}
+        setattr(g, _CACHE_ATTR, cache)
+    return cache
+
+
+def load(kind, key, loader):
+    """
+    Return loader(key), memoized for the current request.
+
+    Args:
+        kind (str): Namespace, e.g. 'profile' or 'state'
+        key: Lookup key, e.g. the phone number
+        loader (callable): Fetches the value on a miss
+    """
+    if not has_request_context():
+        return loader(key)
+    cache = _cache()
+    if (kind, key) not in cache:
+        cache[(kind, key)] = loader(key)
+    return cache[(kind, key)]
+
+
+def remember(kind, key, value):
+    """Record a value just written, so later reads in this request skip the fetch."""
+    if has_request_context():
+        _cache()[(kind, key)] = value
+
+
+def invalidate(kind, key):
+    """Drop a memoized value after a write whose result is not known locally."""
+    if has_request_context():
+        _cache().pop((kind, key), None)
@@ -0,0 +1,73 @@
+# services.py
+
+"""
+Shared Service Clients
+
+The driver registration and passenger SMS / WhatsApp / IVR blueprints run in
+one Flask app (see app_factory.py) and share one instance per process of:
+
+- the Twilio client (or StubClient, see sms_queue.create_client)
+- the outbound message queue
+- the geocode cache
+
+Nothing is built at import time: each getter constructs its object on first
+use, so importing the app (tests, gunicorn preload) needs no credentials and
+opens no connections. Google Maps calls already share one pooled session
+through http_client.py, and SQLite connections come from db_pool.py.
+"""
+
+import os
+import threading
+
+from dotenv import load_dotenv
+
+from geocode_cache import GeocodeCache
+from sms_queue import OutboundQueue, create_client
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Configuration constants
+TWILIO_PHONE_NUMBER = os.getenv('TWILIO_PHONE_NUMBER')
+
+_instances = {}
+_lock = threading.RLock()  # Factories may build other shared instances
+
+
+def _shared(name, factory):
+    """Return the process-wide instance called name, building it with factory on first use."""
+    instance = _instances.get(name)
+    if instance is None:
+        with _lock:
+            instance = _instances.get(name)
+            if instance is None:
+                instance = _instances[name] = factory()
+    return instance
+
+
+def twilio_client():
+    """Twilio client shared by every blueprint (TWILIO_ACCOUNT_SID, or the older TWILIO_SID)."""
+    return _shared('twilio_client', lambda: create_client(
+        os.getenv('TWILIO_ACCOUNT_SID') or os.getenv('TWILIO_SID'),
+        os.getenv('TWILIO_AUTH_TOKEN')))
+
+
+def outbound_queue():
+    """
+    Outbound SMS / WhatsApp queue, sending through twilio_client().
+
+    Its workers start when it is built, so call this at process startup (after
+    any fork) to send messages queued before a restart.
+    """
+    return _shared('outbound_queue', _start_outbound_queue)
+
+
+def _start_outbound_queue():
+    queue = OutboundQueue(twilio_client())
+    queue.start()
+    return queue
+
+
+def geocode_cache():
+    """Geocoding response cache shared by address resolution and dispatch."""
+    return _shared('geocode_cache', GeocodeCache)
@@ -0,0 +1,227 @@
+# simulate_dispatch.py
+
+"""
+Dispatch Simulation Harness
+
+Drives dispatcher.Dispatcher with synthetic drivers and ride requests in
+simulated time (no sleeping, no network, no SMS), using throwaway databases,
+and reports assignment rate, pickup distance, passenger wait and batch solve
+time.
+
+A scenario is a list of events, so runs are replayable:
+- the same --seed always generates the same scenario
+- --record saves the generated scenario as JSON lines, --replay runs a saved one
+
+Events:
+    {"t": 0.0, "type": "driver", "id": 1, "lat": .., "lng": .., "gender": "Female",
+     "preference": "male & female", "seats": 4, "wheelchair": false}
+    {"t": 3.2, "type": "ride", "phone": "+1555...", "gender": "Male", "lat": .., "lng": ..}
+
+Drivers become available again TRIP_SECONDS after being assigned, at the
+pickup location.
+
+Usage:
+    python simulate_dispatch.py --drivers 2000 --rides-per-second 20 --duration 120
+    python simulate_dispatch.py --solver greedy --replay scenario.jsonl
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+from db_pool import close_connections, get_connection
+from dispatcher import Dispatcher
+from migrations import DRIVERS_MIGRATIONS, PROFILES_MIGRATIONS, migrate
+
+CENTER = (40.75, -73.99)
+AREA_DEGREES = 0.3
+TRIP_SECONDS = 600
+EPOCH = 1_700_000_000.0  # Simulated clock start
+
+
+class RecordingQueue:
+    """Outbound queue stand-in that only counts messages."""
+
+    def __init__(self):
+        self.messages = 0
+
+    def enqueue_many(self, messages):
+        self.messages += len(messages)
+        return len(messages)
+
+
+def generate_scenario(drivers, rides_per_second, duration, seed=42):
+    """Build a reproducible list of driver and ride events, ordered by time."""
+    rng = random.Random(seed)
+
+    def point():
+        return (CENTER[0] + rng.uniform(-AREA_DEGREES, AREA_DEGREES),
+                CENTER[1] + rng.uniform(-AREA_DEGREES, AREA_DEGREES))
+
+    events = []
+    for driver_id in range(1, drivers + 1):
+        lat, lng = point()
+        events.append({'t': 0.0, 'type': 'driver', 'id': driver_id, 'lat': lat, 'lng': lng,
+                       'gender': rng.choice(['Male', 'Female']),
+                       'preference': rng.choice(['male & female', 'male & female', 'male only', 'female only']),
+                       'seats': rng.randint(1, 6), 'wheelchair': rng.random() < 0.1})
+
+    t = 0.0
+    ride = 0
+    while True:
+        t += rng.expovariate(rides_per_second)
+        if t >= duration:
+            break
+        lat, lng = point()
+        ride += 1
+        events.append({'t': round(t, 3), 'type': 'ride', 'phone': f"+1555{ride:07d}",
+                       'gender': rng.choice(['Male', 'Female']), 'lat': lat, 'lng': lng})
+    return events
+
+
+def load_scenario(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def save_scenario(events, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        for event in events:
+            f.write(json.dumps(event) + '\n')
+
+
+def _add_driver(conn, event):
+    c = conn.execute('''INSERT INTO drivers (id, name, phone, email, license_number, license_plate,
+                                             gender, Model, car_color, available_seats, is_new_car,
+                                             is_luxury, has_wheelchair, car_seat_count, has_booster,
+                                             notify_rides, notify_deliveries, PassengerPreference)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, 'Sedan', 'white', ?, 0, 0, ?, 0, 0, 1, 0, ?)''',
+                     (event['id'], f"Driver {event['id']}", f"+1444{event['id']:07d}", 'sim@example.com',
+                      f"SIM-L{event['id']}", f"SIM-P{event['id']}", event['gender'], event['seats'],
+                      event['wheelchair'], event['preference']))
+    conn.execute('INSERT INTO driver_locations (driver_id, lat, lng, is_available, updated_at) VALUES (?, ?, ?, 1, ?)',
+                 (c.lastrowid, event['lat'], event['lng'], datetime.fromtimestamp(EPOCH + event['t'])))
+
+
+def run_scenario(events, solver='optimal', interval=1.0):
+    """
+    Replay a scenario against a fresh pair of databases.
+
+    Returns:
+        dict: Summary statistics
+    """
+    workdir = tempfile.mkdtemp(prefix='dispatch-sim-')
+    profiles_db = os.path.join(workdir, 'profiles.db')
+    drivers_db = os.path.join(workdir, 'drivers.db')
+    try:
+        migrate(profiles_db, PROFILES_MIGRATIONS)
+        migrate(drivers_db, DRIVERS_MIGRATIONS)
+        profiles = get_connection(profiles_db)
+        drivers = get_connection(drivers_db)
+
+        queue = RecordingQueue()
+        dispatcher = Dispatcher(profiles_db, drivers_db, outbound_queue=queue, solver=solver,
+                                geocoder=lambda address: None, from_number='+10000000000')
+
+        pending = sorted(events, key=lambda event: event['t'])
+        end = pending[-1]['t'] if pending else 0.0
+        busy_until = []   # (release time, driver id, lat, lng)
+        solve_ms = []
+        now = 0.0
+        i = 0
+        while i < len(pending) or now <= end + interval:
+            now += interval
+            # Events up to the current tick
+            drivers_changed = False
+            while i < len(pending) and pending[i]['t'] <= now:
+                event = pending[i]
+                if event['type'] == 'driver':
+                    _add_driver(drivers, event)
+                    drivers_changed = True
+                else:
+                    profiles.execute('INSERT OR IGNORE INTO profiles (phone_number, profile_name, gender, zip_code, created_at) '
+                                     'VALUES (?, ?, ?, ?, ?)', (event['phone'], '0000', event['gender'], '10001',
+                                                                datetime.fromtimestamp(EPOCH)))
+                    profiles.execute('''INSERT INTO rides (phone_number, pickup, destination, travel_time, created_at,
+                                                           pickup_lat, pickup_lng)
+                                        VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                                     (event['phone'], f"{event['lat']:.5f},{event['lng']:.5f}", 'Downtown', '10 mins',
+                                      datetime.fromtimestamp(EPOCH + event['t']), event['lat'], event['lng']))
+                i += 1
+            # Drivers finishing their trips
+            released = [entry for entry in busy_until if entry[0] <= now]
+            if released:
+                busy_until = [entry for entry in busy_until if entry[0] > now]
+                drivers.executemany('UPDATE driver_locations SET lat = ?, lng = ?, is_available = 1 WHERE driver_id = ?',
+                                    [(lat, lng, driver_id) for _, driver_id, lat, lng in released])
+            profiles.commit()
+            drivers.commit()
+
+            dispatcher.refresh_drivers(EPOCH + now, force=drivers_changed or bool(released))
+            result = dispatcher.run_batch(EPOCH + now)
+            if result['pending']:
+                solve_ms.append(result['solve_ms'])
+            for ride_id, driver_id, lat, lng in profiles.execute(
+                    '''SELECT id, driver_id, pickup_lat, pickup_lng FROM rides
+                       WHERE status = 'assigned' AND assigned_at = ?''', (datetime.fromtimestamp(EPOCH + now),)):
+                busy_until.append((now + TRIP_SECONDS, driver_id, lat, lng))
+
+        rows = profiles.execute('SELECT status, created_at, assigned_at, pickup_lat, pickup_lng, driver_id FROM rides').fetchall()
+        assigned = [row for row in rows if row[0] == 'assigned']
+        waits = np.array([datetime.fromisoformat(row[2]).timestamp() - datetime.fromisoformat(row[1]).timestamp()
+                          for row in assigned]) if assigned else np.zeros(1)
+        return {
+            'solver': solver,
+            'rides': len(rows),
+            'assigned': len(assigned),
+            'unassigned': sum(row[0] == 'unassigned' for row in rows),
+            'still_pending': sum(row[0] == 'pending' for row in rows),
+            'mean_pickup_km': round(dispatcher.stats['pickup_km'] / len(assigned), 3) if assigned else 0.0,
+            'mean_wait_s': round(float(waits.mean()), 2),
+            'p95_wait_s': round(float(np.percentile(waits, 95)), 2),
+            'mean_solve_ms': round(float(np.mean(solve_ms)), 3) if solve_ms else 0.0,
+            'max_solve_ms': round(float(np.max(solve_ms)), 3) if solve_ms else 0.0,
+            'messages': queue.messages,
+        }
+    finally:
+        close_connections()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Simulate batched ride dispatch.')
+    parser.add_argument('--drivers', type=int, default=1000)
+    parser.add_argument('--rides-per-second', type=float, default=5.0)
+    parser.add_argument('--duration', type=float, default=60.0, help='Simulated seconds of ride requests')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--interval', type=float, default=1.0, help='Simulated seconds between batches')
+    parser.add_argument('--solver', choices=['optimal', 'greedy', 'both'], default='both')
+    parser.add_argument('--record', help='Write the generated scenario to this JSONL file')
+    parser.add_argument('--replay', help='Run a scenario saved with --record instead of generating one')
+    args = parser.parse_args(argv)
+
+    if args.replay:
+        events = load_scenario(args.replay)
+    else:
+        events = generate_scenario(args.drivers, args.rides_per_second, args.duration, args.seed)
+    if args.record:
+        save_scenario(events, args.record)
+        print(f"Scenario saved to {args.record}")
+
+    solvers = ['optimal', 'greedy'] if args.solver == 'both' else [args.solver]
+    for solver in solvers:
+        started = time.perf_counter()
+        summary = run_scenario(events, solver, args.interval)
+        summary['wall_s'] = round(time.perf_counter() - started, 2)
+        print(json.dumps(summary))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,355 @@
+# sms_queue.py
+
+"""
+Durable Outbound Message Queue
+
+Request handlers enqueue SMS/WhatsApp messages instead of calling
+client.messages.create inline. The queue lives in SQLite (outbound.db by
+default), so messages survive restarts, and a pool of worker threads
+drains it in the background:
+
+- per-sender rate limiting (Twilio long codes accept ~1 message/second).
+  The next free send slot of each number is kept in outbound.db and reserved
+  when a message is claimed, so the web workers, dispatcher.py and
+  driver_import.py together send at most RATE_PER_SECOND per number
+- retries with exponential backoff, up to MAX_ATTEMPTS
+- optional dedup keys, so retried requests cannot send the same message twice
+
+Workers start when the queue is built through services.outbound_queue(),
+which the web server (gunicorn post_fork, the debug servers) and the
+dispatcher do at startup, so messages left over from a restart are sent
+without waiting for a new one to be queued.
+
+Set SMS_BACKEND=stub to use StubClient, which records messages locally
+instead of calling Twilio (for development and tests).
+"""
+
+import os
+import random
+import threading
+import time
+
+import metrics
+from db_pool import get_connection
+
+# Configuration constants
+QUEUE_DATABASE = os.getenv('OUTBOUND_QUEUE_DB', 'outbound.db')
+QUEUE_WORKERS = int(os.getenv('OUTBOUND_WORKERS', '4'))
+RATE_PER_SECOND = float(os.getenv('OUTBOUND_RATE_PER_SECOND', '1'))  # per sender number
+MAX_ATTEMPTS = int(os.getenv('OUTBOUND_MAX_ATTEMPTS', '5'))
+BACKOFF_BASE = float(os.getenv('OUTBOUND_BACKOFF_BASE', '2'))         # 2s, 4s, 8s ...
+SENDING_TIMEOUT = 300  # Seconds before a message stuck in 'sending' is retried
+STARTUP_SENDING_AGE = 60  # On start, 'sending' rows older than this were left by a dead process
+IDLE_POLL_INTERVAL = 1.0
+
+
+class StubMessage:
+    """Minimal stand-in for a Twilio MessageInstance."""
+
+    def __init__(self, sid, body, from_, to):
+        self.sid = sid
+        self.body = body
+        self.from_ = from_
+        self.to = to
+
+
+class StubMessages:
+    """Records created messages instead of sending them."""
+
+    def __init__(self):
+        self.sent = []
+        self._lock = threading.Lock()
+
+    def create(self, body, from_, to, **kwargs):
+        with self._lock:
+            message = StubMessage(f"SMSTUB{len(self.sent):026d}", body, from_, to)
+            self.sent.append(message)
+        print(f"[stub sms] to={to} body={body[:60]!r}")
+        return message
+
+
+class StubClient:
+    """Drop-in replacement for twilio.rest.Client that never touches the network."""
+
+    def __init__(self, *args, **kwargs):
+        self.messages = StubMessages()
+
+
+def create_client(account_sid, auth_token):
+    """
+    Build a Twilio client, or a StubClient when SMS_BACKEND=stub.
+
+    TWILIO_API_URL replaces https://api.twilio.com, e.g. with a local fake
+    (see fake_upstreams.py).
+    """
+    if os.getenv('SMS_BACKEND', 'twilio').lower() == 'stub':
+        return StubClient()
+    from twilio.rest import Client
+    client = Client(account_sid, auth_token)
+    if os.getenv('TWILIO_API_URL'):
+        client.api.base_url = os.getenv('TWILIO_API_URL')
+    return client
+
+
+class OutboundQueue:
+    """
+    SQLite-backed outbound message queue drained by a worker pool.
+
+    Args:
+        client: Twilio Client (or StubClient) used to send messages
+        database (str): SQLite file holding the queue
+        workers (int): Number of sender threads per process
+        rate_per_second (float): Messages per second allowed per sender number,
+            shared with every process using the same database
+    """
+
+    def __init__(self, client, database=QUEUE_DATABASE, workers=QUEUE_WORKERS,
+                 rate_per_second=RATE_PER_SECOND):
+        self.client = client
+        self.database = database
+        self.workers = workers
+        self.send_interval = 1.0 / rate_per_second
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+        self._started_pid = None
+        self._start_lock = threading.Lock()
+        self._table_ready = False
+
+    def _connection(self):
+        conn = get_connection(self.database)
+        if not self._table_ready:
+            conn.execute('''CREATE TABLE IF NOT EXISTS outbound_messages
+                            (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                             dedup_key TEXT UNIQUE,
+                             to_number TEXT NOT NULL,
+                             from_number TEXT,
+                             body TEXT NOT NULL,
+                             status TEXT NOT NULL DEFAULT 'pending',
+                             attempts INTEGER NOT NULL DEFAULT 0,
+                             next_attempt_at REAL NOT NULL,
+                             claimed_at REAL,
+                             last_error TEXT,
+                             sid TEXT,
+                             created_at REAL NOT NULL,
+                             sent_at REAL)''')
+            conn.execute('''CREATE INDEX IF NOT EXISTS idx_outbound_due
+                            ON outbound_messages (status, next_attempt_at)''')
+            # Rate limit per sender number, shared by every process using this database
+            conn.execute('''CREATE TABLE IF NOT EXISTS outbound_senders
+                            (from_number TEXT PRIMARY KEY,
+                             next_send_at REAL NOT NULL)''')
+            conn.commit()
+            self._table_ready = True
+        return conn
+
+    def enqueue(self, to, body, from_, dedup_key=None):
+        """
+        Queue a message for delivery and make sure workers are running.
+
+        Args:
+            to (str): Destination number (prefix with 'whatsapp:' for WhatsApp)
+            body (str): Message text
+            from_ (str): Sender number
+            dedup_key (str): Optional key; a second message with the same key is dropped
+
+        Returns:
+            int or None: Queue id, or None if dedup_key was already queued
+        """
+        conn = self._connection()
+        now = time.time()
+        c = conn.execute('''INSERT OR IGNORE INTO outbound_messages
+                            (dedup_key, to_number, from_number, body, next_attempt_at, created_at)
+                            VALUES (?, ?, ?, ?, ?, ?)''',
+                         (dedup_key, to, from_, body, now, now))
+        conn.commit()
+        if c.rowcount == 0:
+            return None
+
+        self.start()
+        self._wakeup.set()
+        return c.lastrowid
+
+    def enqueue_many(self, messages):
+        """
+        Queue many (to, body, from_, dedup_key) tuples in one transaction.
+
+        Returns:
+            int: Number of messages actually queued (duplicates are skipped)
+        """
+        conn = self._connection()
+        now = time.time()
+        before = conn.total_changes
+        conn.executemany('''INSERT OR IGNORE INTO outbound_messages
+                            (dedup_key, to_number, from_number, body, next_attempt_at, created_at)
+                            VALUES (?, ?, ?, ?, ?, ?)''',
+                         [(dedup_key, to, from_, body, now, now)
+                          for to, body, from_, dedup_key in messages])
+        conn.commit()
+        queued = conn.total_changes - before
+        if queued:
+            self.start()
+            self._wakeup.set()
+        return queued
+
+    def _claim(self):
+        """
+        Atomically move the next due message whose sender has a free send slot
+        to 'sending', reserve the sender's next slot and return the message.
+        """
+        conn = self._connection()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Recover messages left in 'sending' by a crashed worker
+            conn.execute('''UPDATE outbound_messages SET status = 'pending'
+                            WHERE status = 'sending' AND claimed_at < ?''',
+                         (now - SENDING_TIMEOUT,))
+            row = conn.execute('''SELECT m.id, m.to_number, m.from_number, m.body, m.attempts
+                                  FROM outbound_messages m
+                                  LEFT JOIN outbound_senders s
+                                    ON s.from_number = COALESCE(m.from_number, '')
+                                  WHERE m.status = 'pending' AND m.next_attempt_at <= ?
+                                    AND (s.next_send_at IS NULL OR s.next_send_at <= ?)
+                                  ORDER BY m.next_attempt_at LIMIT 1''', (now, now)).fetchone()
+            if row:
+                conn.execute('''UPDATE outbound_messages SET status = 'sending', claimed_at = ?
+                                WHERE id = ?''', (now, row[0]))
+                conn.execute('''INSERT OR REPLACE INTO outbound_senders (from_number, next_send_at)
+                                VALUES (?, ?)''', (row[2] or '', now + self.send_interval))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return row
+
+    def _seconds_until_due(self):
+        """Time until the next pending message is due and its sender free, at most IDLE_POLL_INTERVAL."""
+        (due_at,) = self._connection().execute(
+            '''SELECT MIN(MAX(m.next_attempt_at, COALESCE(s.next_send_at, 0)))
+               FROM outbound_messages m
+               LEFT JOIN outbound_senders s ON s.from_number = COALESCE(m.from_number, '')
+               WHERE m.status = 'pending' ''').fetchone()
+        if due_at is None:
+            return IDLE_POLL_INTERVAL
+        return min(IDLE_POLL_INTERVAL, max(0.0, due_at - time.time()))
+
+    def _send(self, row):
+        message_id, to, from_, body, attempts = row
+        conn = self._connection()
+        try:
+            with metrics.span('twilio.messages_create'):
+                message = self.client.messages.create(body=body, from_=from_, to=to)
+        except Exception as e:
+            attempts += 1
+            if attempts >= MAX_ATTEMPTS:
+                print(f"Outbound message {message_id} failed permanently: {str(e)}")
+                conn.execute('''UPDATE outbound_messages
+                                SET status = 'failed', attempts = ?, last_error = ?
+                                WHERE id = ?''', (attempts, str(e), message_id))
+            else:
+                delay = BACKOFF_BASE ** attempts * random.uniform(0.8, 1.2)
+                conn.execute('''UPDATE outbound_messages
+                                SET status = 'pending', attempts = ?, last_error = ?,
+                                    next_attempt_at = ?
+                                WHERE id = ?''', (attempts, str(e), time.time() + delay, message_id))
+        else:
+            conn.execute('''UPDATE outbound_messages
+                            SET status = 'sent', attempts = ?, sid = ?, sent_at = ?
+                            WHERE id = ?''',
+                         (attempts + 1, getattr(message, 'sid', None), time.time(), message_id))
+        conn.commit()
+
+    def drain_once(self):
+        """
+        Send the next due message, if any, on the calling thread.
+
+        Returns:
+            bool: True if a message was processed
+        """
+        row = self._claim()
+        if row is None:
+            return False
+        self._send(row)
+        return True
+
+    def _worker(self):
+        while not self._stopping.is_set():
+            wait = IDLE_POLL_INTERVAL
+            try:
+                if self.drain_once():
+                    continue
+                wait = self._seconds_until_due()
+            except Exception as e:
+                print(f"Outbound queue worker error: {str(e)}")
+            self._wakeup.wait(wait)
+            self._wakeup.clear()
+
+    def _recover_sending(self):
+        """Requeue messages a previous process claimed but never finished sending."""
+        conn = self._connection()
+        c = conn.execute('''UPDATE outbound_messages SET status = 'pending'
+                            WHERE status = 'sending' AND claimed_at < ?''',
+                         (time.time() - STARTUP_SENDING_AGE,))
+        conn.commit()
+        if c.rowcount:
+            print(f"Outbound queue: requeued {c.rowcount} messages left in 'sending'")
+
+    def start(self):
+        """
+        Start the worker threads in this process (no-op if already running).
+
+        Messages still queued from before a restart are picked up right away;
+        ones left in 'sending' by a dead process are requeued first.
+        """
+        if self._started_pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._started_pid == os.getpid():
+                return
+            try:
+                self._recover_sending()
+            except Exception as e:
+                print(f"Outbound queue recovery error: {str(e)}")
+            self._stopping.clear()
+            self._threads = [
+                threading.Thread(target=self._worker, name=f'outbound-{i}', daemon=True)
+                for i in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+            self._started_pid = os.getpid()
+
+    def stop(self, timeout=5):
+        """Signal workers to exit and wait for them."""
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        self._started_pid = None
+
+    def outstanding(self, dedup_keys):
+        """
+        Number of the messages with the given dedup keys still being sent or
+        due now; failed attempts waiting out their backoff are not counted.
+        """
+        conn = self._connection()
+        keys = list(dedup_keys)
+        now = time.time()
+        total = 0
+        for i in range(0, len(keys), 500):
+            batch = keys[i:i + 500]
+            (count,) = conn.execute(f'''SELECT COUNT(*) FROM outbound_messages
+                                        WHERE dedup_key IN ({', '.join('?' * len(batch))})
+                                          AND (status = 'sending'
+                                               OR (status = 'pending' AND next_attempt_at <= ?))''',
+                                    (*batch, now)).fetchone()
+            total += count
+        return total
+
+    def counts(self):
+        """Number of queued messages per status."""
+        rows = self._connection().execute(
+            'SELECT status, COUNT(*) FROM outbound_messages GROUP BY status').fetchall()
+        return dict(rows)
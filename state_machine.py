@@ -0,0 +1,167 @@
+# state_machine.py
+
+"""
+Conversation State Machine Engine
+
+Each conversation flow (SMS, WhatsApp, IVR) is a StateMachine: a dict from
+state name to handler, so dispatching a message is one dict lookup instead
+of a walk down an if/elif chain. Handlers receive a Turn describing the
+incoming message and return the webhook response.
+
+Simple "validate the input, then either advance or re-prompt" states are
+declared with step(), which pairs a validator with an on_valid and an
+on_invalid handler. Everything channel specific (texts, TwiML verbs) lives
+in the handlers/renderers registered by the caller, so a new channel only
+needs its own table of handlers.
+
+Every dispatch is timed per (flow, state); state_metrics() reports call
+counts and latency so slow states are easy to find.
+"""
+
+import threading
+import time
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+class Turn:
+    """
+    One incoming message (or IVR input) for a conversation.
+
+    Attributes:
+        phone_number (str): Caller / sender
+        text (str): Message body, keypad digits or speech, depending on the state
+        user_state (tuple): Current user_state row, or None
+        profile (tuple): Profile row, or None
+        channel (str): 'SMS', 'WHATSAPP' or 'IVR'
+        digits (str): IVR keypad input
+        speech (str): IVR speech recognition result
+    """
+
+    __slots__ = ('phone_number', 'text', 'user_state', 'profile', 'channel', 'digits', 'speech')
+
+    def __init__(self, phone_number, text, user_state=None, profile=None, channel=None,
+                 digits='', speech=''):
+        self.phone_number = phone_number
+        self.text = text
+        self.user_state = user_state
+        self.profile = profile
+        self.channel = channel
+        self.digits = digits
+        self.speech = speech
+
+    @property
+    def state(self):
+        """Current step name, or None when the user has no state row."""
+        return self.user_state[1] if self.user_state else None
+
+
+class StateMachine:
+    """
+    Table of state handlers for one conversation flow.
+
+    Args:
+        name (str): Flow name used in metrics, e.g. 'sms'
+        fallback (callable): Handler for states without an entry
+    """
+
+    def __init__(self, name, fallback=None):
+        self.name = name
+        self.fallback = fallback
+        self._handlers = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def on(self, *states):
+        """Decorator registering a handler for one or more states."""
+        def register(handler):
+            for state in states:
+                self._handlers[state] = handler
+            return handler
+        return register
+
+    def step(self, state, validator, on_valid, on_invalid):
+        """
+        Declare a validated input step.
+
+        Args:
+            state (str): State the step handles
+            validator (callable): validator(text) -> bool
+            on_valid (callable): Handler when the input is valid (usually advances state)
+            on_invalid (callable): Handler when it is not (usually re-prompts)
+        """
+        def handler(turn):
+            return on_valid(turn) if validator(turn.text) else on_invalid(turn)
+        self._handlers[state] = handler
+
+    def handles(self, state):
+        return state in self._handlers
+
+    def dispatch(self, turn, state=None):
+        """
+        Run the handler for a state (defaults to turn.state) and record its latency.
+
+        Returns:
+            The handler's response, or None if no handler and no fallback exist
+        """
+        state = turn.state if state is None else state
+        handler = self._handlers.get(state, self.fallback)
+        if handler is None:
+            return None
+
+        start = time.perf_counter()
+        try:
+            return handler(turn)
+        finally:
+            self._record(state if state in self._handlers else '<fallback>',
+                         time.perf_counter() - start)
+
+    def _record(self, state, elapsed):
+        with self._lock:
+            stats = self._stats.get(state)
+            if stats is None:
+                stats = self._stats[state] = [0, 0.0, 0.0]
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] = max(stats[2], elapsed)
+
+    def metrics(self):
+        """
+        Per-state dispatch statistics.
+
+        Returns:
+            dict: {state: {'count', 'total_ms', 'mean_ms', 'max_ms'}}
+        """
+        with self._lock:
+            return {
+                state: {
+                    'count': count,
+                    'total_ms': total * 1000,
+                    'mean_ms': total * 1000 / count,
+                    'max_ms': worst * 1000,
+                }
+                for state, (count, total, worst) in self._stats.items()
+            }
+
+
+def state_metrics():
+    """Metrics of every StateMachine created in this process, keyed by flow name."""
+    with _registry_lock:
+        machines = list(_registry)
+    return {machine.name: machine.metrics() for machine in machines}
+
+
+# Common input validators
+def is_profile_name(text):
+    return len(text) == 4 and text.isdigit()
+
+
+def is_gender_choice(text):
+    return text in ['1', '2']
+
+
+def is_zip_code(text):
+    return len(text) == 5 and text.isdigit()
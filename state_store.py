@@ -0,0 +1,301 @@
+# state_store.py
+
+"""
+Conversation State Store
+
+Holds the per-phone-number user_state row (current step plus temporary
+answers), optionally behind a small in-process TTL cache (STATE_CACHE_TTL),
+so repeated reads within and across conversational turns do not hit the
+database.
+
+Writes go to the backing store either
+- write-through (default): synchronously, before the call returns, or
+- write-behind: queued and flushed by a background thread every
+  STATE_FLUSH_INTERVAL seconds (and at exit)
+
+Backends:
+- SQLiteStateBackend: the user_state table in profiles.db
+- RedisStateBackend: any Redis-compatible server (pip install redis);
+  FakeRedis provides the same interface in memory for tests
+
+Rows are records.UserState tuples. update() changes only the given fields:
+the SQLite backend issues an UPDATE of just those columns instead of
+rewriting the whole row.
+
+Note: the local cache is per process and nothing invalidates it when another
+process changes a row, so a user's next message could be answered from a
+stale step. It is off by default; only set STATE_CACHE_TTL when a single
+process serves every conversation (one gunicorn worker, any number of
+threads). Several processes must share state through the backend with the
+cache off, e.g. Redis with STATE_CACHE_TTL=0.
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+
+from db_pool import get_connection
+from records import UserState, fetch_one
+
+# Configuration constants
+STATE_BACKEND = os.getenv('STATE_BACKEND', 'sqlite')        # 'sqlite' or 'redis'
+STATE_CACHE_TTL = float(os.getenv('STATE_CACHE_TTL', '0'))   # Seconds, 0 disables the cache (single process only)
+STATE_WRITE_BEHIND = os.getenv('STATE_WRITE_BEHIND', 'false').lower() in ('1', 'true', 'yes')
+STATE_FLUSH_INTERVAL = float(os.getenv('STATE_FLUSH_INTERVAL', '0.5'))
+STATE_REDIS_TTL = int(os.getenv('STATE_REDIS_TTL', str(24 * 3600)))  # Abandoned conversations expire
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+
+USER_STATE_COLUMNS = UserState._fields
+
+_DELETED = object()  # Write-behind marker for a pending delete
+
+
+class SQLiteStateBackend:
+    """user_state rows stored in SQLite."""
+
+    def __init__(self, database):
+        self.database = database
+
+    def get(self, phone_number):
+        return fetch_one(get_connection(self.database), UserState,
+                         'SELECT * FROM user_state WHERE phone_number = ?', (phone_number,))
+
+    def set_many(self, rows):
+        conn = get_connection(self.database)
+        conn.executemany(f'''INSERT OR REPLACE INTO user_state ({', '.join(USER_STATE_COLUMNS)})
+                             VALUES ({', '.join('?' * len(USER_STATE_COLUMNS))})''', rows)
+        conn.commit()
+
+    def update(self, row, changes):
+        """Write only the changed columns; returns False if the row does not exist."""
+        assignments = ', '.join(f'{column} = ?' for column in changes)
+        conn = get_connection(self.database)
+        cursor = conn.execute(f'UPDATE user_state SET {assignments} WHERE phone_number = ?',
+                              (*changes.values(), row.phone_number))
+        conn.commit()
+        return cursor.rowcount > 0
+
+    def delete_many(self, phone_numbers):
+        conn = get_connection(self.database)
+        conn.executemany('DELETE FROM user_state WHERE phone_number = ?',
+                         [(phone_number,) for phone_number in phone_numbers])
+        conn.commit()
+
+
+class RedisStateBackend:
+    """
+    user_state rows stored as JSON strings in a Redis-compatible server.
+
+    Args:
+        client: redis.Redis instance (or FakeRedis)
+        prefix (str): Key prefix
+        ttl (int): Seconds before an untouched conversation expires
+    """
+
+    def __init__(self, client, prefix='user_state:', ttl=STATE_REDIS_TTL):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def get(self, phone_number):
+        value = self.client.get(self.prefix + phone_number)
+        # Rows stored before a column was added are shorter; the new fields take their defaults
+        return UserState(*json.loads(value)) if value else None
+
+    def set_many(self, rows):
+        for row in rows:
+            self.client.set(self.prefix + row[0], json.dumps(list(row)), ex=self.ttl)
+
+    def update(self, row, changes):
+        # Rows are stored as one value, so rewrite it
+        self.set_many([row])
+        return True
+
+    def delete_many(self, phone_numbers):
+        if phone_numbers:
+            self.client.delete(*[self.prefix + phone_number for phone_number in phone_numbers])
+
+
+class FakeRedis:
+    """In-memory subset of the redis.Redis API (get/set/delete with expiry)."""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key, value, ex=None):
+        with self._lock:
+            self._data[key] = (value, time.time() + ex if ex else None)
+        return True
+
+    def delete(self, *keys):
+        with self._lock:
+            return sum(self._data.pop(key, None) is not None for key in keys)
+
+
+class StateStore:
+    """
+    TTL-cached, write-through or write-behind access to user_state rows.
+
+    Args:
+        backend: SQLiteStateBackend or RedisStateBackend
+        cache_ttl (float): Seconds a cached row is trusted; 0 disables caching
+        write_behind (bool): Flush writes asynchronously instead of immediately
+        flush_interval (float): Seconds between write-behind flushes
+    """
+
+    def __init__(self, backend, cache_ttl=STATE_CACHE_TTL, write_behind=STATE_WRITE_BEHIND,
+                 flush_interval=STATE_FLUSH_INTERVAL):
+        self.backend = backend
+        self.cache_ttl = cache_ttl
+        self.write_behind = write_behind
+        self.flush_interval = flush_interval
+        self._cache = {}
+        self._dirty = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flusher_pid = None
+        self.stats = {'hits': 0, 'misses': 0, 'writes': 0, 'flushes': 0}
+        if write_behind:
+            atexit.register(self.flush)
+
+    def _cache_put(self, phone_number, row):
+        if self.cache_ttl > 0:
+            self._cache[phone_number] = (time.monotonic() + self.cache_ttl, row)
+
+    def get(self, phone_number):
+        """Return the user_state row for phone_number, or None."""
+        with self._lock:
+            pending = self._dirty.get(phone_number)
+            if pending is not None:
+                self.stats['hits'] += 1
+                return None if pending is _DELETED else pending
+            entry = self._cache.get(phone_number)
+            if entry is not None and entry[0] > time.monotonic():
+                self.stats['hits'] += 1
+                return entry[1]
+            self.stats['misses'] += 1
+
+        row = self.backend.get(phone_number)
+        with self._lock:
+            self._cache_put(phone_number, row)
+        return row
+
+    def set(self, row):
+        """Store a full user_state row (tuple in USER_STATE_COLUMNS order)."""
+        row = UserState._make(row)
+        phone_number = row.phone_number
+        with self._lock:
+            self._cache_put(phone_number, row)
+            self.stats['writes'] += 1
+            if self.write_behind:
+                self._dirty[phone_number] = row
+        if self.write_behind:
+            self._ensure_flusher()
+        else:
+            self.backend.set_many([row])
+
+    def update(self, phone_number, changes):
+        """
+        Change some fields of a user_state row, keeping the others.
+
+        Args:
+            phone_number (str): Conversation to update; the row is created if missing
+            changes (dict): {column: value}
+
+        Returns:
+            UserState: The updated row
+        """
+        current = self.get(phone_number)
+        row = (current or UserState(phone_number))._replace(**changes)
+        with self._lock:
+            self._cache_put(phone_number, row)
+            self.stats['writes'] += 1
+            if self.write_behind:
+                self._dirty[phone_number] = row
+        if self.write_behind:
+            self._ensure_flusher()
+        elif current is None or not self.backend.update(row, changes):
+            self.backend.set_many([row])
+        return row
+
+    def delete(self, phone_number):
+        """Remove the user_state row for phone_number."""
+        with self._lock:
+            self._cache_put(phone_number, None)
+            self.stats['writes'] += 1
+            if self.write_behind:
+                self._dirty[phone_number] = _DELETED
+        if self.write_behind:
+            self._ensure_flusher()
+        else:
+            self.backend.delete_many([phone_number])
+
+    def invalidate(self, phone_number=None):
+        """Forget cached rows (all of them when phone_number is None)."""
+        with self._lock:
+            if phone_number is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(phone_number, None)
+
+    def flush(self):
+        """Write all pending write-behind changes to the backend."""
+        with self._flush_lock:
+            with self._lock:
+                dirty, self._dirty = self._dirty, {}
+            if not dirty:
+                return
+            try:
+                rows = [row for row in dirty.values() if row is not _DELETED]
+                deleted = [phone for phone, row in dirty.items() if row is _DELETED]
+                if rows:
+                    self.backend.set_many(rows)
+                if deleted:
+                    self.backend.delete_many(deleted)
+                self.stats['flushes'] += 1
+            except Exception as e:
+                print(f"State store flush error: {str(e)}")
+                with self._lock:
+                    # Keep newer writes, re-queue the ones that failed
+                    for phone_number, row in dirty.items():
+                        self._dirty.setdefault(phone_number, row)
+
+    def _ensure_flusher(self):
+        if self._flusher_pid == os.getpid():
+            return
+        with self._flush_lock:
+            if self._flusher_pid == os.getpid():
+                return
+            threading.Thread(target=self._flush_loop, name='state-flusher', daemon=True).start()
+            self._flusher_pid = os.getpid()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+
+def create_state_store(database):
+    """Build the StateStore selected by STATE_BACKEND."""
+    if STATE_BACKEND == 'redis':
+        import redis
+        backend = RedisStateBackend(redis.Redis.from_url(REDIS_URL))
+    elif STATE_BACKEND == 'fakeredis':
+        backend = RedisStateBackend(FakeRedis())
+    else:
+        backend = SQLiteStateBackend(database)
+    return StateStore(backend)
@@ -0,0 +1,124 @@
+# test_driver_import.py
+
+"""
+Bulk driver import: per-row errors, duplicate rejection and streamed input.
+
+    python -m pytest test_driver_import.py
+"""
+
+import csv
+import io
+import json
+
+import pytest
+
+from db_pool import get_connection
+from driver_import import import_drivers, read_json_array
+from migrations import DRIVERS_MIGRATIONS, migrate
+from sms_queue import OutboundQueue, StubClient
+
+
+def driver(number, **changes):
+    row = {
+        'name': f'Driver {number}', 'phone': f'+1555000{number:04d}', 'email': f'd{number}@example.com',
+        'licenseNumber': f'LIC{number:05d}', 'licensePlate': f'PLT{number:05d}', 'gender': 'Female',
+        'Model': 'Civic', 'carColor': 'Red', 'availableSeats': '4', 'PassengerPreference': 'male & female',
+    }
+    row.update(changes)
+    return row
+
+
+def as_csv(rows):
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=list(rows[0]))
+    writer.writeheader()
+    writer.writerows(rows)
+    return io.StringIO(out.getvalue())
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = str(tmp_path / 'drivers.db')
+    migrate(path, DRIVERS_MIGRATIONS)
+    return path
+
+
+def registered(database):
+    return [row[0] for row in get_connection(database).execute(
+        'SELECT license_number FROM drivers ORDER BY license_number')]
+
+
+def test_bad_rows_are_reported_and_the_rest_imported(database):
+    rows = [
+        driver(1),
+        driver(2, gender='Other'),
+        driver(3, availableSeats=''),
+        driver(4, availableSeats='many'),
+        driver(5, email='nobody'),
+        driver(6),
+    ]
+    result = import_drivers(csv.DictReader(as_csv(rows)), database, chunk_size=2)
+
+    assert (result['rows'], result['imported'], result['failed']) == (6, 2, 4)
+    assert result['errors'] == [
+        {'row': 2, 'licenseNumber': 'LIC00002', 'error': 'gender must be Male or Female'},
+        {'row': 3, 'licenseNumber': 'LIC00003', 'error': 'availableSeats is required'},
+        {'row': 4, 'licenseNumber': 'LIC00004', 'error': 'availableSeats must be a number'},
+        {'row': 5, 'licenseNumber': 'LIC00005', 'error': 'email is not valid'},
+    ]
+    assert registered(database) == ['LIC00001', 'LIC00006']
+
+
+def test_duplicates_are_rejected(database):
+    import_drivers([driver(1)], database)
+    rows = [
+        driver(1, licensePlate='NEW00001'),                 # License already registered
+        driver(2, licensePlate='PLT00001'),                 # Plate already registered
+        driver(3),
+        driver(4, licenseNumber='LIC00003'),                # Repeats an earlier row of this import
+        driver(5, licensePlate='PLT00003'),                 # Plate of an earlier row of this import
+    ]
+    result = import_drivers(rows, database, chunk_size=2)
+
+    assert result['imported'] == 1
+    assert [(error['row'], error['licenseNumber']) for error in result['errors']] == \
+        [(1, 'LIC00001'), (2, 'LIC00002'), (4, 'LIC00003'), (5, 'LIC00005')]
+    assert registered(database) == ['LIC00001', 'LIC00003']
+
+
+def test_invalid_json_line_fails_only_that_row(database):
+    lines = [json.dumps(driver(1)), '{"name": "cut off', json.dumps(driver(3))]
+    result = import_drivers(lines, database)
+
+    assert (result['imported'], result['failed']) == (2, 1)
+    assert result['errors'][0]['row'] == 2
+    assert result['errors'][0]['error'].startswith('Invalid JSON')
+
+
+def test_broken_json_array_stops_the_import_there(database):
+    body = json.dumps([driver(1), driver(2)])[:-20] + '", oops'
+    result = import_drivers(read_json_array(io.StringIO(body), read_size=16), database)
+
+    assert result['imported'] == 1
+    assert result['errors'][0]['row'] == 2
+    assert result['errors'][0]['error'].startswith('Unreadable input')
+
+
+@pytest.mark.parametrize('read_size', [1, 7, 65536])
+def test_json_array_is_read_element_by_element(read_size):
+    rows = [driver(1), {'nested': [1, {'a': ']'}], 'n': -1.5e3}, 42, None]
+    text = json.dumps(rows, indent=2)
+
+    assert list(read_json_array(io.StringIO(text), read_size)) == rows
+    with pytest.raises(ValueError):
+        list(read_json_array(io.StringIO('{"not": "an array"}'), read_size))
+
+
+def test_confirmation_sms_are_queued_once(database, tmp_path):
+    queue = OutboundQueue(StubClient(), str(tmp_path / 'outbound.db'), workers=0)
+    keys = []
+    result = import_drivers([driver(1), driver(2), driver(2)], database, queue, '+15559999', queued_keys=keys)
+
+    assert result['smsQueued'] == 2
+    assert keys == ['driver-registration:LIC00001', 'driver-registration:LIC00002']
+    assert queue.outstanding(keys) == 2
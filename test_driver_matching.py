@@ -0,0 +1,116 @@
+# test_driver_matching.py
+
+"""
+Grid index matching checked against a brute-force scan of every driver.
+
+    python -m pytest test_driver_matching.py
+"""
+
+import math
+import random
+
+import pytest
+
+from db_pool import get_connection
+from driver_matching import (CAP_ACCEPTS_FEMALE, CAP_ACCEPTS_MALE, CAP_BOOSTER, CAP_WHEELCHAIR, KM_PER_DEGREE,
+                             DriverIndex, capability_mask, load_driver_index, report_location, ride_requirements)
+from migrations import DRIVERS_MIGRATIONS, migrate
+from records import Driver
+
+CENTER = (40.75, -73.99)
+
+
+def approx_km(lat, lng, d_lat, d_lng):
+    """The index ranks candidates by this equirectangular distance."""
+    dy = d_lat - lat
+    dx = (d_lng - lng) * math.cos(math.radians(lat))
+    return math.sqrt(dx * dx + dy * dy) * KM_PER_DEGREE
+
+
+def brute_force(drivers, lat, lng, k, required_mask, seats, max_km):
+    eligible = sorted(
+        (approx_km(lat, lng, d_lat, d_lng), driver_id)
+        for driver_id, (d_lat, d_lng, mask, free_seats) in drivers.items()
+        if mask & required_mask == required_mask and free_seats >= seats
+        and approx_km(lat, lng, d_lat, d_lng) <= max_km
+    )
+    return [driver_id for _, driver_id in eligible[:k]]
+
+
+@pytest.fixture
+def fleet():
+    rng = random.Random(7)
+    index = DriverIndex(cell_degrees=0.01)
+    drivers = {}
+    for driver_id in range(3000):
+        lat = CENTER[0] + rng.gauss(0, 0.08)
+        lng = CENTER[1] + rng.gauss(0, 0.08)
+        mask = rng.getrandbits(8)
+        seats = rng.randint(1, 6)
+        drivers[driver_id] = (lat, lng, mask, seats)
+        index.upsert(driver_id, lat, lng, mask, seats)
+    return index, drivers
+
+
+@pytest.mark.parametrize('required_mask, seats', [
+    (0, 1),
+    (CAP_ACCEPTS_FEMALE, 1),
+    (CAP_ACCEPTS_MALE | CAP_WHEELCHAIR, 2),
+    (CAP_ACCEPTS_FEMALE | CAP_BOOSTER | CAP_WHEELCHAIR, 4),
+])
+def test_nearest_matches_brute_force(fleet, required_mask, seats):
+    index, drivers = fleet
+    rng = random.Random(required_mask)
+    for _ in range(25):
+        lat = CENTER[0] + rng.uniform(-0.2, 0.2)
+        lng = CENTER[1] + rng.uniform(-0.2, 0.2)
+        k = rng.choice([1, 5, 20])
+        max_km = rng.choice([2, 10, 50])
+
+        matches = index.nearest(lat, lng, k=k, required_mask=required_mask, seats=seats, max_km=max_km)
+
+        assert sorted(driver_id for _, driver_id in matches) == \
+            sorted(brute_force(drivers, lat, lng, k, required_mask, seats, max_km))
+        distances = [distance for distance, _ in matches]
+        assert distances == sorted(distances)
+
+
+def test_moved_and_removed_drivers(fleet):
+    index, drivers = fleet
+    lat, lng = 41.5, -72.5   # Away from the fleet
+    index.upsert(1, lat + 0.001, lng, drivers[1][2] | CAP_ACCEPTS_MALE, 4)
+    index.upsert(2, lat + 0.002, lng, CAP_ACCEPTS_MALE, 4)
+    assert [driver_id for _, driver_id in index.nearest(lat, lng, k=5)] == [1, 2]
+
+    index.remove(1)
+    assert [driver_id for _, driver_id in index.nearest(lat, lng, k=5)] == [2]
+    assert 1 not in index
+    assert index.nearest(lat, lng, k=5, required_mask=CAP_ACCEPTS_FEMALE) == []
+
+
+def test_capability_mask_and_requirements():
+    driver = Driver(1, 'Ann', '+1555', 'a@x.com', 'L1', 'P1', 'Female', 'Civic', 'Red', 4,
+                    has_wheelchair=True, has_booster=True, car_seat_count=0, passenger_preference='female only')
+    mask = capability_mask(driver)
+
+    assert mask & ride_requirements('Female', wheelchair=True) == ride_requirements('Female', wheelchair=True)
+    assert mask & ride_requirements('Male') != ride_requirements('Male')
+    assert mask & ride_requirements(booster=True) == ride_requirements(booster=True)
+    assert mask & ride_requirements(car_seats=1) != ride_requirements(car_seats=1)
+
+
+def test_reported_locations_reload(tmp_path):
+    database = str(tmp_path / 'drivers.db')
+    migrate(database, DRIVERS_MIGRATIONS)
+    conn = get_connection(database)
+    conn.execute('''INSERT INTO drivers (id, name, phone, email, license_number, license_plate, gender, Model,
+                                         car_color, available_seats, PassengerPreference)
+                    VALUES (1, 'Ann', '+1555', 'a@x.com', 'L1', 'P1', 'Female', 'Civic', 'Red', 4,
+                            'male & female')''')
+    conn.commit()
+
+    report_location(database, 1, *CENTER)
+    assert [driver_id for _, driver_id in load_driver_index(database).nearest(*CENTER)] == [1]
+
+    report_location(database, 1, *CENTER, is_available=False)
+    assert load_driver_index(database).nearest(*CENTER) == []
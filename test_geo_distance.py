@@ -0,0 +1,34 @@
+# test_geo_distance.py
+
+"""
+Scalar and NumPy distance paths agree.
+
+    python -m pytest test_geo_distance.py
+"""
+
+import math
+
+import numpy as np
+import pytest
+
+from bench_distance import random_locations
+from geo_distance import SCALAR_CUTOFF, calculate_distance, distances_from, locations_to_array
+
+ORIGIN = {'lat': 40.7506, 'lng': -73.9972}
+
+
+@pytest.mark.parametrize('count', [0, 1, SCALAR_CUTOFF - 1, SCALAR_CUTOFF, 500])
+def test_distances_from_matches_calculate_distance(count):
+    points = random_locations(count)
+    expected = [calculate_distance(ORIGIN, point) for point in points]
+
+    for given in (points, locations_to_array(points)):
+        distances = distances_from(ORIGIN, given)
+        assert isinstance(distances, np.ndarray) and distances.shape == (count,)
+        assert np.allclose(distances, expected, atol=1e-6)
+
+
+@pytest.mark.parametrize('count', [3, SCALAR_CUTOFF + 3])
+def test_missing_origin_is_infinitely_far(count):
+    distances = distances_from(None, random_locations(count))
+    assert len(distances) == count and all(math.isinf(d) for d in distances)
@@ -0,0 +1,155 @@
+# test_sms_queue.py
+
+"""
+Outbound queue behaviour against StubClient (no Twilio, no network).
+
+Queues are built with workers=0, so nothing sends in the background and
+each test drives delivery itself with drain_once().
+
+    python -m pytest test_sms_queue.py
+"""
+
+import time
+
+import pytest
+
+import sms_queue
+from sms_queue import OutboundQueue, StubClient
+
+
+class FlakyMessages:
+    """Raises on the first `failures` sends, then records like StubMessages."""
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = 0
+        self.sent = []
+
+    def create(self, body, from_, to, **kwargs):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise RuntimeError('Twilio unavailable')
+        self.sent.append((to, body))
+        return sms_queue.StubMessage(f'SM{self.calls}', body, from_, to)
+
+
+class FlakyClient:
+    def __init__(self, failures):
+        self.messages = FlakyMessages(failures)
+
+
+@pytest.fixture
+def database(tmp_path):
+    return str(tmp_path / 'outbound.db')
+
+
+def make_queue(database, client=None, rate_per_second=1e9):
+    return OutboundQueue(client or StubClient(), database, workers=0, rate_per_second=rate_per_second)
+
+
+def row(queue, message_id):
+    return queue._connection().execute(
+        'SELECT status, attempts, next_attempt_at, last_error FROM outbound_messages WHERE id = ?',
+        (message_id,)).fetchone()
+
+
+def make_due(queue, message_id):
+    queue._connection().execute('UPDATE outbound_messages SET next_attempt_at = 0 WHERE id = ?', (message_id,))
+    queue._connection().commit()
+
+
+def test_sends_queued_message(database):
+    queue = make_queue(database)
+    message_id = queue.enqueue('+15550001', 'hello', '+15559999')
+
+    assert queue.drain_once()
+    assert not queue.drain_once()
+    assert [(m.to, m.body, m.from_) for m in queue.client.messages.sent] == [('+15550001', 'hello', '+15559999')]
+    assert row(queue, message_id)[:2] == ('sent', 1)
+
+
+def test_dedup_key_queues_once(database):
+    queue = make_queue(database)
+    assert queue.enqueue('+15550001', 'hello', '+15559999', dedup_key='ride:1') is not None
+    assert queue.enqueue('+15550001', 'hello again', '+15559999', dedup_key='ride:1') is None
+    assert queue.enqueue_many([('+15550001', 'hi', '+15559999', 'ride:1'),
+                               ('+15550002', 'hi', '+15559999', 'ride:2')]) == 1
+
+    while queue.drain_once():
+        pass
+    assert sorted(m.to for m in queue.client.messages.sent) == ['+15550001', '+15550002']
+
+
+def test_failed_send_is_retried_after_backoff(database):
+    queue = make_queue(database, FlakyClient(failures=1))
+    message_id = queue.enqueue('+15550001', 'hello', '+15559999')
+
+    before = time.time()
+    assert queue.drain_once()
+    status, attempts, next_attempt_at, last_error = row(queue, message_id)
+    assert (status, attempts, last_error) == ('pending', 1, 'Twilio unavailable')
+    # First retry waits BACKOFF_BASE seconds, +-20% jitter
+    assert next_attempt_at >= before + sms_queue.BACKOFF_BASE * 0.8
+    assert not queue.drain_once()
+
+    make_due(queue, message_id)
+    assert queue.drain_once()
+    assert row(queue, message_id)[:2] == ('sent', 2)
+    assert queue.client.messages.sent == [('+15550001', 'hello')]
+
+
+def test_gives_up_after_max_attempts(database, monkeypatch):
+    monkeypatch.setattr(sms_queue, 'MAX_ATTEMPTS', 2)
+    queue = make_queue(database, FlakyClient(failures=5))
+    message_id = queue.enqueue('+15550001', 'hello', '+15559999')
+
+    assert queue.drain_once()
+    make_due(queue, message_id)
+    assert queue.drain_once()
+    assert row(queue, message_id)[:2] == ('failed', 2)
+    assert queue.counts() == {'failed': 1}
+
+
+def test_rate_limit_is_per_sender_and_shared_through_the_database(database):
+    queue = make_queue(database, rate_per_second=0.5)
+    other_process = make_queue(database, rate_per_second=0.5)
+    queue.enqueue_many([('+15550001', 'a', '+15559999', None),
+                        ('+15550002', 'b', '+15559999', None),
+                        ('+15550003', 'c', '+15558888', None)])
+
+    assert queue.drain_once()
+    # Same sender: its next slot is 2 s away, for every queue on this database
+    assert other_process.drain_once()
+    assert not other_process.drain_once()
+    assert not queue.drain_once()
+    senders = sorted(m.from_ for m in queue.client.messages.sent + other_process.client.messages.sent)
+    assert senders == ['+15558888', '+15559999']
+
+
+def test_start_requeues_messages_left_sending(database):
+    queue = make_queue(database)
+    stale = queue.enqueue('+15550001', 'stale', '+15559999')
+    fresh = queue.enqueue('+15550002', 'fresh', '+15559999')
+    conn = queue._connection()
+    conn.execute("UPDATE outbound_messages SET status = 'sending', claimed_at = ? WHERE id = ?",
+                 (time.time() - sms_queue.STARTUP_SENDING_AGE - 1, stale))
+    conn.execute("UPDATE outbound_messages SET status = 'sending', claimed_at = ? WHERE id = ?",
+                 (time.time(), fresh))
+    conn.commit()
+
+    restarted = make_queue(database)
+    restarted.start()
+    assert row(restarted, stale)[0] == 'pending'
+    assert row(restarted, fresh)[0] == 'sending'   # May still be in flight in another process
+    restarted.stop()
+
+
+def test_outstanding_counts_only_given_keys_due_now(database):
+    queue = make_queue(database, FlakyClient(failures=1))
+    queue.enqueue_many([('+15550001', 'a', '+15559999', 'import:1'),
+                        ('+15550002', 'b', '+15559999', 'import:2'),
+                        ('+15550003', 'c', '+15559999', 'other:1')])
+    assert queue.outstanding(['import:1', 'import:2']) == 2
+
+    assert queue.drain_once()   # import:1 fails and backs off
+    assert queue.outstanding(['import:1', 'import:2']) == 1
@@ -0,0 +1,106 @@
+# test_state_store.py
+
+"""
+StateStore behaviour on FakeRedis and SQLite.
+
+    python -m pytest test_state_store.py
+"""
+
+import json
+
+import pytest
+
+from migrations import PROFILES_MIGRATIONS, migrate
+from records import UserState
+from state_store import FakeRedis, RedisStateBackend, SQLiteStateBackend, StateStore
+
+
+@pytest.fixture
+def redis_backend():
+    return RedisStateBackend(FakeRedis())
+
+
+@pytest.fixture
+def sqlite_backend(tmp_path):
+    database = str(tmp_path / 'profiles.db')
+    migrate(database, PROFILES_MIGRATIONS)
+    return SQLiteStateBackend(database)
+
+
+@pytest.fixture(params=['redis', 'sqlite'])
+def backend(request, redis_backend, sqlite_backend):
+    return redis_backend if request.param == 'redis' else sqlite_backend
+
+
+def test_update_creates_missing_row(backend):
+    store = StateStore(backend, cache_ttl=0)
+    row = store.update('+1555', {'current_step': 'AWAITING_GENDER', 'temp_profile_name': '1234'})
+
+    assert row == UserState('+1555', current_step='AWAITING_GENDER', temp_profile_name='1234')
+    assert backend.get('+1555') == row
+
+
+def test_update_changes_only_given_fields(backend):
+    store = StateStore(backend, cache_ttl=0)
+    store.update('+1555', {'current_step': 'AWAITING_CONFIRMATION', 'temp_pickup': 'A St',
+                           'temp_destination': 'B St', 'channel': 'SMS'})
+    store.update('+1555', {'current_step': 'AWAITING_NEW_PICKUP'})
+
+    assert store.get('+1555') == UserState('+1555', current_step='AWAITING_NEW_PICKUP', temp_pickup='A St',
+                                           temp_destination='B St', channel='SMS')
+
+
+def test_reads_with_cache_off_see_other_processes_writes(backend):
+    store = StateStore(backend, cache_ttl=0)
+    other_process = StateStore(backend, cache_ttl=0)
+    store.update('+1555', {'current_step': 'AWAITING_ZIP'})
+    assert store.get('+1555').current_step == 'AWAITING_ZIP'
+
+    other_process.update('+1555', {'current_step': 'AWAITING_RIDE_BOOKING'})
+    assert store.get('+1555').current_step == 'AWAITING_RIDE_BOOKING'
+    assert store.stats['hits'] == 0
+
+    other_process.delete('+1555')
+    assert store.get('+1555') is None
+
+
+def test_cache_on_serves_its_own_copy(redis_backend):
+    store = StateStore(redis_backend, cache_ttl=60)
+    other_process = StateStore(redis_backend, cache_ttl=0)
+    store.update('+1555', {'current_step': 'AWAITING_ZIP'})
+    other_process.update('+1555', {'current_step': 'AWAITING_RIDE_BOOKING'})
+
+    # Why the cache must stay off with several processes
+    assert store.get('+1555').current_step == 'AWAITING_ZIP'
+    store.invalidate('+1555')
+    assert store.get('+1555').current_step == 'AWAITING_RIDE_BOOKING'
+
+
+def test_write_behind_flushes_to_backend(backend):
+    store = StateStore(backend, cache_ttl=0, write_behind=True, flush_interval=3600)
+    store.update('+1555', {'current_step': 'AWAITING_ZIP'})
+    assert store.get('+1555').current_step == 'AWAITING_ZIP'   # Pending write is visible locally
+    assert backend.get('+1555') is None
+
+    store.flush()
+    assert backend.get('+1555').current_step == 'AWAITING_ZIP'
+
+
+def test_redis_rows_from_before_a_new_column_still_load(redis_backend):
+    old_row = ['+1555', 'RESOLVING', None, None, None, 'A St', 'B St', None, 'SMS']
+    redis_backend.client.set('user_state:+1555', json.dumps(old_row))
+
+    row = StateStore(redis_backend, cache_ttl=0).get('+1555')
+    assert row.current_step == 'RESOLVING'
+    assert row.resolving_started_at is None
+
+
+def test_fake_redis_expires_keys(monkeypatch):
+    client = FakeRedis()
+    now = [1000.0]
+    monkeypatch.setattr('state_store.time.time', lambda: now[0])
+    client.set('key', 'value', ex=10)
+    assert client.get('key') == 'value'
+
+    now[0] += 11
+    assert client.get('key') is None
@@ -0,0 +1,57 @@
+# test_travel_time.py
+
+"""
+Travel time batching against a fake Distance Matrix (no network).
+
+    python -m pytest test_travel_time.py
+"""
+
+import pytest
+
+import travel_time
+
+
+@pytest.fixture
+def requests(monkeypatch):
+    """Records each Distance Matrix request and answers every element with 'N mins'."""
+    seen = []
+
+    def get_json(url, params):
+        origins = params['origins'].split('|')
+        destinations = params['destinations'].split('|')
+        seen.append((origins, destinations))
+        return {'status': 'OK', 'rows': [
+            {'elements': [{'status': 'OK', 'duration': {'text': f'{len(d)} mins'}} for d in destinations]}
+            for _ in origins]}
+
+    monkeypatch.setattr(travel_time.http_client, 'get_json', get_json)
+    travel_time.clear_cache()
+    yield seen
+    travel_time.clear_cache()
+
+
+def test_one_request_per_origin_with_only_its_destinations(requests):
+    pairs = [('A St', 'Xx'), ('B St', 'Yyy'), ('A St', 'Zzzz'), ('B St', 'Xx')]
+
+    assert travel_time.get_travel_times(pairs) == [('2 mins', None), ('3 mins', None),
+                                                   ('4 mins', None), ('2 mins', None)]
+    assert requests == [(['A St'], ['Xx', 'Zzzz']), (['B St'], ['Yyy', 'Xx'])]
+
+
+def test_many_destinations_are_split(requests):
+    pairs = [('A St', f'D{i}') for i in range(travel_time.MAX_DESTINATIONS + 3)]
+    travel_time.get_travel_times(pairs)
+
+    assert [len(destinations) for _, destinations in requests] == [travel_time.MAX_DESTINATIONS, 3]
+
+
+def test_cached_pairs_skip_the_request(requests):
+    travel_time.get_travel_time('A St', 'Xx')
+    assert travel_time.get_travel_time('a st ', 'XX') == ('2 mins', None)
+    assert len(requests) == 1
+
+
+def test_addresses_with_separator_are_rejected(requests):
+    assert travel_time.get_travel_times([('A St|B St', 'Xx'), ('A St', 'Xx|Yy'), ('', 'Xx')]) == \
+        [(None, travel_time.ADDRESS_ERROR)] * 3
+    assert requests == []
@@ -0,0 +1,174 @@
+# travel_time.py
+
+"""
+Travel Time Service
+
+Memoizing front end for the Google Distance Matrix API.
+
+- Results are cached per (origin, destination, time bucket). Traffic-aware
+  durations drift over the day, so a cached value is only reused within the
+  same bucket (15 minutes by default) and evicted after TRAVEL_TIME_TTL.
+- Cache misses are grouped by origin: one Distance Matrix request per origin
+  with up to 25 of its destinations. The API bills every element of the
+  origins x destinations grid, so mixing origins in one request would pay
+  for pairs nobody asked for.
+- Addresses containing '|' (the API's list separator, which cannot be
+  escaped) are rejected with ADDRESS_ERROR instead of being sent.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import http_client
+
+# Configuration constants
+GOOGLE_MAPS_API_URL = os.getenv('GOOGLE_MAPS_API_URL', 'https://maps.googleapis.com/maps/api')
+DISTANCE_MATRIX_URL = f"{GOOGLE_MAPS_API_URL}/distancematrix/json"
+TIME_BUCKET_SECONDS = int(os.getenv('TRAVEL_TIME_BUCKET', '900'))
+TRAVEL_TIME_TTL = int(os.getenv('TRAVEL_TIME_TTL', '1800'))
+MAX_CACHE_ENTRIES = int(os.getenv('TRAVEL_TIME_CACHE_SIZE', '4096'))
+
+# Distance Matrix request limit
+MAX_DESTINATIONS = 25
+
+ADDRESS_ERROR = "Error calculating travel time. Please check your addresses."
+SERVICE_ERROR = "Error calculating travel time. Please try again shortly."
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+stats = {'hits': 0, 'misses': 0, 'requests': 0}
+
+
+def _cache_key(origin, destination, now):
+    return (origin or '').strip().lower(), (destination or '').strip().lower(), int(now // TIME_BUCKET_SECONDS)
+
+
+def _cache_get(key, now):
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= now:
+            del _cache[key]
+            return None
+        _cache.move_to_end(key)
+        return entry[1]
+
+
+def _cache_put(key, duration, now):
+    with _cache_lock:
+        _cache[key] = (now + TRAVEL_TIME_TTL, duration)
+        _cache.move_to_end(key)
+        while len(_cache) > MAX_CACHE_ENTRIES:
+            _cache.popitem(last=False)
+
+
+def clear_cache():
+    """Drop every cached travel time."""
+    with _cache_lock:
+        _cache.clear()
+
+
+def plan_batches(pairs):
+    """
+    Group (origin, destination) pairs into one Distance Matrix request per origin.
+
+    An origin with more than MAX_DESTINATIONS destinations is split over
+    several requests. Order of first appearance is kept.
+
+    Returns:
+        list: [(origin, destinations)] with destinations as an ordered list
+    """
+    by_origin = {}
+    for origin, destination in pairs:
+        destinations = by_origin.setdefault(origin, [])
+        if destination not in destinations:
+            destinations.append(destination)
+
+    return [(origin, destinations[i:i + MAX_DESTINATIONS])
+            for origin, destinations in by_origin.items()
+            for i in range(0, len(destinations), MAX_DESTINATIONS)]
+
+
+def _fetch_batch(origin, destinations):
+    """
+    Run one Distance Matrix request for a single origin.
+
+    Returns:
+        dict: {(origin, destination): (duration, error)}
+    """
+    params = {
+        'origins': origin,
+        'destinations': '|'.join(destinations),
+        'key': os.getenv('GEOCODING_API_KEY'),
+    }
+    stats['requests'] += 1
+    try:
+        response = http_client.get_json(DISTANCE_MATRIX_URL, params)
+    except Exception as e:
+        print(f"Distance Matrix error: {e}")
+        return {(origin, destination): (None, SERVICE_ERROR) for destination in destinations}
+
+    if response.get('status') != 'OK':
+        print(f"Distance Matrix status: {response.get('status')}")
+        return {(origin, destination): (None, ADDRESS_ERROR) for destination in destinations}
+
+    results = {(origin, destination): (None, ADDRESS_ERROR) for destination in destinations}
+    for destination, element in zip(destinations, response['rows'][0]['elements']):
+        if element.get('status') == 'OK':
+            results[(origin, destination)] = (element['duration']['text'], None)
+    return results
+
+
+def get_travel_times(pairs):
+    """
+    Travel times for many (origin, destination) pairs.
+
+    Cached pairs are answered locally; the rest are fetched with one
+    Distance Matrix request per origin.
+
+    Returns:
+        list: (duration_text, error) tuples in the same order as pairs
+    """
+    pairs = list(pairs)
+    now = time.time()
+    results = {}
+    missing = []
+    seen = set()
+
+    for pair in pairs:
+        if pair in seen:
+            continue
+        seen.add(pair)
+        if not pair[0] or not pair[1] or '|' in pair[0] or '|' in pair[1]:
+            # Missing address (e.g. state lost its pickup) or one that would split
+            # into several in the request, nothing to look up
+            results[pair] = (None, ADDRESS_ERROR)
+            continue
+        duration = _cache_get(_cache_key(*pair, now), now)
+        if duration is not None:
+            stats['hits'] += 1
+            results[pair] = (duration, None)
+        else:
+            stats['misses'] += 1
+            missing.append(pair)
+
+    for origin, destinations in plan_batches(missing):
+        for pair, (duration, error) in _fetch_batch(origin, destinations).items():
+            if duration is not None:
+                _cache_put(_cache_key(*pair, now), duration, now)
+            results[pair] = (duration, error)
+
+    return [results[pair] for pair in pairs]
+
+
+def get_travel_time(origin, destination):
+    """
+    Travel time for a single pair.
+
+    Returns:
+        tuple: (duration_text, None) on success, (None, error_message) otherwise
+    """
+    return get_travel_times([(origin, destination)])[0]
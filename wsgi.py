@@ -0,0 +1,46 @@
+# wsgi.py
+
+"""
+Production Entry Point
+
+Serves the driver registration routes and the passenger SMS / WhatsApp /
+IVR webhooks from one app built by app_factory.create_app(), under a
+multi-process server instead of the Flask debug server:
+
+    gunicorn -c gunicorn.conf.py wsgi:application
+
+gunicorn.conf.py sets preload_app, so this module is imported once in the
+master process: schema migrations run once (when the blueprints are
+registered), and the ZIP centroid, address, license and driver indexes are
+loaded once and shared with the forked workers copy-on-write. Per-process
+resources (SQLite connections, HTTP sessions, the Twilio client) are
+created lazily in each worker, see db_pool.py, http_client.py and
+services.py; the outbound SMS workers are started by the post_fork hook in
+gunicorn.conf.py.
+"""
+
+import address_index
+import app as driver_registration
+import db_pool
+import zip_centroids
+from app_factory import create_app
+
+application = create_app()
+
+
+def preload():
+    """
+    One-time startup work, run before workers fork.
+
+    Loading is idempotent, so running this again, e.g. without preload_app,
+    is harmless.
+    """
+    zip_centroids.get_index()
+    address_index.get_index()
+    driver_registration.license_registry.refresh()
+    driver_registration.get_driver_index()
+    # Connections must not cross fork; workers open their own
+    db_pool.close_connections()
+
+
+preload()
@@ -0,0 +1,160 @@
+# zip_centroids.py
+
+"""
+Offline ZIP Code Centroid Index
+
+Answers "where is this ZIP code?" without calling the Geocoding API.
+Centroids are read once from a CSV file and kept in two flat float arrays
+(4 bytes per coordinate) plus a dict from ZIP code to array slot, so the
+full US ZCTA set (~34k ZIPs) costs well under a megabyte and every lookup
+is a single dict access.
+
+Accepted input formats:
+- zip_centroids.csv with a header row: zip,lat,lng
+- the US Census Gazetteer ZCTA file (tab separated, GEOID/INTPTLAT/INTPTLONG)
+
+Building the bundled CSV from the Census file:
+    python zip_centroids.py build 2020_Gaz_zcta_national.txt
+"""
+
+import csv
+import os
+import sys
+import threading
+from array import array
+
+# Path of the centroid file, relative to the working directory
+CENTROIDS_FILE = os.getenv('ZIP_CENTROIDS_CSV', 'zip_centroids.csv')
+
+# Header names recognised for each column
+ZIP_COLUMNS = ('zip', 'zip_code', 'zipcode', 'geoid')
+LAT_COLUMNS = ('lat', 'latitude', 'intptlat')
+LNG_COLUMNS = ('lng', 'lon', 'longitude', 'intptlong')
+
+
+def _column_index(header, candidates):
+    for i, name in enumerate(header):
+        if name.strip().lower() in candidates:
+            return i
+    raise ValueError(f"Missing column, expected one of {candidates}")
+
+
+def read_centroid_rows(path):
+    """
+    Stream (zip_code, lat, lng) tuples from a centroid CSV or Gazetteer file.
+
+    Rows with unparsable coordinates are skipped.
+    """
+    with open(path, newline='', encoding='utf-8') as f:
+        first_line = f.readline()
+        delimiter = '\t' if '\t' in first_line else ','
+        header = next(csv.reader([first_line], delimiter=delimiter))
+        zip_i = _column_index(header, ZIP_COLUMNS)
+        lat_i = _column_index(header, LAT_COLUMNS)
+        lng_i = _column_index(header, LNG_COLUMNS)
+
+        for row in csv.reader(f, delimiter=delimiter):
+            try:
+                yield row[zip_i].strip().zfill(5), float(row[lat_i]), float(row[lng_i])
+            except (IndexError, ValueError):
+                continue
+
+
+class ZipCentroidIndex:
+    """
+    Array-backed lookup table of ZIP code centroids.
+
+    Args:
+        rows (iterable): (zip_code, lat, lng) tuples
+    """
+
+    def __init__(self, rows=()):
+        self._slots = {}
+        self._lat = array('f')
+        self._lng = array('f')
+        for zip_code, lat, lng in rows:
+            self.add(zip_code, lat, lng)
+
+    @classmethod
+    def from_file(cls, path):
+        """Load an index from disk, returning an empty index if the file is missing."""
+        if not os.path.exists(path):
+            print(f"ZIP centroid file {path} not found, falling back to geocoding")
+            return cls()
+        return cls(read_centroid_rows(path))
+
+    def add(self, zip_code, lat, lng):
+        """Insert or overwrite a single centroid."""
+        slot = self._slots.get(zip_code)
+        if slot is None:
+            self._slots[zip_code] = len(self._lat)
+            self._lat.append(lat)
+            self._lng.append(lng)
+        else:
+            self._lat[slot] = lat
+            self._lng[slot] = lng
+
+    def get(self, zip_code):
+        """
+        Look up a ZIP centroid.
+
+        Returns:
+            dict or None: {'lat': float, 'lng': float} in the Geocoding API
+            location format, or None if the ZIP is unknown
+        """
+        slot = self._slots.get(str(zip_code).strip())
+        if slot is None:
+            return None
+        return {'lat': self._lat[slot], 'lng': self._lng[slot]}
+
+    def __contains__(self, zip_code):
+        return str(zip_code).strip() in self._slots
+
+    def __len__(self):
+        return len(self._lat)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """Return the process-wide index, loading it from CENTROIDS_FILE on first use."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = ZipCentroidIndex.from_file(CENTROIDS_FILE)
+    return _index
+
+
+def zip_centroid(zip_code):
+    """Shortcut for get_index().get(zip_code)."""
+    if not zip_code:
+        return None
+    return get_index().get(zip_code)
+
+
+def build_csv(source_path, output_path=CENTROIDS_FILE):
+    """
+    Convert a Gazetteer (or any accepted) file into the compact zip,lat,lng CSV.
+
+    Returns:
+        int: Number of centroids written
+    """
+    count = 0
+    with open(output_path, 'w', newline='', encoding='utf-8') as out:
+        writer = csv.writer(out)
+        writer.writerow(['zip', 'lat', 'lng'])
+        for zip_code, lat, lng in read_centroid_rows(source_path):
+            writer.writerow([zip_code, f"{lat:.6f}", f"{lng:.6f}"])
+            count += 1
+    return count
+
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 3 and sys.argv[1] == 'build':
+        output = sys.argv[3] if len(sys.argv) > 3 else CENTROIDS_FILE
+        print(f"Wrote {build_csv(sys.argv[2], output)} centroids to {output}")
+    else:
+        print("Usage: python zip_centroids.py build <gazetteer_file> [output_csv]")